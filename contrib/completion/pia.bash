@@ -0,0 +1,56 @@
+# bash completion for pia
+#
+# Host names are read from the index pia writes whenever the host list changes, so completing
+# does not start Python. Install as /usr/share/bash-completion/completions/pia.
+
+_pia_index=/var/lib/pia/names.txt
+
+_pia() {
+    local cur=${COMP_WORDS[COMP_CWORD]} prev=${COMP_WORDS[COMP_CWORD-1]}
+    local strategies='cm nm nmwg openvpn wg nft'
+    local name names=()
+    COMPREPLY=()
+
+    case $prev in
+        -e|--exclude|--strategy)
+            COMPREPLY=($(compgen -W "$strategies" -- "$cur"))
+            return ;;
+        --format)
+            COMPREPLY=($(compgen -W 'text json tsv' -- "$cur"))
+            return ;;
+        --log-format)
+            COMPREPLY=($(compgen -W 'text json' -- "$cur"))
+            return ;;
+        --root)
+            COMPREPLY=($(compgen -d -- "$cur"))
+            return ;;
+        --roots-from|--export|--import)
+            COMPREPLY=($(compgen -f -- "$cur"))
+            return ;;
+        --near|--count|--match|--country)
+            return ;;
+    esac
+
+    if [[ $cur == -* ]]; then
+        COMPREPLY=($(compgen -W '-a --auto-configure --auto-port --near --count --lazy
+            -r --remove-configurations -l --list-configurations --format --match --country
+            --strategy --installed-only --verify --repair --export --import --root --roots-from
+            -e --exclude -d --debug --log-format -h --help --version' -- "$cur"))
+        return
+    fi
+
+    if [[ $COMP_CWORD -eq 1 ]]; then
+        COMPREPLY=($(compgen -W 'monitor forward connect refresh' -- "$cur"))
+    fi
+
+    [[ -r $_pia_index ]] || return
+    mapfile -t names < "$_pia_index"
+
+    cur=${cur//[\'\"]/}
+    cur=${cur// /_}
+    for name in "${names[@]}"; do
+        [[ $name != \#* && ${name,,} == "${cur,,}"* ]] && COMPREPLY+=("$name")
+    done
+}
+
+complete -F _pia pia
@@ -0,0 +1,41 @@
+# fish completion for pia
+#
+# Host names are read from the index pia writes whenever the host list changes, so completing
+# does not start Python. Install as ~/.config/fish/completions/pia.fish.
+
+function __pia_hosts
+    test -r /var/lib/pia/names.txt; or return
+    string match -v -- '#*' </var/lib/pia/names.txt
+end
+
+set -l strategies cm nm nmwg openvpn wg nft
+
+complete -c pia -f -a '(__pia_hosts)'
+complete -c pia -f -n __fish_use_subcommand -a monitor -d 'Watch running OpenVPN profiles'
+complete -c pia -f -n __fish_use_subcommand -a forward -d 'Keep ports forwarded'
+complete -c pia -f -n __fish_use_subcommand -a connect -d 'Create and start one host'
+complete -c pia -f -n __fish_use_subcommand -a refresh -d 'Look up the kill-switch endpoints again'
+
+complete -c pia -s a -l auto-configure -d 'Generate configurations'
+complete -c pia -l auto-port -d 'Probe which port works best on this network'
+complete -c pia -x -l near -d 'Only configure the hosts closest to LAT,LON'
+complete -c pia -x -l count -d 'Number of hosts picked by --near'
+complete -c pia -l lazy -d 'Only record the hosts, for pia connect'
+complete -c pia -s r -l remove-configurations -d 'Remove generated configurations'
+complete -c pia -s l -l list-configurations -d 'List known hosts'
+complete -c pia -x -l format -a 'text json tsv' -d 'Output of -l'
+complete -c pia -x -l match -d 'Only list hosts matching a pattern'
+complete -c pia -x -l country -d 'Only list hosts in these countries'
+complete -c pia -x -l strategy -a "$strategies" -d 'Applications to list or connect with'
+complete -c pia -l installed-only -d 'Only list hosts which have configurations'
+complete -c pia -l verify -d 'Report configurations which changed'
+complete -c pia -l repair -d 'Rewrite the configurations reported by --verify'
+complete -c pia -r -l export -d 'Render configurations into a bundle'
+complete -c pia -r -l import -d 'Install configurations from a bundle'
+complete -c pia -x -l root -a '(__fish_complete_directories)' -d 'Generate into another root filesystem'
+complete -c pia -r -l roots-from -d 'Generate into every root filesystem listed in a file'
+complete -c pia -x -s e -l exclude -a "$strategies" -d 'Exclude applications'
+complete -c pia -s d -l debug -d 'Enable debug logging'
+complete -c pia -x -l log-format -a 'text json' -d 'Log format'
+complete -c pia -s h -l help -d 'Show help'
+complete -c pia -l version -d 'Show version'
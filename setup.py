@@ -62,6 +62,7 @@ setup(
 
     packages=find_packages('src', exclude=['contrib', 'docs', 'tests*']),
     package_dir={'': 'src'},
+    py_modules=['pia_complete'],
     package_data={'pia.applications': ['template-configs/*.cfg']},
 
     install_requires = [
@@ -71,11 +72,14 @@ setup(
     extras_require={
         'dev': ['check-manifest'],
         'test': ['coverage'],
+        'zstd': ['zstandard'],
+        'geo': ['numpy'],
     },
 
     entry_points={
         'console_scripts': [
             'pia=pia.command_line:main',
+            'pia-complete=pia_complete:main',
         ],
     },
 )
@@ -17,4 +17,5 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from .appstrategy import StrategicAlternative, Application
-from .hooks import ApplicationStrategyOPENVPN, ApplicationStrategyCM, ApplicationStrategyNM
+from .hooks import ApplicationStrategyOPENVPN, ApplicationStrategyCM, ApplicationStrategyNM, \
+    ApplicationStrategyWG, ApplicationStrategyNMWG
@@ -18,7 +18,7 @@
 import inspect
 import logging
 import os
-import shutil
+import stat
 from re import findall, escape
 import sys
 import warnings
@@ -29,12 +29,22 @@ import pia
 import importlib
 from pkg_resources import resource_string
 
-from pia.conf import properties
-from pia.utils.misc import multiple_replace
+from pia.conf import properties, settings
+from pia.conf.manifest import manifest
+from pia.utils.misc import atomic_write, batched, multiple_replace, content_digest, lookup_owner, rooted
 
 logger = logging.getLogger(__name__)
 
 
+# Hosts prepared at once when configurations are checked or exported
+PREPARE_BATCH = 64
+
+
+class RenderError(Exception):
+    """Raised by a strategy when a configuration cannot be rendered (i.e. a failed key exchange)"""
+    pass
+
+
 class Application(object):
     """Creates class to hold public API for different applications.
 
@@ -89,41 +99,80 @@ class Application(object):
     def remove_configs(self):
         """Removes all configurations for a strategy
 
+        Files recorded in the manifest for this strategy are removed. Files the manifest does not
+        track (i.e. generated by an older version) are removed too if they are in the configuration
+        directory and match known host names, or are the one file of strategies which write a single
+        file.
+
         Raises:
             OSError: Throws if config cannot be removed
             FileNotFoundError: Thrown if the configuration directory doesn't exists
 
         """
+        owned = manifest.by_strategy(self.strategy)
+        self.app.cleanup()
 
-        hosts = [re.sub(' ', '_', h) for h in properties.get_default_hosts_list(names_only=True)]
+        for path in owned:
+            self.remove_config(path)
+
+        hosts = [r.stem for r in properties.iter_hosts()]
         conf_dir = self.app.conf_dir
 
         cdir = []
 
         try:
-            cdir = os.listdir(conf_dir)
+            cdir = os.listdir(rooted(conf_dir))
         except FileNotFoundError:
             pass
 
+        # Strategies writing one file for every host (i.e. consolidated connman) own that file too
+        if not self.app.per_host:
+            hosts.append(os.path.basename(self.app.conf_path()))
+
         if hosts:
             regex = re.compile("(%s)" % "|".join(map(escape, hosts)))
             cdir = [d for d in cdir if regex.match(d)]
 
+        # Files tracked for other strategies sharing the directory are theirs to remove
+        cdir = [d for d in cdir if manifest.get(os.path.join(conf_dir, d)) is None]
+
         try:
             for f in cdir:
-                path = os.path.join(conf_dir, f)
+                path = os.path.join(rooted(conf_dir), f)
                 os.remove(path)
         except OSError:
             pass
 
+    def remove_config(self, path):
+        """Removes one generated configuration and its manifest entry
+
+        Args:
+            path: full path of the configuration file
+
+        Returns:
+            False if the file could not be removed
+        """
+        try:
+            os.remove(rooted(path))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            warnings.warn("Cannot remove %s." % path)
+            return False
+
+        manifest.forget(path)
+        return True
+
     def is_installed(self):
-        """Checks to see if application for a strategy is installed"""
+        """Checks to see if application for a strategy is installed (every file in command_bin exists)"""
         installed = None
         for command in self.app.command_bin:
             try:
-                installed = os.access(command, os.F_OK)
+                installed = os.access(rooted(command), os.F_OK)
             except OSError:
                 installed = False
+            if not installed:
+                break
         return installed
 
     def find_config(self, config_id):
@@ -137,6 +186,44 @@ class Application(object):
         """
         return self.app.find_config(config_id)
 
+    @property
+    def capabilities(self):
+        """Features supported by the installed application (see StrategicAlternative.probe())"""
+        return self.app.capabilities
+
+    def installed_configs(self):
+        """Finds all installed configurations for a strategy
+
+        Returns:
+            A set of configuration names (i.e. "US East") which are installed
+        """
+        return self.app.installed_configs()
+
+    def find_drift(self, config_ids):
+        """Compares rendered configurations against the files on disk
+
+        Args:
+            config_ids: list of configuration names to check
+
+        Returns:
+            A list of (remote, conf, text, reasons) tuples for each configuration which differs
+        """
+        return self.app.find_drift(config_ids)
+
+    def commit(self, conf, text, config_id=None, port=None):
+        """Writes a rendered configuration file
+
+        Args:
+            conf: a string which is the full path to the configuration file to create
+            text: contents of the configuration file
+            config_id: the name of the profile (i.e. "US East") or the Remote the file was generated for
+            port: port the file was generated for (defaults to the configured port)
+
+        Returns:
+            False if the file could not be written
+        """
+        return self.app.commit(conf, text, config_id, port)
+
 
 def build_strategy(strategy):
     """Creates an application options with strategy
@@ -200,13 +287,14 @@ def check_apps():
     Gets a list of supported applications and builds the application objects.
     Checks to see if the application is installed using the Application.is_installed()
     method. All applications installed are automatically set to be configured unless '-e' is
-    given when running the application.
+    given when running the application. Opt-in applications (i.e. the kill-switch) must be
+    enabled in pia.conf as well.
 
     """
     apps = get_supported_apps()
     for app in apps:
         a = build_strategy(app)
-        a.configure = a.is_installed()
+        a.configure = a.is_installed() and not a.app.opt_in
         pia.conf.properties.props.__dict__[app] = a
 
 
@@ -243,21 +331,35 @@ class StrategicAlternative(object):
             _conf_dir = '/var/lib/configdir'
             _command_bin = ['/usr/bin/example-app']
 
-            def config(self, config_id, filename, enable=None):
-                #You must create your own function to update the configuration files.
-                #By default, each class creates a 're_dict' to hold a directory of replacement files
-                #and calls self.update_config() to update the configuration
-                pass
+            def get_re_dict(self, config_id):
+                #You must create your own function to build the replacement values.
+                #Each class returns a 're_dict' to hold a directory of replacement values
+                #which render() applies to the configuration template
+                return {}
+
+    Strategies which write one file for all hosts (i.e. a firewall ruleset) set _PER_HOST to
+    False. They collect hosts in prepare() and write their file in finish() instead of having
+    each host rendered.
 
     Attributes:
         @command_bin: list containing which files to check if the application is installed
         @conf_dir: directory to the application stores it's configurations
         @strategy: name of which strategy created this class
         @config_template: location of the application's config_template
+        @per_host: True if the strategy writes one configuration per host
+        @opt_in: True if the strategy is only configured when enabled in pia.conf
 
     """
     _CONF_DIR = ''
+    _CONF_EXT = ''
+    _CONF_MODE = 0o600
+    _CONF_OWNER = 'root'
+    _CONF_GROUP = 'network'
     _COMMAND_BIN = []
+    _TUNING_KEYS = {}
+    _TUNING_FORMAT = '%s=%s'
+    _PER_HOST = True
+    _OPT_IN = False
 
     @property
     def command_bin(self):
@@ -279,18 +381,140 @@ class StrategicAlternative(object):
         """name of which strategy created this class"""
         return self._strategy
 
+    @property
+    def per_host(self):
+        """True if the strategy writes one configuration per host"""
+        return self._PER_HOST
+
+    @property
+    def opt_in(self):
+        """True if the strategy is only configured when enabled in pia.conf"""
+        return self._OPT_IN
+
+    @property
+    def template_version(self):
+        """short digest of the config_template, used to tell which template rendered a file"""
+        return content_digest(self.config_template or '')[:12]
+
+    @property
+    def capabilities(self):
+        """features supported by the installed application, probed on first use"""
+        if self._capabilities is None:
+            self._capabilities = self.probe()
+        return self._capabilities
+
+    @property
+    def conf_owner(self):
+        """uid and gid configuration files should be owned by (None when the user or group is unknown)
+
+        Names are resolved in the root filesystem being configured (see settings.PIA_ROOT).
+        """
+        return lookup_owner(settings.PIA_ROOT, self._CONF_OWNER, self._CONF_GROUP)
+
     def __init__(self, strategy):
         self._strategy = strategy
+        self._capabilities = None
         self._CONFIG_TEMPLATE = self.get_config_template()
 
     def __repr__(self):
         return '<%s %s:%s>' % ('StrategicAlternative.' + type(self).__name__, 'strategy', self._strategy)
 
     def config(self, config_id):
-        """Implemented in the subclass to modify configuration template for each VPN endpoint"""
+        """Configures configuration file for the given strategy.
+
+        Args:
+            config_id: the name of the profile (i.e. "US East") or its Remote(name, fqdn)
+        """
+        remote = self.get_remote(config_id)
+        conf, text = self.render(remote)
+        self.commit(conf, text, remote)
+
+    @staticmethod
+    def get_remote(config_id):
+        """Returns the Remote(name, fqdn) for config_id, looking up names in the host list"""
+        if isinstance(config_id, properties.Remote):
+            return config_id
+        return properties.get_remote(config_id)
+
+    def get_re_dict(self, remote):
+        """Implemented in the subclass to build the replacement values for each VPN endpoint"""
+        return {}
+
+    def prepare(self, remotes):
+        """Implemented in the subclass to do work for a batch of hosts before they are rendered
+
+        Strategies which need network requests per host (i.e. key exchanges) should do them
+        here, concurrently, instead of one at a time in get_re_dict().
+
+        Args:
+            remotes: list of Remote(name, fqdn) about to be rendered
+        """
         pass
 
-    def update_config(self, re_dict, conf):
+    def finish(self):
+        """Implemented in the subclass to write files which cover every host, after all batches"""
+        pass
+
+    def cleanup(self):
+        """Implemented in the subclass to undo anything besides files when configurations are removed"""
+        pass
+
+    def is_active(self, config_id):
+        """Implemented in the subclass to check if the tunnel of config_id is running
+
+        Returns:
+            False unless the application can tell that the tunnel is running
+        """
+        return False
+
+    def probe(self):
+        """Implemented in the subclass to find which features the installed application supports
+
+        Returns:
+            A dictionary of capabilities. Probing should be cheap or cached (see pia.applications.probe)
+        """
+        return {}
+
+    def format_tuning(self, tuning):
+        """Formats tuning settings for the '##tuning##' line of the configuration template
+
+        Only the settings named in _TUNING_KEYS are supported by a strategy. Each one is written
+        on its own line with _TUNING_FORMAT, so no settings leave the template unchanged.
+
+        Args:
+            tuning: dictionary of tuning settings (i.e. properties.props.tuning)
+
+        Returns:
+            A string of lines to replace '##tuning##' with
+        """
+        return '\n'.join(self._TUNING_FORMAT % (name, tuning[key])
+                         for key, name in self._TUNING_KEYS.items() if tuning.get(key))
+
+    def render(self, config_id):
+        """Renders the configuration file for config_id in memory
+
+        Args:
+            config_id: the name of the profile (i.e. "US East") or its Remote(name, fqdn)
+
+        Returns:
+            A tuple of the full path to the configuration file and its contents
+        """
+        remote = self.get_remote(config_id)
+        return remote.path(self), self.fill_template(self.get_re_dict(remote))
+
+    def fill_template(self, re_dict):
+        """Replaces the placeholders of the configuration template with re_dict
+
+        Placeholders on a line of their own which have no value leave no blank line behind.
+        """
+        template = self.config_template
+
+        for key in [k for k, v in re_dict.items() if v == '']:
+            template = template.replace('\n' + key + '\n', '\n')
+
+        return multiple_replace(re_dict, template) if re_dict else template
+
+    def update_config(self, re_dict, conf, config_id=None):
         """Modifies configuration file with dictionary
 
         You must create a dictionary to do a single pass, multi-replacement on each configuration.
@@ -304,23 +528,52 @@ class StrategicAlternative(object):
         Args:
             re_dict: dictionary to replace values in the configuration files
             conf: a string which is the full path to the configuration file to create
+            config_id: the name of the profile (i.e. "US East") or the Remote the file was generated for
+        """
+        self.commit(conf, multiple_replace(re_dict, self.config_template), config_id)
+
+    def commit(self, conf, text, config_id=None, port=None):
+        """Writes a rendered configuration file
+
+        The file is replaced in a single step, its permissions and ownership are set and
+        it is recorded in the manifest. A missing configuration directory is created (i.e. in a
+        fresh root filesystem).
+
+        Args:
+            conf: a string which is the full path to the configuration file to create
+            text: contents of the configuration file
+            config_id: the name of the profile (i.e. "US East") or the Remote the file was generated for
+            port: port the file was generated for (defaults to the configured port)
+
+        Returns:
+            False if the file could not be written
 
         Raises:
             OSError: problems trying to write or change permissions on config files.
         """
+        path = rooted(conf)
+
         try:
-            with open(conf, "w") as c:
-                c.write(multiple_replace(re_dict, self.config_template))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            atomic_write(path, text, self._CONF_MODE)  # Sets permissions to Read, Write, to Owner only.
         except OSError:
-            warnings.warn("Cannot access %s." % conf)
+            warnings.warn("Cannot access %s." % path)
+            return False
+
+        uid, gid = self.conf_owner
 
         try:
-            logger.debug('Changing permission on %s.' % conf)
-            os.chmod(conf, 0o600)  # Sets permissions to Read, Write, to Owner only.
-            shutil.chown(conf, "root", "network")  # Sets ownership to root:root (uid 0).
-            logger.debug('Changing permission on %s was successful.' % conf)
-        except OSError:
-            warnings.warn("Cannot change permissions on %s." % conf)
+            logger.debug('Changing ownership on %s.', path)
+            if uid is None or gid is None:
+                raise LookupError('%s:%s' % (self._CONF_OWNER, self._CONF_GROUP))
+            os.chown(path, uid, gid)
+            logger.debug('Changing ownership on %s was successful.', path)
+        except (OSError, LookupError):
+            warnings.warn("Cannot change permissions on %s." % path)
+
+        host = config_id.name if isinstance(config_id, properties.Remote) else config_id or ''
+        manifest.record(conf, self.strategy, host, port or properties.props.port, text, self.template_version)
+        return True
 
     def get_config_template(self):
         """Loads the config template file.
@@ -339,6 +592,23 @@ class StrategicAlternative(object):
                 logger.warning("Cannot load template file: %s" % 'template-configs/' + self.strategy + '.cfg')
             return None
 
+    def conf_path(self, config_id):
+        """Returns the full path of the configuration file for config_id
+
+        Use Remote.path() for hosts from the host list, which computes this once per strategy.
+
+        Args:
+            config_id: the name of the profile (i.e. "US East") or its Remote
+        """
+        return self.conf_dir + '/' + self.stem(config_id) + self._CONF_EXT
+
+    @staticmethod
+    def stem(config_id):
+        """Returns the file name stem for config_id (i.e. "US_East" for "US East")"""
+        if isinstance(config_id, properties.Remote):
+            return config_id.stem
+        return properties.to_stem(config_id)
+
     def find_config(self, config_id):
         """Find if a configuration is configured
 
@@ -348,9 +618,102 @@ class StrategicAlternative(object):
         Returns:
             Returns bool depending on if the configuration is already installed
         """
-        os_access = os.access(self.conf_dir + '/' + re.sub(' ', '_', config_id), os.F_OK)
+        return os.access(rooted(self.conf_path(config_id)), os.F_OK)
+
+    def installed_configs(self):
+        """Finds all installed configurations with a single scan of conf_dir
+
+        Files recorded in the manifest are matched against the directory listing. If nothing
+        has been recorded for this strategy, the file name of each known host is used instead.
+
+        Returns:
+            A set of configuration names (i.e. "US East") which are installed
+        """
+        try:
+            with os.scandir(rooted(self.conf_dir)) as it:
+                names = {entry.name for entry in it}
+        except (FileNotFoundError, NotADirectoryError):
+            return set()
+
+        owned = manifest.by_strategy(self.strategy)
+
+        if owned:
+            return {e['host'] for p, e in owned.items() if os.path.basename(p) in names}
+
+        return {r.name for r in properties.iter_hosts() if os.path.basename(r.path(self)) in names}
+
+    def find_drift(self, config_ids):
+        """Compares rendered configurations against the files on disk
+
+        The configuration directory is scanned once. A file is only read when its size
+        matches the rendered configuration, so clean files cost a single stat. Hosts are
+        prepared in batches first, so they render the same as when they were written.
+
+        Args:
+            config_ids: iterable of configuration names or Remote(name, fqdn) to check
+
+        Returns:
+            A list of (remote, conf, text, reasons) tuples for each configuration which differs
+            from what would be generated. reasons lists any of 'missing', 'content', 'mode' or 'owner'.
+        """
+        try:
+            with os.scandir(rooted(self.conf_dir)) as it:
+                entries = {entry.name: entry for entry in it}
+        except (FileNotFoundError, NotADirectoryError):
+            entries = {}
+
+        uid, gid = self.conf_owner
+        drift = []
+
+        for batch in batched((self.get_remote(c) for c in config_ids), PREPARE_BATCH):
+            self.prepare(batch)
+
+            for remote in batch:
+                try:
+                    conf, text = self.render(remote)
+                except RenderError as e:
+                    logger.warning('Cannot check %s for %s: %s', remote.name, self.strategy, e)
+                    continue
+
+                entry = entries.get(os.path.basename(conf))
+
+                if entry is None:
+                    drift.append((remote, conf, text, ['missing']))
+                    continue
+
+                reasons = self.compare(conf, text, entry.stat(follow_symlinks=False), uid, gid)
+                if reasons:
+                    drift.append((remote, conf, text, reasons))
+
+        return drift
+
+    def compare(self, conf, text, st, uid=None, gid=None):
+        """Compares a file on disk against the contents, permissions and ownership it should have
+
+        Args:
+            conf: full path to the configuration file
+            text: contents the file should have
+            st: os.stat_result of conf
+            uid: user id which should own the file (not checked if None)
+            gid: group id which should own the file (not checked if None)
+
+        Returns:
+            A list containing any of 'content', 'mode' or 'owner'
+        """
+        reasons = []
+        data = text.encode()
+
+        if not stat.S_ISREG(st.st_mode) or st.st_size != len(data):
+            reasons.append('content')
+        else:
+            with open(rooted(conf), 'rb') as f:
+                if f.read() != data:
+                    reasons.append('content')
+
+        if stat.S_IMODE(st.st_mode) != self._CONF_MODE:
+            reasons.append('mode')
 
-        if not os_access:
-            os_access = os.access(self.conf_dir + '/' + re.sub(' ', '_', config_id) + '.conf', os.F_OK)
+        if (uid is not None and st.st_uid != uid) or (gid is not None and st.st_gid != gid):
+            reasons.append('owner')
 
-        return os_access
+        return reasons
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+#    Private Internet Access Configuration auto-configures VPN files for PIA
+#    Copyright (C) 2016  Jesse Spangenberger <azulephoenix[at]gmail[dot]com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import gzip
+import io
+import json
+import logging
+import os
+import posixpath
+import tarfile
+import tempfile
+from contextlib import contextmanager
+
+from pia.applications.appstrategy import PREPARE_BATCH, RenderError, StrategicAlternative
+from pia.conf import properties
+from pia.utils.misc import batched, content_digest, rooted
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_MANIFEST = 'MANIFEST.json'
+BUNDLE_VERSION = 1
+
+# Fields of each manifest entry and the types they may have
+ENTRY_FIELDS = {'strategy': str, 'host': str, 'port': (str, int), 'template': str, 'digest': str}
+
+
+class BundleError(Exception):
+    """Raised when a bundle cannot be read or does not match its manifest"""
+    pass
+
+
+def _compression(filepath):
+    """Returns the compression used for a bundle based on its file extension"""
+    for ext, comp in (('.tar.zst', 'zst'), ('.tzst', 'zst'), ('.tar.gz', 'gz'), ('.tgz', 'gz'),
+                      ('.tar.xz', 'xz'), ('.txz', 'xz'), ('.tar.bz2', 'bz2')):
+        if filepath.endswith(ext):
+            return comp
+    return ''
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise BundleError('zstandard is required for .tar.zst bundles (pip install pia[zstd])')
+    return zstandard
+
+
+@contextmanager
+def _replacing(filepath):
+    """Opens a temporary file which replaces filepath in a single step once it is closed
+
+    Like atomic_write(), but for a file written as a stream. If writing fails, the temporary
+    file is removed and filepath is left as it was.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filepath) or '.',
+                               prefix='.' + os.path.basename(filepath) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, filepath)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+@contextmanager
+def _open_tar(filepath, mode):
+    """Opens a bundle as a streamed tar archive
+
+    Compression is chosen from the file extension. gzip headers are written without a
+    timestamp so identical profiles always produce identical bundles. A bundle being written
+    replaces the file only once it is complete (see _replacing()).
+
+    Args:
+        filepath: path to the bundle
+        mode: 'r' or 'w'
+    """
+    comp = _compression(filepath)
+
+    with _replacing(filepath) if mode == 'w' else open(filepath, 'rb') as f:
+        if comp == 'zst':
+            zstd = _zstandard()
+            if mode == 'w':
+                stream = zstd.ZstdCompressor().stream_writer(f, closefd=False)
+            else:
+                stream = zstd.ZstdDecompressor().stream_reader(f, closefd=False)
+        elif comp == 'gz':
+            stream = gzip.GzipFile(fileobj=f, mode=mode + 'b', mtime=0)
+        else:
+            stream = None
+
+        if stream is None:
+            tar = tarfile.open(fileobj=f, mode='%s|%s' % (mode, comp))
+        else:
+            tar = tarfile.open(fileobj=stream, mode=mode + '|')
+
+        try:
+            yield tar
+        finally:
+            tar.close()
+            if stream is not None:
+                stream.close()
+
+
+def _add_member(tar, name, text):
+    data = text.encode()
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = 0o600
+    info.mtime = 0
+    tar.addfile(info, io.BytesIO(data))
+
+
+def export_bundle(filepath, apps, config_ids):
+    """Renders configurations into a bundle without touching the configuration directories
+
+    Each configuration is stored as '<strategy>/<path relative to conf_dir>', followed by a
+    manifest of digests. Entries are written in a fixed order so the bundle is reproducible.
+    Hosts are prepared in batches for each application first, as 'pia -a' does.
+
+    Args:
+        filepath: path to the bundle to create
+        apps: list of Application objects to render
+        config_ids: iterable of configuration names or Remote(name, fqdn) to render
+
+    Returns:
+        Number of configurations written to the bundle
+    """
+    files = {}
+
+    with _open_tar(filepath, 'w') as tar:
+        for batch in batched((StrategicAlternative.get_remote(c) for c in config_ids), PREPARE_BATCH):
+            for app in apps:
+                app.app.prepare(batch)
+
+            for remote in batch:
+                for app in apps:
+                    try:
+                        conf, text = app.app.render(remote)
+                    except RenderError as e:
+                        logger.warning('Cannot export %s for %s: %s', remote.name, app.strategy, e)
+                        continue
+                    name = posixpath.join(app.strategy, os.path.relpath(conf, app.app.conf_dir))
+
+                    _add_member(tar, name, text)
+                    files[name] = {'strategy': app.strategy,
+                                   'host': remote.name,
+                                   'port': properties.props.port,
+                                   'template': app.app.template_version,
+                                   'digest': content_digest(text)}
+
+        _add_member(tar, BUNDLE_MANIFEST, json.dumps({'version': BUNDLE_VERSION, 'files': files},
+                                                     indent=1, sort_keys=True))
+
+    logger.debug('Exported %d configuration(s) to %s.' % (len(files), filepath))
+    return len(files)
+
+
+def read_bundle(filepath):
+    """Reads and verifies a bundle
+
+    Args:
+        filepath: path to the bundle
+
+    Returns:
+        A list of (name, entry, text) tuples for each configuration in the bundle
+
+    Raises:
+        BundleError: the bundle cannot be read, has unsafe paths or does not match its manifest
+    """
+    contents = {}
+    files = None
+
+    try:
+        with _open_tar(filepath, 'r') as tar:
+            for info in tar:
+                name = posixpath.normpath(info.name)
+
+                if not info.isfile() or name.startswith(('/', '..')):
+                    raise BundleError('Unsafe entry in bundle: %s' % info.name)
+
+                text = tar.extractfile(info).read().decode()
+
+                if name == BUNDLE_MANIFEST:
+                    data = json.loads(text)
+                    if not isinstance(data, dict) or data.get('version') != BUNDLE_VERSION:
+                        raise BundleError('Unsupported bundle version in %s' % filepath)
+                    files = data['files']
+                    if not isinstance(files, dict):
+                        raise BundleError('Invalid %s in %s' % (BUNDLE_MANIFEST, filepath))
+                else:
+                    contents[name] = text
+    except (OSError, tarfile.TarError, ValueError, KeyError) as e:
+        raise BundleError('Cannot read bundle %s: %s' % (filepath, e))
+
+    if files is None:
+        raise BundleError('Bundle %s has no %s' % (filepath, BUNDLE_MANIFEST))
+
+    if set(files) != set(contents):
+        raise BundleError('Bundle %s does not match its manifest' % filepath)
+
+    for name, entry in files.items():
+        if not isinstance(entry, dict) or not all(isinstance(entry.get(k), t) for k, t in ENTRY_FIELDS.items()):
+            raise BundleError('Invalid manifest entry for %s in %s' % (name, filepath))
+
+    for name, text in contents.items():
+        if not name.startswith(files[name]['strategy'] + '/'):
+            raise BundleError('Entry %s is outside of its strategy in %s' % (name, filepath))
+        if content_digest(text) != files[name]['digest']:
+            raise BundleError('Digest mismatch for %s in %s' % (name, filepath))
+
+    return [(name, files[name], contents[name]) for name in sorted(contents)]
+
+
+def import_bundle(filepath, apps):
+    """Commits the configurations from a bundle
+
+    The whole bundle is verified and compared against the installed configurations before
+    anything is written. Configurations which already match the bundle, including permissions
+    and ownership, are skipped.
+
+    Args:
+        filepath: path to the bundle
+        apps: list of Application objects to import configurations for
+
+    Returns:
+        A tuple of the number of configurations written and skipped
+
+    Raises:
+        BundleError: the bundle cannot be read, does not match its manifest or a configuration
+                     cannot be written
+    """
+    apps = {app.strategy: app for app in apps}
+    changed = []
+    skipped = 0
+
+    for name, entry, text in read_bundle(filepath):
+        app = apps.get(entry['strategy'])
+        if app is None:
+            logger.debug('Skipping %s. %s is not configured.', name, entry['strategy'])
+            continue
+
+        conf = os.path.join(app.app.conf_dir, name.split('/', 1)[1])
+        uid, gid = app.app.conf_owner
+
+        try:
+            reasons = app.app.compare(conf, text, os.stat(rooted(conf), follow_symlinks=False), uid, gid)
+        except FileNotFoundError:
+            reasons = ['missing']
+        except OSError as e:
+            raise BundleError('Cannot check %s: %s' % (conf, e))
+
+        if reasons:
+            changed.append((app, conf, text, entry))
+        else:
+            skipped += 1
+
+    for app, conf, text, entry in changed:
+        try:
+            if not app.commit(conf, text, entry['host'], entry['port']):
+                raise OSError('not written')
+        except OSError as e:
+            raise BundleError('Cannot write %s: %s' % (conf, e))
+
+    return len(changed), skipped
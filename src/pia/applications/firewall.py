@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+#    Private Internet Access Configuration auto-configures VPN files for PIA
+#    Copyright (C) 2016  Jesse Spangenberger <azulephoenix[at]gmail[dot]com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import ipaddress
+import json
+import logging
+import os
+import re
+import socket
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from pia.conf import settings
+from pia.utils.misc import atomic_write, content_digest
+
+logger = logging.getLogger(__name__)
+
+# Named sets of the kill-switch table which change with the host list
+SETS = {'endpoints4': 'ipv4_addr', 'endpoints6': 'ipv6_addr', 'tunnels': 'ifname'}
+
+
+class NftError(Exception):
+    """Raised when nft rejects a ruleset or cannot be run"""
+    pass
+
+
+def _nft(binary, *args, stdin=None):
+    """Runs nft and returns its output"""
+    try:
+        r = subprocess.run((binary,) + args, input=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           timeout=30)
+    except (OSError, subprocess.SubprocessError) as e:
+        raise NftError('Cannot run %s: %s' % (binary, e))
+
+    if r.returncode:
+        raise NftError(r.stderr.decode(errors='replace').strip() or 'nft exited with %d' % r.returncode)
+
+    return r.stdout.decode(errors='replace')
+
+
+def _lookup(fqdn):
+    try:
+        return {i[4][0] for i in socket.getaddrinfo(fqdn, None, proto=socket.IPPROTO_UDP)}
+    except OSError as e:
+        logger.warning('Cannot resolve %s: %s' % (fqdn, e))
+        return set()
+
+
+def resolve(addresses, workers=8, lookup=True):
+    """Finds the IP addresses of VPN endpoints
+
+    Addresses which already are IP addresses are used as they are. Host names are resolved
+    concurrently, at most 'workers' at once.
+
+    Args:
+        addresses: iterable of host names or IP addresses
+        workers: number of lookups in flight at once
+        lookup: resolve host names, otherwise they are left out
+
+    Returns:
+        A tuple of the sets of IPv4 and IPv6 addresses
+    """
+    ips, names = set(), set()
+
+    for address in addresses:
+        try:
+            ips.add(ipaddress.ip_address(address))
+        except ValueError:
+            names.add(address)
+
+    if names and not lookup:
+        logger.debug('Leaving out %d unresolved host name(s).' % len(names))
+    elif names:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for found in pool.map(_lookup, sorted(names)):
+                ips.update(ipaddress.ip_address(a.split('%')[0]) for a in found)
+
+    return ({str(ip) for ip in ips if ip.version == 4},
+            {str(ip) for ip in ips if ip.version == 6})
+
+
+def format_elements(elements, indent='\t\t'):
+    """Formats the elements line of a set, or '' for an empty set (nft rejects empty element lists)"""
+    if not elements:
+        return ''
+    return '%selements = { %s }' % (indent, ', '.join(sorted(elements)))
+
+
+def parse_elements(text):
+    """Reads the elements of each named set from a ruleset
+
+    Returns:
+        A dictionary of set names to sets of addresses
+    """
+    elements = {}
+    for name in SETS:
+        m = re.search(r'set %s \{[^}]*?elements = \{([^}]*)\}' % name, text)
+        elements[name] = {e.strip() for e in m.group(1).split(',')} if m else set()
+    return elements
+
+
+def rules_digest(text):
+    """Digest of a ruleset without its set elements, which only changes when the rules do"""
+    return content_digest(re.sub(r'(?m)^\s*elements = .*\n', '', text))
+
+
+def only_resolved_differ(old, new, listed):
+    """Checks if two rulesets only differ in the addresses their host names resolved to
+
+    Args:
+        old: the ruleset on disk
+        new: the ruleset just rendered
+        listed: tuple of the sets of IPv4 and IPv6 addresses which are not looked up (see resolve())
+
+    Returns:
+        True if the rules and interfaces are the same and old still has every listed address
+    """
+    if rules_digest(old) != rules_digest(new):
+        return False
+
+    before, after = parse_elements(old), parse_elements(new)
+    return (before['tunnels'] == after['tunnels'] and
+            listed[0] <= before['endpoints4'] and listed[1] <= before['endpoints6'])
+
+
+def _load_state():
+    try:
+        with open(settings.PIA_FIREWALL_STATE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(table, text):
+    state = {'table': table, 'rules': rules_digest(text)}
+    state.update({k: sorted(v) for k, v in parse_elements(text).items()})
+
+    try:
+        os.makedirs(os.path.dirname(settings.PIA_FIREWALL_STATE), exist_ok=True)
+        atomic_write(settings.PIA_FIREWALL_STATE, json.dumps(state, indent=1, sort_keys=True))
+    except OSError:
+        logger.warning('Cannot write %s.' % settings.PIA_FIREWALL_STATE)
+
+
+def is_loaded(binary, table):
+    """Checks if the kill-switch table is loaded in the kernel"""
+    try:
+        return ('table inet %s' % table) in _nft(binary, 'list', 'tables').splitlines()
+    except NftError as e:
+        logger.debug('Cannot list nftables tables: %s' % e)
+        return False
+
+
+def delta(table, old, new):
+    """Builds an nft script which turns the named sets in old into the ones in new
+
+    Args:
+        table: name of the kill-switch table
+        old: dictionary of set names to the addresses which are loaded
+        new: dictionary of set names to the addresses which should be loaded
+
+    Interface names are quoted in both, as they are in the ruleset.
+
+    Returns:
+        The script, or '' if the sets are the same
+    """
+    lines = []
+
+    for name in SETS:
+        before, after = set(old.get(name, ())), new.get(name, set())
+        for verb, addresses in (('delete', before - after), ('add', after - before)):
+            if addresses:
+                lines.append('%s element inet %s %s { %s }' % (verb, table, name, ', '.join(sorted(addresses))))
+
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def apply(binary, conf, text, table):
+    """Loads a kill-switch ruleset
+
+    When the loaded table has the same rules, only the endpoints and interfaces which were added
+    or removed are changed. Otherwise the whole ruleset file is loaded. Either way nft applies the change
+    in a single transaction, so there is never a moment without a kill-switch.
+
+    Args:
+        binary: full path to nft
+        conf: full path to the ruleset file holding text
+        text: the ruleset
+        table: name of the kill-switch table
+
+    Raises:
+        NftError: nft rejected the ruleset
+    """
+    state = _load_state()
+
+    if state.get('table') == table and state.get('rules') == rules_digest(text) and is_loaded(binary, table):
+        script = delta(table, state, parse_elements(text))
+        if not script:
+            logger.debug('Kill-switch %s is up to date.' % table)
+            return
+
+        try:
+            _nft(binary, '-f', '-', stdin=script.encode())
+            _save_state(table, text)
+            logger.debug('Updated kill-switch endpoints:\n%s' % script)
+            return
+        except NftError as e:
+            logger.debug('Cannot update kill-switch endpoints, reloading %s: %s' % (conf, e))
+
+    _nft(binary, '-f', conf)
+    _save_state(table, text)
+    logger.debug('Loaded kill-switch %s.' % conf)
+
+
+def remove(binary, table):
+    """Unloads the kill-switch table"""
+    if is_loaded(binary, table):
+        try:
+            _nft(binary, 'delete', 'table', 'inet', table)
+        except NftError as e:
+            logger.warning('Cannot remove kill-switch table %s: %s' % (table, e))
+            return
+
+    try:
+        os.remove(settings.PIA_FIREWALL_STATE)
+    except OSError:
+        pass
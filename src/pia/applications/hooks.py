@@ -1,10 +1,16 @@
 import logging
 import os
+import random
 import re
 
-from uuid import uuid4
+from uuid import uuid5, NAMESPACE_DNS
 from pia.conf import settings, properties
-from pia.utils.misc import get_login_credentials
+from pia.conf.manifest import manifest
+from pia.utils.misc import content_digest, get_login_credentials, rooted
+from pia.utils import network
+from pia.utils.routes import netmask
+from pia import monitor
+from pia.applications import firewall, pmtu, probe, wireguard
 from pia.applications.appstrategy import StrategicAlternative
 
 logger = logging.getLogger(__name__)
@@ -23,6 +29,10 @@ class ApplicationStrategyOPENVPN(StrategicAlternative):
     """
     _COMMAND_BIN = ['/usr/bin/openvpn']
     _CONF_DIR = '/etc/openvpn/client'
+    _CONF_EXT = '.conf'
+    _TUNING_KEYS = {'sndbuf': 'sndbuf', 'rcvbuf': 'rcvbuf', 'tun_mtu': 'tun-mtu', 'mssfix': 'mssfix',
+                    'txqueuelen': 'txqueuelen', 'ping': 'ping', 'ping_restart': 'ping-restart'}
+    _TUNING_FORMAT = '%s %s'
     _configs = []
 
     @property
@@ -36,15 +46,117 @@ class ApplicationStrategyOPENVPN(StrategicAlternative):
 
     def __init__(self):
         super().__init__('openvpn')
+        self._families = {}
+        self._order = None
 
-    def config(self, config_id):
-        """Configures configuration file for the given strategy.
+    def prepare(self, remotes):
+        """Finds the IPv4 and IPv6 endpoints of a batch of hosts and the order to try them in
+
+        Hosts are resolved concurrently when 'resolve' is turned on in the [dual_stack] section.
+        The order of IP versions is found once, for the first batch with hosts of both versions
+        (see order_families()). Path MTUs are discovered when turned on (see pia.applications.pmtu).
+        """
+        options = properties.props.dual_stack
+        pmtu.discovery.discover(remotes)
+
+        if properties.is_enabled(options['resolve']):
+            self._families.update(network.classify({r.fqdn for r in remotes if r.fqdn not in self._families},
+                                                   int(options['workers'])))
+
+        if self._order is None and any(len(self.addresses(r)) > 1 for r in remotes):
+            self._order = self.order_families(remotes)
+
+    def addresses(self, remote):
+        """Returns the addresses of a host by IP version, listed ones before resolved ones"""
+        found = dict(self._families.get(remote.fqdn, {}))
+        found.update((v, a) for v, a in ((4, remote.v4), (6, remote.v6)) if a)
+        return found
+
+    def order_families(self, remotes):
+        """Finds which IP version endpoints are tried first on this network
+
+        Unless 'prefer' in the [dual_stack] section picks a version, the configured port is probed
+        on a sample of the hosts' IPv4 and IPv6 addresses concurrently (see network.family_order()).
+        The order is cached for the network, like --auto-port's ports, so later runs on the same
+        network skip probing.
+
+        Returns:
+            A list of IP versions (i.e. [6, 4])
+        """
+        options = properties.props.dual_stack
+        if options['prefer'] in ('4', '6'):
+            return [4, 6] if options['prefer'] == '4' else [6, 4]
+
+        cache = network.PortCache(settings.PIA_FAMILY_CACHE, field='order')
+        net = network.network_id()
+
+        order = cache.get(net, float(options['ttl'])) if net else None
+        if order:
+            logger.debug('Using IP version order %s cached for %s.' % (order, net))
+            return order
+
+        addresses = {4: [], 6: []}
+        for remote in remotes:
+            for version, address in self.addresses(remote).items():
+                addresses[version].append(address)
+
+        sample = int(options['sample'])
+        addresses = {v: random.sample(a, min(len(a), sample)) for v, a in addresses.items()}
+
+        results = network.probe_families(addresses, properties.props.port, properties.props.protocol.lower(),
+                                         float(options['timeout']), int(options['workers']))
+        for version, rtts in sorted(results.items()):
+            logger.debug('IPv%d answered on %d of %d address(es).' % (version, len(rtts), len(addresses[version])))
+
+        order = network.family_order(results, float(options['head_start']))
+        if order is None:
+            logger.warning('No endpoint answered over IPv4 or IPv6. Trying IPv4 first.')
+            return [4, 6]
+
+        logger.info('Trying IPv%d endpoints first.' % order[0])
+        if net:
+            cache.put(net, order)
+        return order
+
+    def format_remotes(self, remote):
+        """Formats the remote directives of a host, one per IP version in the order found by prepare()
+
+        Each directive names the protocol of its IP version (i.e. 'udp6'), so OpenVPN only uses
+        that version for it. Addresses from the host list are used as they are, resolved versions
+        keep the host name so OpenVPN resolves it when connecting. With more than one endpoint,
+        'server-poll-timeout' limits how long OpenVPN waits for an endpoint before trying the next
+        one ('fallback' in [dual_stack]).
+
+        Returns:
+            The directives, or 'remote <fqdn> <port>' if neither the host list nor the resolver
+            gave more than the host name
+        """
+        found = self.addresses(remote)
+        listed = {4: remote.v4, 6: remote.v6}
+        port = properties.props.port
+
+        if not (remote.v4 or remote.v6) and len(found) < 2:
+            return 'remote %s %s' % (remote.fqdn, port)
+
+        proto = properties.props.protocol.lower()
+        directives = ['remote %s %s %s%d' % (listed[v] or remote.fqdn, port, proto, v)
+                      for v in self._order or [4, 6] if v in found]
+
+        fallback = properties.props.dual_stack['fallback']
+        if len(directives) > 1 and fallback:
+            directives.append('server-poll-timeout %s' % fallback)
+
+        return '\n'.join(directives)
+
+    def get_re_dict(self, remote):
+        """Builds the replacement dictionary for the given strategy.
 
         Args:
-            config_id: the name of the profile (i.e. "US East") used as the name of the VPN endpoint
+            remote: Remote(name, fqdn) of the VPN endpoint. The name (i.e. "US East") is used as the
+                    name of the profile
 
-        Raises:
-            OSError: problems with reading or writing configuration files
+        Returns:
+            A dictionary of replacement values for the configuration template
         """
 
         # Directory of replacement values for OpenVPN's configuration files
@@ -53,36 +165,104 @@ class ApplicationStrategyOPENVPN(StrategicAlternative):
                    '##proto##': properties.props.protocol.lower(),
                    '##root_ca##': properties.props.root_ca,
                    '##root_crl##': properties.props.root_crl,
-                   '##login_config##': properties.settings.LOGIN_CONFIG,
-                   '##remote##': self.get_remote_address(config_id),
-                   '##auth##': properties.props.auth}
+                   '##login_config##': remote.login_config,
+                   '##remotes##': self.format_remotes(remote),
+                   '##auth##': properties.props.auth,
+                   '##data_ciphers##': self.format_data_ciphers(),
+                   '##compression##': '' if self.capabilities.get('dco') else 'comp-lzo',
+                   '##tuning##': self.format_tuning(pmtu.discovery.tuning(remote)),
+                   '##management##': self.format_management(remote),
+                   '##routes##': self.format_routes(properties.props.split_routes)}
 
-        # Complete path of configuration file
-        conf = self.conf_dir + '/' + re.sub(' ', '_', config_id) + '.conf'
+        return re_dict
 
-        # Modifies configuration file
-        self.update_config(re_dict, conf)
+    def format_routes(self, routes):
+        """Formats split tunnel routes as OpenVPN directives
 
-    def find_config(self, config_id):
-        """Find if a configuration is configured
+        With nopull (the default), routes pushed by the server, including the default route, are
+        ignored so only the listed prefixes go through the VPN.
+
+        Args:
+            routes: list of Route(version, address, length) (see properties.props.split_routes)
+
+        Returns:
+            The directives, or '' if every route goes through the VPN
+        """
+        if not routes:
+            return ''
+
+        directives = ['route-nopull'] if properties.is_enabled(properties.props.routes['nopull']) else []
+        directives.extend('route %s %s' % (r.address, netmask(r.length)) if r.version == 4 else
+                          'route-ipv6 %s/%s' % (r.address, r.length) for r in routes)
+
+        return '\n'.join(directives)
+
+    def format_management(self, config_id):
+        """Formats the management socket directive watched by 'pia monitor'
+
+        Returns:
+            The directive, or '' if management sockets are turned off in pia.conf
+        """
+        if not properties.is_enabled(properties.props.monitor['management']):
+            return ''
+        return 'management %s unix' % self.management_path(config_id)
+
+    @staticmethod
+    def management_path(config_id):
+        """Returns the path of the management socket for config_id (a profile name or its Remote)"""
+        return os.path.join(properties.props.monitor['socket_dir'],
+                            monitor.SOCKET_PREFIX + StrategicAlternative.stem(config_id) + monitor.SOCKET_SUFFIX)
+
+    def is_active(self, config_id):
+        """Checks if OpenVPN is running config_id, by its management socket"""
+        return network.is_listening(self.management_path(config_id))
+
+    def probe(self):
+        """Finds which data channel features the installed OpenVPN supports
+
+        The OpenVPN of the root filesystem being configured is probed (see settings.PIA_ROOT). When
+        it is not the running system, the kernel it will run on is unknown and offload is left out.
+
+        Returns:
+            A dictionary with the OpenVPN version and whether AEAD ciphers ('aead') and data
+            channel offload ('dco') are supported
+        """
+        return probe.probe_openvpn(rooted(self.command_bin[0]), kernel=settings.PIA_ROOT == '/')
+
+    def format_data_ciphers(self, fmt='data-ciphers %s\ndata-ciphers-fallback %s'):
+        """Formats AEAD cipher negotiation for OpenVPN 2.5+
+
+        The CBC cipher stays last in the list and as the fallback for servers which do not
+        negotiate ciphers. Older versions get no directives and only use the CBC cipher.
 
         Args:
-            config_id: configuration name
+            fmt: format for the list of ciphers and the fallback cipher
 
         Returns:
-            Returns bool depending on if the configuration is already installed
+            The formatted directives, or '' if AEAD ciphers are not supported
+        """
+        if not self.capabilities.get('aead'):
+            return ''
+        return fmt % (properties.props.data_ciphers, properties.props.cipher.upper())
 
+    def format_tuning(self, tuning):
+        """Formats tuning settings as OpenVPN directives
+
+        fast-io is only written for UDP since OpenVPN ignores it otherwise.
         """
-        conf = self.conf_dir + "/" + re.sub(' ', '_', config_id) + '.conf'
+        directives = [super().format_tuning(tuning)]
+
+        if tuning.get('fast_io', '').lower() in ('yes', 'true', '1') and properties.props.protocol == 'udp':
+            directives.append('fast-io')
 
-        return os.access(conf, os.F_OK)
+        return '\n'.join(d for d in directives if d)
 
     @staticmethod
     def get_remote_address(config_id):
         """Finds the remote server host/ip address
         """
 
-        return [h.fqdn for h in properties.get_default_hosts_list() if h.name == re.sub('_', ' ', config_id)][0]
+        return properties.get_remote(config_id).fqdn
 
 
 class ApplicationStrategyNM(StrategicAlternative):
@@ -94,103 +274,584 @@ class ApplicationStrategyNM(StrategicAlternative):
     """
     _CONF_DIR = '/etc/NetworkManager/system-connections'
     _COMMAND_BIN = ['/usr/bin/nmcli', '/usr/lib/nm-openvpn-service']
+    _TUNING_KEYS = {'tun_mtu': 'tunnel-mtu', 'mssfix': 'mssfix', 'ping': 'ping', 'ping_restart': 'ping-restart'}
 
     def __init__(self):
         super().__init__('nm')
 
-    def config(self, config_id):
-        """Configures configuration file for the given strategy.
+    def prepare(self, remotes):
+        """Discovers path MTUs concurrently for the hosts about to be rendered (see pia.applications.pmtu)"""
+        pmtu.discovery.discover(remotes)
+
+    def is_active(self, config_id):
+        """Checks if NetworkManager has the connection of config_id up"""
+        return self.get_remote(config_id).name in network.active_connections()
+
+    def get_re_dict(self, remote):
+        """Builds the replacement dictionary for the given strategy.
 
         NetworkManager requires VPN credentials in its configuration files. So, those are
         pulled in using Props.get_login_credentials() classmethod.
 
         Args:
-            config_id: the name of the profile (i.e. "US East") used as the name of the VPN endpoint
+            remote: Remote(name, fqdn) of the VPN endpoint. The name (i.e. "US East") is used as the
+                    name of the profile
+
+        Returns:
+            A dictionary of replacement values for the configuration template
         """
 
         # Gets VPN username and password
 
-        username, password = get_login_credentials(settings.LOGIN_CONFIG)
+        username, password = get_login_credentials(remote.login_config)
 
         # Directory of replacement values for NetworkManager's configuration files
         re_dict = {'##username##': username,
                    '##password##': password,
-                   '##id##': config_id,
-                   '##uuid##': str(uuid4()),
-                   '##remote##': ApplicationStrategyOPENVPN.get_remote_address(config_id),
+                   '##id##': remote.name,
+                   '##uuid##': str(uuid5(NAMESPACE_DNS, remote.profile_key)),  # Stable across runs
+                   '##remote##': remote.fqdn,
                    '##port##': properties.props.port,
                    '##cipher##': properties.props.cipher.upper(),
                    '##use_tcp##': "yes" if properties.props.protocol.upper() == 'TCP' else 'no',
                    '##root_ca##': properties.props.root_ca,
-                   '##auth##': properties.props.auth.upper()}
+                   '##auth##': properties.props.auth.upper(),
+                   '##data_ciphers##': properties.appstrategy.get_app('openvpn').app.format_data_ciphers(
+                       'data-ciphers=%s\ndata-ciphers-fallback=%s'),
+                   '##tuning##': self.format_tuning(pmtu.discovery.tuning(remote)),
+                   '##routes4##': self.format_routes(properties.props.split_routes, 4),
+                   '##routes6##': self.format_routes(properties.props.split_routes, 6)}
 
-        # Complete path of configuration file
-        conf = self.conf_dir + '/' + re.sub(' ', '_', config_id)
+        return re_dict
 
-        # Modifies configuration file
-        self.update_config(re_dict, conf)
+    @staticmethod
+    def format_routes(routes, version):
+        """Formats split tunnel routes for the [ipv4] or [ipv6] section of a connection
 
-    def find_config(self, config_id):
-        """Find if a configuration is configured
+        With nopull (the default), the VPN never becomes the default route and routes pushed by the
+        server are ignored.
 
         Args:
-            config_id: configuration name
+            routes: list of Route(version, address, length) (see properties.props.split_routes)
+            version: 4 or 6
 
         Returns:
-            Returns bool depending on if the configuration is already installed
+            The settings, or '' if every route goes through the VPN
         """
-        conf = self.conf_dir + "/" + re.sub(' ', '_', config_id)
+        if not routes:
+            return ''
+
+        lines = ['never-default=true']
+        if properties.is_enabled(properties.props.routes['nopull']):
+            lines.append('ignore-auto-routes=true')
+
+        lines.extend('route%d=%s/%s' % (i, r.address, r.length)
+                         for i, r in enumerate((r for r in routes if r.version == version), 1))
 
-        return os.access(conf, os.F_OK)
+        return '\n'.join(lines)
 
 
 class ApplicationStrategyCM(StrategicAlternative):
     """Strategy file for Connman
 
+    With 'consolidate' turned on in the [connman] section, every host is written to a single
+    provisioning file ('<file>.config') with one '[provider_<host>]' section each, so connman-vpn
+    parses one file once per run instead of one file per host. The file is then written like the
+    kill-switch: sections are collected in prepare() and the file is written in finish(). Hosts
+    already in the file keep their sections when they are not configured again, as their
+    provisioning files would (i.e. 'pia -a "US East"' only replaces the section of US East).
+
     Attributes:
         @command_bin: list containing which files to check if the application is installed
         @conf_dir: directory to the application stores it's configurations
     """
     _CONF_DIR = '/var/lib/connman-vpn'
+    _CONF_EXT = '.config'
     _COMMAND_BIN = ['/usr/bin/connmanctl']
+    _TUNING_KEYS = {'tun_mtu': 'OpenVPN.MTU'}
+    _TUNING_FORMAT = '%s = %s'
+    _PROVIDER = '[provider_openvpn]'
+    _SECTION = re.compile(r'^\[provider_(.+)\]$', re.MULTILINE)
 
     def __init__(self):
         super().__init__('cm')
+        self._sections = []
+
+    @property
+    def consolidated(self):
+        """True if every host is written to one provisioning file"""
+        return properties.is_enabled(properties.props.connman['consolidate'])
+
+    @property
+    def per_host(self):
+        """True unless every host is written to one provisioning file"""
+        return not self.consolidated
+
+    def conf_path(self, config_id=None):
+        """Returns the full path of the provisioning file for config_id, or of the consolidated file"""
+        if self.consolidated:
+            return self.conf_dir + '/' + properties.props.connman['file'] + self._CONF_EXT
+        return super().conf_path(config_id)
+
+    def prepare(self, remotes):
+        """Renders the section of each host in a batch when the file is consolidated"""
+        if self.consolidated:
+            self._sections.extend((r.stem, self.render_section(r)) for r in remotes)
+
+    def render_section(self, remote):
+        """Renders the provider section of a host, named after its file name stem (i.e. "provider_US_East")"""
+        text = self.fill_template(self.get_re_dict(remote))
+        section = text[text.index(self._PROVIDER):]
+        return section.replace(self._PROVIDER, '[provider_%s]' % remote.stem, 1)
+
+    def render(self, config_id=None):
+        """Renders the provisioning file for config_id, or the consolidated file of the hosts collected by prepare()
+
+        The sections of the hosts collected by prepare() replace theirs in the file on disk, new
+        hosts are added after the others.
+
+        Returns:
+            A tuple of the full path to the file and its contents
+        """
+        if not self.consolidated:
+            return super().render(config_id)
+
+        sections = self.installed_sections()
+        sections.update(self._sections)
+
+        header = self.config_template[:self.config_template.index(self._PROVIDER)]
+        return self.conf_path(), header.replace('##id##', properties.props.connman['file']) + '\n'.join(sections.values())
+
+    def finish(self):
+        """Writes the consolidated file and removes files left from the other mode
+
+        The consolidated file is only written when it changed, so connman-vpn does not parse it
+        again for nothing. Switching modes removes the files pia generated in the other mode, so
+        connman never sees a host twice.
+        """
+        conf = None
+
+        if self.consolidated:
+            conf, text = self.render()
+            self._sections = []
+
+            try:
+                unchanged = not self.compare(conf, text, os.stat(rooted(conf)), *self.conf_owner)
+            except FileNotFoundError:
+                unchanged = False
+
+            if unchanged:
+                logger.debug('%s is up to date.', conf)
+            else:
+                self.commit(conf, text)
 
-    def config(self, config_id):
-        """Configures configuration file for the given strategy.
+        app = properties.appstrategy.get_app(self.strategy)
+        for path, entry in manifest.by_strategy(self.strategy).items():
+            if (path != conf) if self.consolidated else not entry['host']:
+                logger.debug('Removing %s left from the other connman mode.', path)
+                app.remove_config(path)
+
+    def installed_sections(self):
+        """Reads the sections of the consolidated file
+
+        Returns:
+            A dictionary of the file name stem of each host in the file to its section, in file order
+        """
+        try:
+            with open(rooted(self.conf_path())) as f:
+                text = f.read()
+        except OSError:
+            return {}
+
+        found = list(self._SECTION.finditer(text))
+        sections = {}
+
+        for m, end in zip(found, [n.start() for n in found[1:]] + [None]):
+            section = text[m.start():end]
+            # Sections are separated by a blank line, which belongs to neither
+            sections[m.group(1)] = section[:-1] if end is not None and section.endswith('\n\n') else section
+
+        return sections
+
+    def find_config(self, config_id):
+        """Checks if a host has a provisioning file, or a section in the consolidated file"""
+        if self.consolidated:
+            return self.stem(config_id) in self.installed_sections()
+        return super().find_config(config_id)
+
+    def installed_configs(self):
+        """Finds the hosts with a provisioning file, or a section in the consolidated file
+
+        Returns:
+            A set of configuration names (i.e. "US East") which are installed
+        """
+        if not self.consolidated:
+            return super().installed_configs()
+
+        stems = self.installed_sections()
+        return {r.name for r in properties.iter_profiles(properties.iter_hosts()) if r.stem in stems}
+
+    def find_drift(self, config_ids):
+        """Compares the consolidated file for config_ids against the file on disk
+
+        Sections of hosts other than config_ids are kept as they are (see render()), so checking
+        some hosts does not report the others as drifted.
+
+        Returns:
+            A list with a ('', conf, text, reasons) tuple if the file differs
+        """
+        if not self.consolidated:
+            return super().find_drift(config_ids)
+
+        self.prepare([self.get_remote(c) for c in config_ids])
+        try:
+            conf, text = self.render()
+        finally:
+            self._sections = []
+
+        try:
+            reasons = self.compare(conf, text, os.stat(rooted(conf), follow_symlinks=False), *self.conf_owner)
+        except FileNotFoundError:
+            reasons = ['missing']
+
+        return [('', conf, text, reasons)] if reasons else []
+
+    def get_re_dict(self, remote):
+        """Builds the replacement dictionary for the given strategy.
 
         Args:
-            config_id: the name of the profile (i.e. "US East") used as the name of the VPN endpoint
+            remote: Remote(name, fqdn) of the VPN endpoint. The name (i.e. "US East") is used as the
+                    name of the profile
 
+        Returns:
+            A dictionary of replacement values for the configuration template
         """
 
         # Directory of replacement values for connman's configuration files
-        re_dict = {'##id##': config_id,
-                   '##filename##': properties.appstrategy.get_app('openvpn').app.conf_dir + '/' +
-                                   re.sub(' ', '_', config_id) + '.conf',
-                   '##remote##': ApplicationStrategyOPENVPN.get_remote_address(config_id),
+        re_dict = {'##id##': remote.name,
+                   '##filename##': remote.path(properties.appstrategy.get_app('openvpn').app),
+                   '##remote##': remote.fqdn,
                    '##port##': properties.props.port,
                    '##cipher##': properties.props.cipher,
                    '##auth##': properties.props.auth,
-                   '##root_ca##': properties.props.root_ca}
+                   '##root_ca##': properties.props.root_ca,
+                   '##tuning##': self.format_tuning(pmtu.discovery.tuning(remote)),
+                   '##routes##': self.format_routes(properties.props.split_routes)}
+
+        return re_dict
 
-        # Complete path of configuration file
-        conf = self.conf_dir + '/' + re.sub(' ', '_', config_id) + '.config'
+    @staticmethod
+    def format_routes(routes):
+        """Formats split tunnel routes as connman's Networks setting, or '' for a full tunnel"""
+        if not routes:
+            return ''
+        return 'Networks = ' + ','.join('%s/%s' % (r.address, r.length) for r in routes)
 
-        # Modifies configuration file
-        self.update_config(re_dict, conf)
 
-    def find_config(self, config_id):
-        """Find if a configuration is configured
+class ApplicationStrategyWG(StrategicAlternative):
+    """Strategy file for WireGuard (wg-quick)
+
+    Keys are exchanged with each region's server before its configuration is rendered
+    (see pia.applications.wireguard).
+
+    Attributes:
+        @command_bin: list containing which files to check if the application is installed
+        @conf_dir: directory to the application stores it's configurations
+    """
+    _CONF_DIR = '/etc/wireguard'
+    _CONF_EXT = '.conf'
+    _COMMAND_BIN = ['/usr/bin/wg-quick']
+    _TUNING_KEYS = {'tun_mtu': 'MTU'}
+    _TUNING_FORMAT = '%s = %s'
+
+    def __init__(self):
+        super().__init__('wg')
+
+    def conf_path(self, config_id):
+        """Returns the full path of the configuration file for config_id
+
+        wg-quick names the interface after the file, which is limited to 15 characters. Longer
+        names are shortened and made unique with a digest of the full name.
+        """
+        return self.conf_dir + '/' + self.interface_name(self.stem(config_id)) + self._CONF_EXT
+
+    @staticmethod
+    def interface_name(name):
+        """Shortens a name to the 15 characters of an interface name, keeping it unique"""
+        if len(name) > 15:
+            name = name[:10] + '-' + content_digest(name)[:4]
+        return name
+
+    def prepare(self, remotes):
+        """Exchanges keys and discovers path MTUs concurrently for the regions about to be rendered"""
+        wireguard.session.prefetch(remotes)
+        pmtu.discovery.discover(remotes)
+
+    def find_drift(self, config_ids):
+        """Finds drifted configurations, reporting regions with expired peer data as 'stale'"""
+        remotes = [self.get_remote(c) for c in config_ids]
+        return wireguard.session.report_stale(self, remotes, super().find_drift(remotes))
+
+    def is_active(self, config_id):
+        """Checks if wg-quick is running config_id, by the interface named after its file"""
+        return network.has_interface(os.path.splitext(os.path.basename(self.conf_path(config_id)))[0])
+
+    def get_re_dict(self, remote):
+        """Builds the replacement dictionary for the given strategy.
 
         Args:
-            config_id: configuration name
+            remote: Remote(name, fqdn) of the VPN endpoint. The name (i.e. "US East") is used as the
+                    name of the profile
+
+        Returns:
+            A dictionary of replacement values for the configuration template
+
+        Raises:
+            KeyExchangeError: the key exchange with the region's server failed
+        """
+        peer = wireguard.session.peer(remote)
+
+        # Directory of replacement values for WireGuard's configuration files
+        re_dict = {'##private_key##': wireguard.session.keypair[0],
+                   '##peer_ip##': peer['peer_ip'],
+                   '##dns##': self.format_dns(peer.get('dns_servers')),
+                   '##server_key##': peer['server_key'],
+                   '##server_ip##': peer['server_ip'],
+                   '##server_port##': str(peer['server_port']),
+                   '##tuning##': self.format_tuning(pmtu.discovery.tuning(remote, wireguard=True))}
+
+        return re_dict
+
+    @staticmethod
+    def format_dns(servers):
+        """Formats the region's DNS servers as wg-quick's DNS line, or '' if it has none"""
+        if not servers:
+            return ''
+        return 'DNS = ' + ', '.join(servers)
+
+
+class ApplicationStrategyNMWG(StrategicAlternative):
+    """Strategy file for NetworkManager's WireGuard connections.
+
+    Shares key exchanges with the WireGuard strategy. Only configured when named in 'apps' of the
+    [configure] section of pia.conf, so NetworkManager machines do not exchange keys unasked.
+
+    Attributes:
+        @command_bin: list containing which files to check if the application is installed
+        @conf_dir: directory to the application stores it's configurations
+    """
+    _CONF_DIR = '/etc/NetworkManager/system-connections'
+    _CONF_EXT = '_WG.nmconnection'
+    _COMMAND_BIN = ['/usr/bin/nmcli', '/usr/bin/wg']
+    _TUNING_KEYS = {'tun_mtu': 'mtu'}
+    _OPT_IN = True
+
+    def __init__(self):
+        super().__init__('nmwg')
+
+    def prepare(self, remotes):
+        """Exchanges keys and discovers path MTUs concurrently for the regions about to be rendered"""
+        wireguard.session.prefetch(remotes)
+        pmtu.discovery.discover(remotes)
+
+    def find_drift(self, config_ids):
+        """Finds drifted configurations, reporting regions with expired peer data as 'stale'"""
+        remotes = [self.get_remote(c) for c in config_ids]
+        return wireguard.session.report_stale(self, remotes, super().find_drift(remotes))
+
+    def is_active(self, config_id):
+        """Checks if NetworkManager has the WireGuard connection of config_id up"""
+        return self.get_remote(config_id).name + ' WireGuard' in network.active_connections()
+
+    def get_re_dict(self, remote):
+        """Builds the replacement dictionary for the given strategy.
+
+        Args:
+            remote: Remote(name, fqdn) of the VPN endpoint. The name (i.e. "US East") is used as the
+                    name of the profile
+
+        Returns:
+            A dictionary of replacement values for the configuration template
+
+        Raises:
+            KeyExchangeError: the key exchange with the region's server failed
+        """
+        peer = wireguard.session.peer(remote)
+
+        # Directory of replacement values for NetworkManager's WireGuard configuration files
+        re_dict = {'##id##': remote.name,
+                   '##uuid##': str(uuid5(NAMESPACE_DNS, 'wg.' + remote.profile_key)),  # Stable across runs
+                   '##interface##': ApplicationStrategyWG.interface_name('pia-' + remote.stem),
+                   '##private_key##': wireguard.session.keypair[0],
+                   '##peer_ip##': peer['peer_ip'],
+                   '##dns##': ''.join(d + ';' for d in peer.get('dns_servers', [])),
+                   '##server_key##': peer['server_key'],
+                   '##server_ip##': peer['server_ip'],
+                   '##server_port##': str(peer['server_port']),
+                   '##tuning##': self.format_tuning(pmtu.discovery.tuning(remote, wireguard=True))}
+
+        return re_dict
+
+
+class ApplicationStrategyNFT(StrategicAlternative):
+    """Strategy file for an nftables kill-switch
+
+    Writes a single ruleset for every host instead of a file per host. The address of each
+    endpoint goes into a named set, so the ruleset has the same few rules however many hosts
+    there are. The ruleset is loaded with nft after it is written (see pia.applications.firewall).
+
+    The kill-switch is only configured when enabled in the [firewall] section of pia.conf.
+
+    Attributes:
+        @command_bin: list containing which files to check if the application is installed
+        @conf_dir: directory to the application stores it's configurations
+    """
+    _CONF_DIR = '/etc/nftables.d'
+    _CONF_EXT = '.nft'
+    _CONF_GROUP = 'root'
+    _COMMAND_BIN = ['/usr/sbin/nft']
+    _PER_HOST = False
+    _OPT_IN = True
+
+    def __init__(self):
+        super().__init__('nft')
+        self._addresses = set()
+        self._interfaces = set()
+
+    @property
+    def options(self):
+        return properties.props.firewall
+
+    def conf_path(self, config_id=None):
+        """Returns the full path of the ruleset, which is the same for every host"""
+        return self.conf_dir + '/' + self.options['table'] + self._CONF_EXT
+
+    def prepare(self, remotes):
+        """Collects the addresses of a batch of hosts for the ruleset
+
+        Addresses listed in the host list and cached WireGuard peer addresses are included, and
+        the interfaces wg-quick creates for each host are allowed when WireGuard is configured.
+        """
+        wg = properties.appstrategy.get_app('wg')
+
+        for remote in remotes:
+            self._addresses.add(remote.fqdn)
+            self._addresses.update(a for a in (remote.v4, remote.v6) if a)
+
+            peer = wireguard.session.peers.get(remote.profile_key)
+            if peer:
+                self._addresses.add(peer['data']['server_ip'])
+
+            if wg and wg.configure:
+                self._interfaces.add(os.path.splitext(os.path.basename(remote.path(wg.app)))[0])
+
+    def get_re_dict(self, remote=None):
+        """Builds the replacement dictionary from the hosts collected by prepare()
+
+        Returns:
+            A dictionary of replacement values for the configuration template
+        """
+        v4, v6 = firewall.resolve(self._addresses, int(self.options['workers']),
+                                  properties.is_enabled(self.options['resolve']))
+
+        interfaces = ['\t\toifname "%s" accept' % i.strip()
+                      for i in self.options['interfaces'].split(',') if i.strip()]
+
+        dns = ['\t\tudp dport 53 accept', '\t\ttcp dport 53 accept']
+        lan = ['\t\tip daddr { 10.0.0.0/8, 172.16.0.0/12, 192.168.0.0/16, 169.254.0.0/16 } accept',
+               '\t\tip6 daddr { fc00::/7, fe80::/10 } accept']
+
+        # Directory of replacement values for the kill-switch ruleset
+        re_dict = {'##table##': self.options['table'],
+                   '##elements4##': firewall.format_elements(v4),
+                   '##elements6##': firewall.format_elements(v6),
+                   '##tunnels##': firewall.format_elements(['"%s"' % i for i in self._interfaces]),
+                   '##interfaces##': '\n'.join(interfaces),
+                   '##dns##': '\n'.join(dns) if properties.is_enabled(self.options['allow_dns']) else '',
+                   '##lan##': '\n'.join(lan) if properties.is_enabled(self.options['allow_lan']) else ''}
+
+        return re_dict
+
+    def render(self, config_id=None):
+        """Renders the ruleset for the hosts collected by prepare()
+
+        Returns:
+            A tuple of the full path to the ruleset and its contents
+        """
+        return self.conf_path(), self.fill_template(self.get_re_dict())
+
+    def finish(self):
+        """Writes and loads the ruleset for every host prepared during the run"""
+        conf, text = self.render()
+        self.commit(conf, text)
+        self._addresses, self._interfaces = set(), set()
+
+    def commit(self, conf, text, config_id=None, port=None):
+        """Writes the ruleset and loads it with nft
 
         Returns:
-            Returns bool depending on if the configuration is already installed
+            False if the ruleset could not be written
 
+        Raises:
+            OSError: problems trying to write or change permissions on the ruleset.
         """
-        conf = self.conf_dir + "/" + re.sub(' ', '_', config_id) + '.config'
+        if not super().commit(conf, text, config_id, port):
+            return False
+
+        # The ruleset of another root filesystem is loaded when that system boots
+        if settings.PIA_ROOT != '/':
+            return True
+
+        try:
+            firewall.apply(self.command_bin[0], conf, text, self.options['table'])
+        except firewall.NftError as e:
+            logger.error('Cannot load kill-switch %s: %s' % (conf, e))
+
+        return True
 
-        return os.access(conf, os.F_OK)
+    def cleanup(self):
+        """Unloads the kill-switch"""
+        if settings.PIA_ROOT == '/':
+            firewall.remove(self.command_bin[0], self.options['table'])
+
+    def installed_configs(self):
+        """The ruleset is not a configuration of any one host"""
+        return set()
+
+    def find_drift(self, config_ids):
+        """Compares the ruleset for config_ids against the file on disk and the loaded table
+
+        Host names resolving to other addresses than when the ruleset was written is not drift,
+        as PIA moves them around (see 'pia refresh'). The ruleset only differs when its rules,
+        interfaces or the addresses from the host list and WireGuard peer data changed.
+
+        Returns:
+            A list with a ('', conf, text, reasons) tuple if the ruleset differs, where reasons
+            may also include 'not loaded'
+        """
+        self.prepare([self.get_remote(c) for c in config_ids])
+        try:
+            conf, text = self.render()
+            listed = firewall.resolve(self._addresses, lookup=False)
+        finally:
+            self._addresses, self._interfaces = set(), set()
+
+        uid, gid = self.conf_owner
+
+        try:
+            reasons = self.compare(conf, text, os.stat(rooted(conf), follow_symlinks=False), uid, gid)
+        except FileNotFoundError:
+            reasons = ['missing']
+
+        if 'content' in reasons:
+            try:
+                with open(rooted(conf)) as f:
+                    if firewall.only_resolved_differ(f.read(), text, listed):
+                        reasons.remove('content')
+            except OSError:
+                pass
+
+        if settings.PIA_ROOT == '/' and not firewall.is_loaded(self.command_bin[0], self.options['table']):
+            reasons.append('not loaded')
+
+        return [('', conf, text, reasons)] if reasons else []
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+#    Private Internet Access Configuration auto-configures VPN files for PIA
+#    Copyright (C) 2016  Jesse Spangenberger <azulephoenix[at]gmail[dot]com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+
+from pia.conf import settings, properties
+from pia.utils import network
+
+logger = logging.getLogger(__name__)
+
+# Bytes WireGuard adds to each packet (32), plus the difference between IPv6 and IPv4 headers so
+# tunnels carrying IPv6 fit too. Gives wg-quick's MTU of 1420 on a 1500 byte path.
+WIREGUARD_OVERHEAD = 52
+
+
+class PathMTUDiscovery(object):
+    """Path MTU of each endpoint during a run, shared by the strategies
+
+    Endpoints are probed when a strategy prepares a batch (see network.probe_mtu()), at most
+    once per run. Results are cached for the network (see network.network_id()), so later runs
+    on the same network only probe endpoints which are new.
+
+    The options come from properties.props.mtu (the [mtu] section of pia.conf):
+        @discover: probe endpoints and fit tunnel MTUs to them
+        @timeout: seconds to wait for an answer after each packet
+        @ttl: seconds results are cached for a network
+        @workers: number of endpoints probed at once
+    """
+
+    def __init__(self, path):
+        self._cache = network.PortCache(path, field='mtu')
+        self._network = None
+        self._payloads = None
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (self.__class__.__name__, 'endpoints', len(self._payloads or ()))
+
+    @property
+    def enabled(self):
+        return properties.is_enabled(properties.props.mtu['discover'])
+
+    def discover(self, remotes):
+        """Probes the endpoints of a batch of hosts which have no path MTU yet"""
+        if not self.enabled:
+            return
+
+        options = properties.props.mtu
+
+        if self._payloads is None:
+            self._network = network.network_id()
+            cached = self._cache.get(self._network, float(options['ttl'])) if self._network else None
+            self._payloads = dict(cached or {})
+
+        targets = {r.fqdn: r.v4 or r.v6 or r.fqdn for r in remotes if r.fqdn not in self._payloads}
+        if not targets:
+            return
+
+        found = network.probe_mtus(targets, properties.props.port, float(options['timeout']),
+                                   int(options['workers']))
+        for fqdn in sorted(set(targets) - set(found)):
+            logger.warning('Cannot find the path MTU to %s. Keeping the default MTU.' % fqdn)
+        logger.debug('Found the path MTU to %d of %d endpoint(s).', len(found), len(targets))
+
+        # Endpoints which did not answer are probed again on the next run, not by every strategy
+        self._payloads.update(dict.fromkeys(targets))
+        self._payloads.update(found)
+        if found and self._network:
+            self._cache.put(self._network, {k: v for k, v in self._payloads.items() if v})
+
+    def tuning(self, remote, wireguard=False):
+        """Returns the tuning settings for a profile, fitted to its path MTU
+
+        OpenVPN profiles get mssfix set to the largest UDP payload which reached the endpoint.
+        OpenVPN then sizes its own packets to fit, so tun_mtu is left as it is. WireGuard has no
+        mssfix, so its tun_mtu leaves room for the WireGuard overhead instead. Settings from
+        [tuning] are returned unchanged when discovery is turned off or the endpoint's path MTU
+        is unknown.
+
+        Args:
+            remote: Remote of the profile
+            wireguard: fit the MTU of a WireGuard tunnel instead of an OpenVPN one
+        """
+        tuning = properties.props.tuning
+        payload = self._payloads.get(remote.fqdn) if self._payloads and self.enabled else None
+
+        if not payload:
+            return tuning
+
+        if wireguard:
+            return dict(tuning, tun_mtu=str(payload - WIREGUARD_OVERHEAD))
+        return dict(tuning, mssfix=str(payload))
+
+
+discovery = PathMTUDiscovery(settings.PIA_MTU_CACHE)  # creates global discovery shared by the strategies
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+#    Private Internet Access Configuration auto-configures VPN files for PIA
+#    Copyright (C) 2016  Jesse Spangenberger <azulephoenix[at]gmail[dot]com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import logging
+import os
+import re
+import subprocess
+
+from pia.conf import settings
+from pia.utils.misc import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Kernel module names used by the OpenVPN data channel offload driver
+DCO_MODULES = ('ovpn_dco_v2', 'ovpn_dco', 'ovpn')
+
+
+def _load_cache():
+    try:
+        with open(settings.PIA_CAPABILITIES) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(settings.PIA_CAPABILITIES), exist_ok=True)
+        atomic_write(settings.PIA_CAPABILITIES, json.dumps(cache, indent=1, sort_keys=True), 0o644)
+    except OSError:
+        logger.debug('Cannot write %s.' % settings.PIA_CAPABILITIES)
+
+
+def run_cached(binary, *args, valid=None):
+    """Runs a binary and returns its output, cached until the binary changes
+
+    The output is cached in settings.PIA_CAPABILITIES keyed by the binary's path, arguments,
+    size and mtime, so the binary only runs again after it is upgraded. Failures are not cached:
+    a binary which cannot be run, or exits with a non-zero status without output that valid
+    accepts, runs again next time.
+
+    Args:
+        binary: full path to the binary
+        args: arguments to run it with
+        valid: function telling if output is usable despite a non-zero exit status
+
+    Returns:
+        The combined stdout and stderr of the binary, or None if it cannot be run
+    """
+    try:
+        st = os.stat(binary)
+    except OSError:
+        return None
+
+    key = ' '.join((binary,) + args)
+    stamp = [st.st_size, st.st_mtime]
+    cache = _load_cache()
+    entry = cache.get(key)
+
+    if entry and entry.get('stamp') == stamp and entry.get('output') is not None:
+        return entry['output']
+
+    try:
+        result = subprocess.run((binary,) + args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=5)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.debug('Cannot run %s: %s' % (key, e))
+        return None
+
+    output = result.stdout.decode(errors='replace')
+
+    if result.returncode == 0 or (valid is not None and valid(output)):
+        cache[key] = {'stamp': stamp, 'output': output}
+        _save_cache(cache)
+    else:
+        logger.debug('%s exited with status %d.' % (key, result.returncode))
+
+    return output
+
+
+def parse_openvpn_version(output):
+    """Returns the OpenVPN version from 'openvpn --version' output as a tuple of ints, or None"""
+    m = re.search(r'^OpenVPN (\d+)\.(\d+)(?:\.(\d+))?', output or '', re.M)
+    if not m:
+        return None
+    return tuple(int(v or 0) for v in m.groups())
+
+
+def kernel_module_available(names, modules_dir='/lib/modules', sys_module='/sys/module'):
+    """Checks if any of the kernel modules is loaded or can be loaded
+
+    Args:
+        names: module names (with underscores)
+        modules_dir: directory holding modules.dep for each kernel release
+        sys_module: directory listing loaded modules
+
+    Returns:
+        True if a module is loaded or listed in modules.dep for the running kernel
+    """
+    if any(os.path.exists(os.path.join(sys_module, n)) for n in names):
+        return True
+
+    dep = os.path.join(modules_dir, os.uname().release, 'modules.dep')
+    files = {n.replace('_', '-') for n in names} | set(names)
+
+    try:
+        with open(dep) as f:
+            for line in f:
+                module = os.path.basename(line.split(':', 1)[0]).split('.ko')[0]
+                if module in files:
+                    return True
+    except OSError:
+        pass
+
+    return False
+
+
+def probe_openvpn(binary, kernel=True):
+    """Finds which data channel features an OpenVPN binary supports
+
+    Args:
+        binary: full path to the openvpn binary
+        kernel: the binary runs on this kernel, so its modules tell if data channel offload works
+
+    Returns:
+        A dictionary with:
+            @version: version tuple or None if unknown
+            @aead: True if AEAD data-ciphers negotiation is supported (OpenVPN 2.5+)
+            @dco: True if data channel offload is supported by OpenVPN (2.6+) and the kernel
+    """
+    # openvpn --version exits with status 1 on older versions, so only its output is checked
+    version = parse_openvpn_version(run_cached(binary, '--version',
+                                               valid=lambda output: parse_openvpn_version(output) is not None))
+    aead = bool(version and version >= (2, 5))
+    dco = bool(version and version >= (2, 6) and kernel and kernel_module_available(DCO_MODULES))
+
+    logger.debug('%s version %s (aead: %s, dco: %s)' % (binary, version, aead, dco))
+    return {'version': version, 'aead': aead, 'dco': dco}
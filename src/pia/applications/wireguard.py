@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+
+#    Private Internet Access Configuration auto-configures VPN files for PIA
+#    Copyright (C) 2016  Jesse Spangenberger <azulephoenix[at]gmail[dot]com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import base64
+import json
+import logging
+import os
+import ssl
+import subprocess
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from pia.applications.appstrategy import RenderError
+from pia.conf import settings, properties
+from pia.utils.misc import atomic_write, read_login_credentials, rooted
+
+logger = logging.getLogger(__name__)
+
+
+class KeyExchangeError(RenderError):
+    """Raised when PIA does not accept the WireGuard public key for a region"""
+    pass
+
+
+class RequestRejected(KeyExchangeError):
+    """Raised when a PIA API answers a request with a status other than 'OK'"""
+    pass
+
+
+def _wg(*args, stdin=None):
+    """Runs the 'wg' command and returns its output"""
+    try:
+        return subprocess.run(('wg',) + args, input=stdin, stdout=subprocess.PIPE, check=True,
+                              timeout=5).stdout.decode().strip()
+    except (OSError, subprocess.SubprocessError) as e:
+        raise KeyExchangeError('Cannot run wg %s: %s' % (args[0], e))
+
+
+def request_json(url, context, timeout, headers=None):
+    """Fetches a JSON document from a PIA API over HTTPS
+
+    Raises:
+        KeyExchangeError: the request failed (i.e. it timed out)
+        RequestRejected: the server answered with a status other than 'OK'
+    """
+    req = urllib.request.Request(url, headers=headers or {})
+    try:
+        with urllib.request.urlopen(req, context=context, timeout=timeout) as r:
+            data = json.loads(r.read().decode())
+    except (OSError, ValueError) as e:
+        raise KeyExchangeError('Request to %s failed: %s' % (url.split('?')[0], e))
+
+    if data.get('status') != 'OK':
+        raise RequestRejected('Request to %s failed: %s' % (url.split('?')[0], data.get('message', data)))
+
+    return data
+
+
+# Fields of an addKey answer which are needed to render a configuration
+PEER_FIELDS = ('peer_ip', 'server_key', 'server_ip', 'server_port')
+
+
+class WireGuardSession(object):
+    """Shared state for WireGuard key exchanges during a run.
+
+    One key pair is used for every region. The public key is registered with each region's
+    server through PIA's addKey API, which returns the peer data needed for a configuration.
+    Peer data is cached in settings.PIA_WG_PEERS until it is older than the configured ttl.
+    Accounts whose token could not be requested by prefetch() are not retried during the run.
+    With cached_only set (pia --verify), keys are never exchanged and expired peer data is used
+    as it is, so checking configurations does not register keys or rewrite the cache.
+
+    The options come from properties.props.wireguard (the [wireguard] section of pia.conf):
+        @token_url: URL to request an authentication token from, verified with the system's CAs
+        @endpoint: URL of the addKey API. '{fqdn}' is replaced with the region's address
+        @ca: certificate authority used to verify the regions' servers
+        @ttl: seconds peer data is reused before exchanging keys again
+        @token_ttl: seconds an authentication token is reused before requesting a new one
+        @workers: number of key exchanges in flight at once
+        @timeout: seconds to wait for each request
+    """
+
+    def __init__(self):
+        self._keypair = None
+        self._tokens = {}
+        self._token_errors = {}
+        self._peers = None
+        self._dirty = False
+        self.cached_only = False
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (self.__class__.__name__, 'peers', len(self.peers))
+
+    @property
+    def options(self):
+        return properties.props.wireguard
+
+    @property
+    def keypair(self):
+        """private and public key of this machine, generated on first use"""
+        if self._keypair is None:
+            try:
+                with open(rooted(settings.PIA_WG_KEY)) as f:
+                    private = f.read().strip()
+            except FileNotFoundError:
+                private = _wg('genkey')
+                os.makedirs(os.path.dirname(rooted(settings.PIA_WG_KEY)), exist_ok=True)
+                atomic_write(rooted(settings.PIA_WG_KEY), private + '\n')
+
+            self._keypair = private, _wg('pubkey', stdin=private.encode())
+        return self._keypair
+
+    @property
+    def peers(self):
+        """cached peer data keyed by profile (see Remote.profile_key)"""
+        if self._peers is None:
+            try:
+                with open(rooted(settings.PIA_WG_PEERS)) as f:
+                    self._peers = json.load(f)
+            except (OSError, ValueError):
+                self._peers = {}
+        return self._peers
+
+    def context(self):
+        """Returns a TLS context for the regions' servers (addKey and port forwarding gateways)
+
+        Raises:
+            KeyExchangeError: the certificate authority cannot be read
+        """
+        try:
+            context = ssl.create_default_context(cafile=self.options['ca'] or None)
+        except (OSError, ssl.SSLError) as e:
+            raise KeyExchangeError('Cannot load the certificate authority %s: %s' % (self.options['ca'], e))
+        # PIA servers present certificates for their own common name rather than the region's
+        # address, so they are only checked against the PIA certificate authority
+        context.check_hostname = False
+        return context
+
+    @staticmethod
+    def token_context():
+        """Returns a TLS context for token_url, which has a public certificate for its host name"""
+        return ssl.create_default_context()
+
+    def token(self, login_config=settings.LOGIN_CONFIG):
+        """Requests an authentication token with an account's credentials
+
+        Tokens are reused until they are 'token_ttl' seconds old or forgotten (see forget_token()).
+        The credentials are read again for each new token, so changed ones are picked up.
+
+        Raises:
+            KeyExchangeError: the credentials cannot be read or the request failed
+        """
+        token, issued = self._tokens.get(login_config, (None, 0))
+
+        if token is None or time.time() - issued >= float(self.options['token_ttl']):
+            try:
+                username, password = read_login_credentials(login_config)
+            except (OSError, ValueError) as e:
+                raise KeyExchangeError('Cannot read credentials: %s' % e)
+            auth = base64.b64encode(('%s:%s' % (username, password)).encode()).decode()
+            data = request_json(self.options['token_url'], self.token_context(), float(self.options['timeout']),
+                                {'Authorization': 'Basic ' + auth})
+            token = data.get('token')
+            if not token:
+                raise KeyExchangeError('No token in the answer of %s' % self.options['token_url'])
+            self._tokens[login_config] = token, time.time()
+        return token
+
+    def forget_token(self, login_config=settings.LOGIN_CONFIG):
+        """Drops the token of an account, so the next request gets a new one"""
+        self._tokens.pop(login_config, None)
+
+    def _valid(self, remote):
+        entry = self.peers.get(remote.profile_key)
+        return (entry is not None and entry.get('pubkey') == self.keypair[1] and
+                time.time() - entry.get('time', 0) < float(self.options['ttl']))
+
+    def _add_key(self, remote, token, context):
+        url = self.options['endpoint'].format(fqdn=remote.fqdn) + '?' + urllib.parse.urlencode(
+            {'pt': token, 'pubkey': self.keypair[1]})
+        data = request_json(url, context, float(self.options['timeout']))
+
+        missing = [k for k in PEER_FIELDS if k not in data]
+        if missing:
+            raise KeyExchangeError('No %s in the answer of %s' % (', '.join(missing), remote.fqdn))
+        return data
+
+    def prefetch(self, remotes):
+        """Exchanges keys concurrently for every region without valid cached peer data
+
+        At most 'workers' exchanges are in flight at once. Regions which fail are logged and
+        retried by peer() when they are rendered, unless their account's token could not be
+        requested.
+
+        Args:
+            remotes: list of Remote(name, fqdn)
+        """
+        if self.cached_only:
+            return
+
+        try:
+            stale = [r for r in remotes if not self._valid(r)]
+            if not stale:
+                return
+            context = self.context()
+        except KeyExchangeError as e:
+            logger.warning('Cannot exchange WireGuard keys: %s', e)
+            return
+
+        tokens = {}
+
+        for login_config in {r.login_config for r in stale}:
+            try:
+                tokens[login_config] = self.token(login_config)
+            except (KeyExchangeError, OSError) as e:
+                self._token_errors[login_config] = str(e)
+                logger.warning('Cannot exchange WireGuard keys for %s: %s', login_config, e)
+
+        stale = [r for r in stale if r.login_config in tokens]
+
+        with ThreadPoolExecutor(max_workers=int(self.options['workers'])) as pool:
+            futures = [(r, pool.submit(self._add_key, r, tokens[r.login_config], context)) for r in stale]
+
+            for remote, future in futures:
+                try:
+                    self._store(remote, future.result())
+                except KeyExchangeError as e:
+                    logger.warning('%s: %s', remote.name, e)
+
+        self.save()
+        logger.debug('Exchanged keys for %d region(s).', len(stale))
+
+    def peer(self, remote):
+        """Returns the peer data for a region, exchanging keys if it is not cached
+
+        Raises:
+            KeyExchangeError: the key exchange failed, the account's token could not be requested
+                              earlier in the run, or nothing is cached with cached_only set
+        """
+        if not self._valid(remote):
+            if self.cached_only:
+                entry = self.peers.get(remote.profile_key)
+                if entry is None or entry.get('pubkey') != self.keypair[1]:
+                    raise KeyExchangeError('No peer data is cached for %s' % remote.name)
+                return entry['data']
+
+            if remote.login_config in self._token_errors:
+                raise KeyExchangeError(self._token_errors[remote.login_config])
+
+            self._store(remote, self._add_key(remote, self.token(remote.login_config), self.context()))
+            self.save()
+        return self.peers[remote.profile_key]['data']
+
+    def report_stale(self, app, remotes, drift):
+        """Adds 'stale' to the drift of regions rendered from expired peer data
+
+        Does nothing unless cached_only is set, as peer data is exchanged again otherwise.
+
+        Args:
+            app: WireGuard strategy which found the drift
+            remotes: list of Remote(name, fqdn) which were checked
+            drift: list of (remote, path, contents, reasons) from find_drift()
+
+        Returns:
+            The drift, with the regions whose peer data expired
+        """
+        if not self.cached_only:
+            return drift
+
+        reasons = {remote.profile_key: r for remote, conf, text, r in drift}
+
+        for remote in remotes:
+            if self._valid(remote) or remote.profile_key not in self.peers:
+                continue
+            if remote.profile_key in reasons:
+                reasons[remote.profile_key].append('stale')
+                continue
+            try:
+                conf, text = app.render(remote)
+            except RenderError:
+                continue
+            drift.append((remote, conf, text, ['stale']))
+
+        return drift
+
+    def _store(self, remote, data):
+        self.peers[remote.profile_key] = {'pubkey': self.keypair[1], 'time': time.time(), 'data': data}
+        self._dirty = True
+
+    def save(self):
+        """Writes the peer cache to disk if it has changed"""
+        if not self._dirty:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(rooted(settings.PIA_WG_PEERS)), exist_ok=True)
+            atomic_write(rooted(settings.PIA_WG_PEERS), json.dumps(self.peers, indent=1, sort_keys=True))
+            self._dirty = False
+        except OSError:
+            logger.warning('Cannot write %s.' % settings.PIA_WG_PEERS)
+
+
+session = WireGuardSession()  # creates global session shared by the WireGuard strategies
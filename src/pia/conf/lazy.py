@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+#    Private Internet Access Configuration auto-configures VPN files for PIA
+#    Copyright (C) 2016  Jesse Spangenberger <azulephoenix[at]gmail[dot]com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import logging
+import os
+import time
+
+from pia.conf import settings
+from pia.conf.properties import Account, Remote, to_stem
+from pia.utils.misc import atomic_write, rooted
+
+logger = logging.getLogger(__name__)
+
+
+class LazyIndex(object):
+    """Profiles 'pia connect' creates on demand, written by 'pia -a --lazy' instead of configurations
+
+    The index holds:
+        @strategies: applications 'pia -a --lazy' would have configured
+        @profiles: every selected profile keyed by file name (i.e. "US_East"), with its display
+                   name, address, location and account
+        @created: configurations 'pia connect' wrote, keyed by path, with the strategy, the profile
+                  and the time it was last connected
+
+    The index is read on first use and written back in one step by save(). Paths are as seen from
+    the root filesystem being configured (see settings.PIA_ROOT).
+    """
+    _VERSION = 1
+
+    def __init__(self, path):
+        self._path = path
+        self._data = None
+        self._dirty = False
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (self.__class__.__name__, 'path', self._path)
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._load()
+        return self._data
+
+    def _load(self):
+        empty = {'strategies': [], 'profiles': {}, 'created': {}}
+
+        try:
+            with open(rooted(self._path)) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return empty
+        except (OSError, ValueError):
+            logger.warning('Cannot read %s. Starting with an empty index.' % self._path)
+            return empty
+
+        if data.get('version') != self._VERSION:
+            logger.warning('Unknown version in %s. Starting with an empty index.' % self._path)
+            return empty
+
+        return data
+
+    @property
+    def strategies(self):
+        return self.data['strategies']
+
+    @property
+    def created(self):
+        return self.data['created']
+
+    def reset(self, strategies):
+        """Empties the profiles before 'pia -a' records new ones
+
+        Configurations created earlier stay in the index until they expire.
+        """
+        if self.data['profiles'] or self.data['strategies'] != strategies:
+            self.data['strategies'] = strategies
+            self.data['profiles'] = {}
+            self._dirty = True
+
+    def clear(self):
+        """Empties the index when 'pia -a' writes every configuration, which then owns them all"""
+        if self.data['strategies'] or self.data['profiles'] or self.data['created']:
+            self._data = {'strategies': [], 'profiles': {}, 'created': {}}
+            self._dirty = True
+
+    def add(self, remotes):
+        """Records profiles 'pia connect' may create"""
+        for r in remotes:
+            self.data['profiles'][r.stem] = {
+                'name': r.name, 'fqdn': r.fqdn, 'country': r.country, 'lat': r.lat, 'lon': r.lon,
+                'v4': r.v4, 'v6': r.v6,
+                'account': [r.account.name, r.account.login_config] if r.account else None}
+        self._dirty = True
+
+    def find(self, name):
+        """Finds a profile by name, ignoring case
+
+        Args:
+            name: name of the profile, with spaces or underscores (i.e. "US East" or "us_east")
+
+        Returns:
+            The Remote of the profile, or None if it is not in the index
+        """
+        stem = to_stem(name)
+        profiles = self.data['profiles']
+
+        if stem not in profiles:
+            stem = next((s for s in profiles if s.lower() == stem.lower()), None)
+            if stem is None:
+                return None
+
+        p = profiles[stem]
+        return Remote(p['name'], p['fqdn'], p['country'], p['lat'], p['lon'], stem=stem,
+                      v4=p.get('v4'), v6=p.get('v6'), account=Account(*p['account']) if p['account'] else None)
+
+    def touch(self, path, strategy, remote):
+        """Records that a configuration was connected now"""
+        self.created[path] = {'strategy': strategy, 'profile': remote.stem, 'time': time.time()}
+        self._dirty = True
+
+    def expired(self, ttl):
+        """Returns the paths of created configurations which were not connected for ttl seconds"""
+        now = time.time()
+        return [p for p, e in self.created.items() if now - e['time'] > ttl]
+
+    def forget(self, path):
+        if self.created.pop(path, None) is not None:
+            self._dirty = True
+
+    def save(self):
+        """Writes the index to disk if it has changed
+
+        Raises:
+            OSError: problems writing the index
+        """
+        if not self._dirty:
+            return
+
+        path = rooted(self._path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, json.dumps(dict(self.data, version=self._VERSION), indent=1, sort_keys=True))
+        self._dirty = False
+
+
+lazy_index = LazyIndex(settings.PIA_LAZY_INDEX)  # creates global index object
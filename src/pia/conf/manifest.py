@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+#    Private Internet Access Configuration auto-configures VPN files for PIA
+#    Copyright (C) 2016  Jesse Spangenberger <azulephoenix[at]gmail[dot]com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import logging
+import os
+import stat
+
+from pia.conf import settings
+from pia.utils.misc import atomic_write, content_digest, rooted
+
+logger = logging.getLogger(__name__)
+
+
+class Manifest(object):
+    """Record of every file generated by pia.
+
+    Each entry is keyed by the full path of the generated file and holds:
+        @strategy: name of the strategy which generated the file
+        @host: name of the VPN endpoint (i.e. "US East")
+        @port: port the profile was generated for (i.e. "1198")
+        @digest: sha256 digest of the file contents
+        @mode: permission bits of the file
+        @uid/@gid: ownership of the file
+        @template: version of the template used to render the file
+
+    The manifest is read on first use and written back in one step by save(). Paths are as seen
+    from the root filesystem being configured (see settings.PIA_ROOT).
+    """
+    _VERSION = 1
+
+    def __init__(self, path):
+        self._path = path
+        self._entries = None
+        self._dirty = False
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (self.__class__.__name__, 'path', self._path)
+
+    @property
+    def path(self):
+        """location of the manifest file"""
+        return self._path
+
+    @property
+    def entries(self):
+        """dictionary of all generated files keyed by path"""
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def _load(self):
+        try:
+            with open(rooted(self._path)) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logger.warning('Cannot read manifest %s. Starting with an empty one.' % self._path)
+            return {}
+
+        if data.get('version') != self._VERSION:
+            logger.warning('Unknown manifest version in %s. Starting with an empty one.' % self._path)
+            return {}
+
+        return data.get('files', {})
+
+    def get(self, path):
+        """Returns the entry for path or None if pia did not generate it"""
+        return self.entries.get(path)
+
+    def by_strategy(self, strategy):
+        """Returns all entries generated by a strategy
+
+        Args:
+            strategy: name of the strategy (i.e. "nm")
+
+        Returns:
+            A dictionary of entries keyed by path
+        """
+        return {p: e for p, e in self.entries.items() if e['strategy'] == strategy}
+
+    def record(self, path, strategy, host, port, text, template):
+        """Adds or replaces the entry for a generated file
+
+        Mode and ownership are read back from the file system so the entry reflects
+        what was actually committed.
+
+        Args:
+            path: full path of the generated file
+            strategy: name of the strategy which generated the file
+            host: name of the VPN endpoint
+            port: port the profile was generated for
+            text: contents written to the file
+            template: version of the template used to render the file
+        """
+        entry = {'strategy': strategy,
+                 'host': host,
+                 'port': port,
+                 'digest': content_digest(text),
+                 'template': template,
+                 'mode': None,
+                 'uid': None,
+                 'gid': None}
+
+        try:
+            st = os.stat(rooted(path))
+            entry.update(mode=stat.S_IMODE(st.st_mode), uid=st.st_uid, gid=st.st_gid)
+        except OSError:
+            pass
+
+        self.entries[path] = entry
+        self._dirty = True
+
+    def forget(self, path):
+        """Removes the entry for path, if any"""
+        if self.entries.pop(path, None) is not None:
+            self._dirty = True
+
+    def save(self):
+        """Writes the manifest to disk if it has changed
+
+        Raises:
+            OSError: problems writing the manifest
+        """
+        if not self._dirty:
+            return
+
+        path = rooted(self._path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, json.dumps({'version': self._VERSION, 'files': self.entries},
+                                            indent=1, sort_keys=True))
+        self._dirty = False
+        logger.debug('Saved manifest %s.' % self._path)
+
+
+manifest = Manifest(settings.PIA_MANIFEST)  # creates global manifest object
@@ -17,15 +17,109 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import configparser
+import ipaddress
 import logging
-from collections import namedtuple
+import os
+import sys
 
 from pia.applications import appstrategy
 from pia.conf import settings
+from pia.utils import catalog, routes
+from pia.utils.misc import atomic_write, read_login_credentials
 
 logger = logging.getLogger(__name__)
 
 
+def to_stem(name):
+    """Returns the name used in file and interface names for a host name (i.e. "US_East" for "US East")"""
+    return name.strip().replace(' ', '_')
+
+
+class Remote(object):
+    """A host from the host list.
+
+    One is created for each row of the host list and passed around instead of host names, so
+    names are only converted once. Names are interned, so comparing and hashing them is cheap.
+
+    Attributes:
+        @name: display name (i.e. "US East")
+        @stem: name used for files and interfaces (i.e. "US_East")
+        @fqdn: address of the VPN endpoint
+        @country/@lat/@lon: location from the host list, or None for hosts listed as only 'name,fqdn'
+        @v4/@v6: IPv4 and IPv6 addresses of the endpoint from the host list, or None if not listed
+        @account: Account the profile logs in with, or None for login.conf
+    """
+    __slots__ = ('name', 'stem', 'fqdn', 'country', 'lat', 'lon', 'v4', 'v6', 'account', '_paths')
+
+    def __init__(self, name, fqdn, country=None, lat=None, lon=None, stem=None, v4=None, v6=None,
+                 account=None):
+        self.name = sys.intern(name)
+        self.stem = sys.intern(stem or to_stem(name))
+        self.fqdn = fqdn
+        self.country = country
+        self.lat = lat
+        self.lon = lon
+        self.v4 = v4
+        self.v6 = v6
+        self.account = account
+        self._paths = None
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (self.__class__.__name__, 'name', self.name)
+
+    def __eq__(self, other):
+        return isinstance(other, Remote) and self.stem == other.stem and self.fqdn == other.fqdn
+
+    def __hash__(self):
+        return hash(self.stem)
+
+    def path(self, strategy):
+        """Returns the configuration file of this host for a strategy, computed once per strategy
+
+        Args:
+            strategy: a StrategicAlternative
+        """
+        if self._paths is None:
+            self._paths = {}
+
+        path = self._paths.get(strategy.strategy)
+        if path is None:
+            path = self._paths[strategy.strategy] = strategy.conf_path(self)
+        return path
+
+    @property
+    def login_config(self):
+        """path to the credentials of the profile"""
+        return self.account.login_config if self.account else settings.LOGIN_CONFIG
+
+    @property
+    def profile_key(self):
+        """identifies the profile across runs: the address, prefixed with the account name if any"""
+        return '%s.%s' % (self.account.name, self.fqdn) if self.account else self.fqdn
+
+    def for_account(self, account):
+        """Returns the profile of this host for another account (i.e. "work US East" for "work")"""
+        return Remote('%s %s' % (account.name, self.name), self.fqdn, self.country, self.lat, self.lon,
+                      v4=self.v4, v6=self.v6, account=account)
+
+
+class Account(object):
+    """A PIA account profiles are generated for besides the one in login.conf
+
+    Attributes:
+        @name: prefix of the account's profile names (i.e. "work" for "work US East")
+        @login_config: path to the account's credentials, in the same format as login.conf
+    """
+    __slots__ = ('name', 'login_config')
+
+    def __init__(self, name, login_config):
+        self.name = sys.intern(to_stem(name))
+        self.login_config = login_config
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (self.__class__.__name__, 'name', self.name)
+
+
 class Props(object):
     """Global properties class.
     """
@@ -72,6 +166,106 @@ class Props(object):
             'config': 'default'
         },
     }
+    _aead_ciphers = 'AES-256-GCM:CHACHA20-POLY1305'
+    _default_tuning = 'default'
+    _tuning_lookup = {
+        'default': {},
+        'high-throughput': {
+            'sndbuf': '524288',
+            'rcvbuf': '524288',
+            'fast_io': 'yes',
+            'txqueuelen': '1000',
+            'ping': '10',
+            'ping_restart': '60'
+        },
+        'lossy-link': {
+            'sndbuf': '262144',
+            'rcvbuf': '262144',
+            'tun_mtu': '1400',
+            'mssfix': '1300',
+            'ping': '5',
+            'ping_restart': '30'
+        },
+    }
+    _wireguard_defaults = {
+        'token_url': 'https://privateinternetaccess.com/gtoken/generateToken',
+        'endpoint': 'https://{fqdn}:1337/addKey',
+        'ca': '/etc/openvpn/client/ca.rsa.4096.crt',
+        'ttl': '43200',
+        'token_ttl': '43200',
+        'workers': '8',
+        'timeout': '10'
+    }
+    _firewall_defaults = {
+        'enable': 'no',
+        'table': 'pia_killswitch',
+        'interfaces': 'tun*, wg*, pia-wg',
+        'allow_lan': 'yes',
+        'allow_dns': 'yes',
+        'resolve': 'yes',
+        'workers': '16'
+    }
+    _monitor_defaults = {
+        'management': 'yes',
+        'socket_dir': '/run',
+        'interval': '5',
+        'samples': '60',
+        'grace': '30',
+        'stall': '90',
+        'min_throughput': '0',
+        'start_command': 'systemctl start openvpn-client@{name}',
+        'stop_command': 'systemctl stop openvpn-client@{name}'
+    }
+    _port_forward_defaults = {
+        'url': 'https://{gateway}:19999',
+        'interval': '900',
+        'scan': '30',
+        'renew': '86400',
+        'port_dir': '/run/pia/ports',
+        'hook': '',
+        'timeout': '10'
+    }
+    _connect_defaults = {
+        'strategy': 'openvpn',
+        'ttl': '86400',
+        'openvpn': 'systemctl start openvpn-client@{name}',
+        'nm': 'nmcli connection load {conf}\nnmcli connection up id {id}',
+        'nmwg': 'nmcli connection load {conf}\nnmcli connection up id {id}',
+        'wg': 'wg-quick up {name}',
+        'cm': ''
+    }
+    _auto_port_defaults = {
+        'sample': '4',
+        'timeout': '2',
+        'ttl': '86400',
+        'workers': '16'
+    }
+    _mtu_defaults = {
+        'discover': 'no',
+        'timeout': '1',
+        'ttl': '86400',
+        'workers': '16'
+    }
+    _connman_defaults = {
+        'consolidate': 'no',
+        'file': 'pia'
+    }
+    _dual_stack_defaults = {
+        'resolve': 'no',
+        'prefer': 'auto',
+        'head_start': '0.05',
+        'sample': '4',
+        'timeout': '2',
+        'ttl': '3600',
+        'workers': '16',
+        'fallback': '5'
+    }
+    _routes_defaults = {
+        'file': settings.PIA_ROUTES,
+        'prefixes': '',
+        'nopull': 'yes'
+    }
+    _tuning_keys = ('sndbuf', 'rcvbuf', 'fast_io', 'tun_mtu', 'mssfix', 'txqueuelen', 'ping', 'ping_restart')
 
     def __init__(self):
         self.exclude_apps = None
@@ -79,7 +273,21 @@ class Props(object):
         self._login_config = settings.LOGIN_CONFIG
         self._conf_file = settings.PIA_CONFIG
         self.port = self._default_port
-        self._default_hosts_list = get_default_hosts_list()
+        self.tuning_preset = self._default_tuning
+        self._wireguard = dict(self._wireguard_defaults)
+        self._firewall = dict(self._firewall_defaults)
+        self._monitor = dict(self._monitor_defaults)
+        self._port_forward = dict(self._port_forward_defaults)
+        self._connect = dict(self._connect_defaults)
+        self._auto_port = dict(self._auto_port_defaults)
+        self._dual_stack = dict(self._dual_stack_defaults)
+        self._connman = dict(self._connman_defaults)
+        self._mtu = dict(self._mtu_defaults)
+        self._routes = dict(self._routes_defaults)
+        self._split_routes = None
+        self._accounts = None
+        self._account_files = {}
+        self._default_hosts_list = None
 
     def __repr__(self):
         return '<%s %s:%s>' % (self.__class__.__name__, 'hosts', self._hosts)
@@ -101,6 +309,11 @@ class Props(object):
     def hosts(self, value):
         self._hosts = value
 
+    @property
+    def configured_hosts(self):
+        """hosts listed in pia.conf (empty if every host should be configured)"""
+        return self._hosts
+
     @property
     def port(self):
         return self._port
@@ -137,6 +350,103 @@ class Props(object):
     def default_port(self):
         return self._default_port
 
+    @property
+    def port_lookup(self):
+        """protocol and configuration of each port PIA listens on"""
+        return self._port_lookup
+
+    @property
+    def tuning_preset(self):
+        """name of the transport tuning preset (i.e. "high-throughput")"""
+        return self._tuning_preset
+
+    @tuning_preset.setter
+    def tuning_preset(self, value):
+        if value not in self._tuning_lookup:
+            logger.warning("Unknown tuning preset %s. Defaulting to %s" % (value, self._default_tuning))
+            value = self._default_tuning
+
+        self._tuning_preset = value
+        self._tuning = dict(self._tuning_lookup[value])
+
+    @property
+    def tuning(self):
+        """transport settings from the tuning preset and any overrides in the [tuning] section"""
+        return self._tuning
+
+    @property
+    def tuning_keys(self):
+        return self._tuning_keys
+
+    @property
+    def wireguard(self):
+        """options for WireGuard key exchanges from the [wireguard] section"""
+        return self._wireguard
+
+    @property
+    def firewall(self):
+        """options for the nftables kill-switch from the [firewall] section"""
+        return self._firewall
+
+    @property
+    def auto_port(self):
+        """options for --auto-port from the [auto_port] section"""
+        return self._auto_port
+
+    @property
+    def mtu(self):
+        """options for path MTU discovery from the [mtu] section"""
+        return self._mtu
+
+    @property
+    def connman(self):
+        """options for connman provisioning files from the [connman] section"""
+        return self._connman
+
+    @property
+    def dual_stack(self):
+        """options for IPv4 and IPv6 endpoints from the [dual_stack] section"""
+        return self._dual_stack
+
+    @property
+    def routes(self):
+        """options for split tunneling from the [routes] section"""
+        return self._routes
+
+    @property
+    def split_routes(self):
+        """aggregated routes to send through the VPN, read on first use (empty for a full tunnel)"""
+        if self._split_routes is None:
+            self._split_routes = routes.load(self._routes['file'], self._routes['prefixes'])
+        return self._split_routes
+
+    @property
+    def account_files(self):
+        """credential files of extra accounts from the [accounts] section, keyed by account name"""
+        return self._account_files
+
+    @property
+    def accounts(self):
+        """extra accounts from settings.PIA_ACCOUNTS_DIR and the [accounts] section, read on first use"""
+        if self._accounts is None:
+            self._accounts = load_accounts(self._account_files)
+        return self._accounts
+
+    @property
+    def monitor(self):
+        """options for 'pia monitor' and the OpenVPN management sockets from the [monitor] section"""
+        return self._monitor
+
+    @property
+    def port_forward(self):
+        """options for 'pia forward' from the [port_forward] section"""
+        return self._port_forward
+
+    @property
+    def connect(self):
+        """options for 'pia connect' from the [connect] section"""
+        return self._connect
+
     @property
     def cipher(self):
         return self._cipher
@@ -145,6 +455,11 @@ class Props(object):
     def auth(self):
         return self._auth
 
+    @property
+    def data_ciphers(self):
+        """AEAD ciphers offered before the CBC cipher on OpenVPN 2.5+"""
+        return self._aead_ciphers + ':' + self._cipher.upper()
+
     @property
     def debug(self):
         return self._debug
@@ -163,17 +478,20 @@ class Props(object):
 
     @property
     def default_hosts_list(self):
+        if self._default_hosts_list is None:
+            self._default_hosts_list = get_default_hosts_list()
         return self._default_hosts_list
 
 
 class _Parser(object):
     """attributes may need additional manipulation"""
 
-    def __init__(self, section):
+    def __init__(self, section, raw=False):
         """section to return all options on, formatted as an object
         transforms all comma-delimited options to lists
         comma-delimited lists with colons are transformed to dicts
         dicts will have values expressed as lists, no matter the length
+        raw sections (i.e. ones holding URLs) keep every option as a string
         """
         c = configparser.ConfigParser()
         c.read(props.conf_file)
@@ -182,6 +500,9 @@ class _Parser(object):
 
         self.__dict__.update({k: v for k, v in c.items(section)})
 
+        if raw:
+            return
+
         # transform all ',' into lists, all ':' into dicts
         for key, value in self.__dict__.items():
             if value.find(':') > 0:
@@ -203,6 +524,34 @@ class _Parser(object):
         return '<%s %s:%s>' % (self.__class__.__name__, 'section', self.__dict__['section'])
 
 
+def _read_section(name, options=None):
+    """Reads a section of pia.conf whose options are kept as strings
+
+    Args:
+        name: name of the section (i.e. "wireguard")
+        options: dictionary of the section's options, updated with the ones set in pia.conf. Unknown
+                 options are logged and left out.
+
+    Returns:
+        The section as a _Parser, or None if pia.conf has no such section
+    """
+    try:
+        section = _Parser(name, raw=True)
+        props.conf_section[name] = section
+    except configparser.NoSectionError:
+        logger.debug("Reading configuration file error. No %s" % name)
+        return None
+
+    if options is not None:
+        for key, value in section.__dict__.items():
+            if key in options:
+                options[key] = value.strip()
+            elif key != 'section_name':
+                logger.warning("Option %s is not a [%s] option." % (key, name))
+
+    return section
+
+
 def parse_conf_file():
     """Parses configure file 'pia.conf' using the Parser Class"""
 
@@ -227,33 +576,359 @@ def parse_conf_file():
         props.strong_encryption = getattr(pia_section, "strong_encryption", False)
 
     if configure_section:
-        [appstrategy.set_option(getattr(props, app_name), configure=False)
-         for app_name in appstrategy.get_supported_apps()
-         if app_name not in getattr(configure_section, "apps", appstrategy.get_supported_apps())]
-
-        appstrategy.set_option(getattr(props, "openvpn"), configure=True)
-
         props.hosts = getattr(configure_section, "hosts", "")
         props.port = getattr(configure_section, "port", [props.default_port])[0]
 
+    try:
+        tuning_section = _Parser("tuning")
+        props.conf_section['tuning'] = tuning_section
+    except configparser.NoSectionError:
+        tuning_section = None
+        logger.debug("Reading configuration file error. No %s" % 'tuning')
+
+    if tuning_section:
+        props.tuning_preset = getattr(tuning_section, "preset", [props.tuning_preset])[0]
+
+        for key, value in tuning_section.__dict__.items():
+            key = key.replace('-', '_')
+            if key in props.tuning_keys:
+                props.tuning[key] = value[0]
+            elif key not in ('preset', 'section_name'):
+                logger.warning("Option %s is not a tuning option." % key)
+
+    _read_section('wireguard', props.wireguard)
+    _read_section('firewall', props.firewall)
+    _read_section('monitor', props.monitor)
+    _read_section('port_forward', props.port_forward)
+    _read_section('connect', props.connect)
+    _read_section('auto_port', props.auto_port)
+    _read_section('mtu', props.mtu)
+    _read_section('dual_stack', props.dual_stack)
+    _read_section('routes', props.routes)
+
+    parse_accounts()
+    parse_connman()
+    select_apps()
+
+
+def parse_accounts():
+    """Reads the credential files of extra accounts from the [accounts] section of pia.conf
+
+    Kept apart from parse_conf_file() because 'pia -l' lists the profiles of every account
+    without reading the rest of pia.conf.
+    """
+    section = _read_section('accounts')
+
+    if section:
+        for key, value in section.__dict__.items():
+            if key != 'section_name':
+                props.account_files[key] = value.strip()
+
+
+def parse_connman():
+    """Reads the [connman] section of pia.conf
+
+    Kept apart from parse_conf_file() because 'pia -l' needs to know whether connman's
+    provisioning files are consolidated without reading the rest of pia.conf.
+    """
+    _read_section('connman', props.connman)
+
+
+def select_apps():
+    """Decides which applications are configured
+
+    Installed applications are configured unless they are left out of 'apps' in the [configure]
+    section of pia.conf. OpenVPN is always configured when [configure] is given. Opt-in
+    applications are only configured when named in 'apps', and the kill-switch only when it is
+    enabled in [firewall].
+
+    Installation is checked in the root filesystem being configured (see settings.PIA_ROOT), so
+    this runs again for each root.
+    """
+    configure_section = props.conf_section.get('configure')
+    apps = getattr(configure_section, 'apps', None)
+
+    for app_name in appstrategy.get_supported_apps():
+        app = getattr(props, app_name)
+        wanted = app_name in (apps or ()) if app.app.opt_in else apps is None or app_name in apps
+        appstrategy.set_option(app, configure=app.is_installed() and wanted)
+
+    if configure_section:
+        appstrategy.set_option(getattr(props, 'openvpn'), configure=True)
+
+    # The kill-switch is never configured just because nft is installed
+    nft = getattr(props, 'nft')
+    appstrategy.set_option(nft, configure=(nft.is_installed() and is_enabled(props.firewall['enable']) and
+                                           (apps is None or 'nft' in apps)))
+
+
+def is_enabled(value):
+    """Checks if an option from pia.conf is turned on (i.e. "yes", "true" or "1")"""
+    return str(value).strip().lower() in ('yes', 'true', 'on', '1')
+
 
 def reset_properties():
     props.strong_encryption = False
     props.port = props.default_port
+    props.tuning_preset = 'default'
     props.hosts = []
 
 
+# Row of every host in the host list once _catalog() has loaded it, otherwise None
+_hosts = None
+
+
+def load_hosts():
+    """Reads the whole host list into memory again
+
+    Processes forked afterwards (see run.run_roots()) share the loaded hosts instead of each
+    loading the host list.
+    """
+    global _hosts
+    _hosts = None
+    _catalog()
+
+
+def _catalog():
+    """Returns every host in the host list, loading it at most once per process
+
+    The parsed host list is kept in a compiled snapshot (settings.PIA_HOST_CACHE) keyed by the
+    path, size and modification time of the host list, so while it is unchanged processes load
+    it with a single read instead of parsing it. A stale snapshot is rebuilt on the next load.
+
+    Only the rows are kept, so memory use does not grow with the hosts iter_hosts() yields.
+
+    Returns:
+        A tuple holding the row of each host (see parse_host_list())
+    """
+    global _hosts
+    if _hosts is not None:
+        return _hosts
+
+    rows = catalog.load(settings.PIA_HOST_LIST, settings.PIA_HOST_CACHE)
+
+    if rows is None:
+        st = os.stat(settings.PIA_HOST_LIST)
+        rows = list(parse_host_list(settings.PIA_HOST_LIST))
+
+        try:
+            catalog.save(settings.PIA_HOST_LIST, st, rows, settings.PIA_HOST_CACHE)
+        except OSError:
+            logger.debug('Cannot write %s.' % settings.PIA_HOST_CACHE)
+
+    _hosts = tuple(rows)
+    return _hosts
+
+
+def parse_host_list(path):
+    """Parses a host list one line at a time
+
+    Each line is 'name,fqdn' optionally followed by ',country,latitude,longitude' and then by
+    ',ipv4,ipv6' addresses of the endpoint. Any of the optional columns may be left empty.
+
+    Yields:
+        A tuple of name, fqdn, country, latitude, longitude, file name (see to_stem()), IPv4 and
+        IPv6 address for each host, in the order of the arguments of Remote
+    """
+    with open(path) as f:
+        for host in f:
+            host = host.strip()
+            if not host:
+                continue
+
+            h, d, *geo = (f.strip() for f in host.split(','))
+            yield (h, d) + parse_geo(h, geo) + (to_stem(h),) + parse_addresses(h, geo[3:])
+
+
+def iter_hosts(names=None, unknown=None):
+    """Iterates over hosts from the host list (see _catalog())
+
+    Args:
+        names: only yield hosts with these names (with spaces or underscores), or every host if empty
+        unknown: set which the names not in the host list are added to, once every host was read
+
+    Yields:
+        A new Remote(name, fqdn, country, lat, lon, stem, v4, v6) for each selected host, in host list order
+        and at most once per name
+    """
+    wanted = {to_stem(n) for n in names} if names else None
+    hosts = _catalog()
+
+    for host in hosts:
+        if wanted is not None:
+            if host[5] not in wanted:
+                continue
+            wanted.discard(host[5])
+
+        # Hosts which are never selected are never built, and built ones are not kept
+        yield Remote(*host)
+
+    if wanted and unknown is not None:
+        unknown.update(n for n in names if to_stem(n) in wanted)
+
+
+def find_account_files(account_files=None):
+    """Lists the credential files of extra accounts, whether they can be read or not
+
+    Args:
+        account_files: dictionary of account names and credential files from the [accounts] section
+
+    Returns:
+        A dictionary of credential files keyed by account name (see load_accounts())
+    """
+    files = {}
+
+    try:
+        names = os.listdir(settings.PIA_ACCOUNTS_DIR)
+    except FileNotFoundError:
+        names = []
+
+    for name in names:
+        stem, ext = os.path.splitext(name)
+        if ext == '.conf':
+            files[stem] = os.path.join(settings.PIA_ACCOUNTS_DIR, name)
+
+    files.update(account_files or {})
+    return files
+
+
+def load_accounts(account_files=None):
+    """Lists the accounts profiles are generated for besides the one in login.conf
+
+    Every '<name>.conf' file in settings.PIA_ACCOUNTS_DIR is an account named after the file.
+    Accounts from the [accounts] section ('name = path') are added after them. Accounts whose
+    credentials cannot be read are left out with a warning, so one bad file does not stop the
+    others from being configured.
+
+    Args:
+        account_files: dictionary of account names and credential files
+
+    Returns:
+        A list of Account, ordered by name
+    """
+    files = find_account_files(account_files)
+    accounts = []
+
+    for name in sorted(files):
+        try:
+            read_login_credentials(files[name])
+        except (OSError, ValueError) as e:
+            logger.warning('Skipping account %s: %s' % (name, e))
+            continue
+        accounts.append(Account(name, files[name]))
+
+    return accounts
+
+
+def iter_profiles(remotes):
+    """Expands hosts into one profile per account
+
+    Each host is yielded for login.conf, followed by a copy for each extra account (see
+    Props.accounts). Without extra accounts the hosts are passed through unchanged.
+
+    Args:
+        remotes: iterable of Remote from the host list
+
+    Yields:
+        A Remote for each account of each host
+    """
+    accounts = props.accounts
+
+    for remote in remotes:
+        yield remote
+        for account in accounts:
+            yield remote.for_account(account)
+
+
+def update_name_index():
+    """Writes the names of the hosts for shell completion when the host list changed
+
+    The index (settings.PIA_NAME_INDEX) has one name per line, with underscores instead of spaces,
+    after a '#' line identifying the host list by its size and modification time. It is read by
+    the completion scripts and pia_complete, which never import pia.
+    """
+    try:
+        st = os.stat(settings.PIA_HOST_LIST)
+    except OSError:
+        return
+
+    header = '# %d %d\n' % (st.st_size, st.st_mtime_ns)
+
+    try:
+        with open(settings.PIA_NAME_INDEX) as f:
+            if f.readline() == header:
+                return
+    except OSError:
+        pass
+
+    try:
+        os.makedirs(os.path.dirname(settings.PIA_NAME_INDEX), exist_ok=True)
+        atomic_write(settings.PIA_NAME_INDEX, header + ''.join(r.stem + '\n' for r in iter_hosts()), 0o644)
+    except OSError:
+        logger.debug('Cannot write %s.' % settings.PIA_NAME_INDEX)
+
+
+def parse_geo(name, fields):
+    """Parses the optional country, latitude and longitude columns of a host
+
+    Returns:
+        A tuple of country, latitude and longitude. Missing or invalid values are None.
+    """
+    country = fields[0] if fields and fields[0] else None
+
+    try:
+        lat, lon = float(fields[1]), float(fields[2])
+    except (IndexError, ValueError):
+        if any(fields[1:3]):
+            logger.warning("Invalid coordinates for %s in the host list." % name)
+        lat = lon = None
+
+    return country, lat, lon
+
+
+def parse_addresses(name, fields):
+    """Parses the optional IPv4 and IPv6 address columns of a host
+
+    Returns:
+        A tuple of the IPv4 and IPv6 address. Missing or invalid addresses are None.
+    """
+    addresses = []
+
+    for version, field in zip((4, 6), list(fields[:2]) + ['', '']):
+        try:
+            address = ipaddress.ip_address(field) if field else None
+        except ValueError:
+            address = None
+
+        if field and (address is None or address.version != version):
+            logger.warning("Invalid IPv%d address for %s in the host list." % (version, name))
+            address = None
+
+        addresses.append(str(address) if address else None)
+
+    return tuple(addresses)
+
+
+def get_remote(config_id):
+    """Finds a host in the host list by name
+
+    Args:
+        config_id: name of the host (i.e. "US East" or "US_East")
+
+    Returns:
+        The Remote(name, fqdn) for the host
+
+    Raises:
+        IndexError: the host is not in the host list
+    """
+    for remote in iter_hosts([config_id]):
+        return remote
+
+    raise IndexError('%s is not in %s' % (config_id, settings.PIA_HOST_LIST))
+
+
 def get_default_hosts_list(names_only=False):
-    all_remotes = []
-    remote = namedtuple('Remote', 'name fqdn')
-    for host in open(settings.PIA_HOST_LIST):
-        h, d = host.replace('\n', '').split(',')
-        if not names_only:
-            all_remotes.append(remote(name=h, fqdn=d))
-        else:
-            all_remotes.append(h)
-
-    return all_remotes
+    return [r.name if names_only else r for r in iter_hosts()]
 
 
 props = Props()  # creates global property object
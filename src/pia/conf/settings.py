@@ -4,6 +4,33 @@
 LOGIN_CONFIG = '/etc/private-internet-access/login.conf'
 PIA_CONFIG = '/etc/private-internet-access/pia.conf'
 PIA_HOST_LIST = '/etc/private-internet-access/vpn-hosts.txt'
+PIA_ROUTES = '/etc/private-internet-access/routes.txt'
+PIA_ACCOUNTS_DIR = '/etc/private-internet-access/accounts.d'
+
+#
+#  Root filesystem configurations are generated for (see --root). Paths in this file and
+#  inside configurations are always as seen from it.
+#
+PIA_ROOT = '/'
+
+#
+#  State Files
+#
+PIA_STATE_DIR = '/var/lib/pia'
+PIA_MANIFEST = PIA_STATE_DIR + '/manifest.json'
+PIA_LOCK = PIA_STATE_DIR + '/pia.lock'
+PIA_RUN_STATE = PIA_STATE_DIR + '/last-run.json'
+PIA_CAPABILITIES = PIA_STATE_DIR + '/capabilities.json'
+PIA_WG_KEY = PIA_STATE_DIR + '/wireguard/private.key'
+PIA_WG_PEERS = PIA_STATE_DIR + '/wireguard/peers.json'
+PIA_FIREWALL_STATE = PIA_STATE_DIR + '/firewall.json'
+PIA_PORT_CACHE = PIA_STATE_DIR + '/ports.json'
+PIA_PORT_FORWARD = PIA_STATE_DIR + '/portforward.json'
+PIA_LAZY_INDEX = PIA_STATE_DIR + '/lazy.json'
+PIA_NAME_INDEX = PIA_STATE_DIR + '/names.txt'  # also in pia_complete.py
+PIA_HOST_CACHE = PIA_STATE_DIR + '/vpn-hosts.cache'
+PIA_FAMILY_CACHE = PIA_STATE_DIR + '/families.json'
+PIA_MTU_CACHE = PIA_STATE_DIR + '/mtu.json'
 
 #
 # Debugging information
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+
+#    Private Internet Access Configuration auto-configures VPN files for PIA
+#    Copyright (C) 2016  Jesse Spangenberger <azulephoenix[at]gmail[dot]com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+import os
+import select
+import shlex
+import signal
+import socket
+import subprocess
+import threading
+import time
+from array import array
+
+logger = logging.getLogger(__name__)
+
+# Management sockets are named SOCKET_PREFIX + <profile file name> + SOCKET_SUFFIX
+SOCKET_PREFIX = 'pia-'
+SOCKET_SUFFIX = '.sock'
+
+
+class ManagementError(Exception):
+    """Raised when the OpenVPN management interface closes or rejects a command"""
+    pass
+
+
+class RingBuffer(object):
+    """Fixed number of the most recent samples, stored as an array of doubles"""
+
+    def __init__(self, size):
+        self._data = array('d', bytes(8 * size))
+        self._size = size
+        self._pos = 0
+        self._count = 0
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (self.__class__.__name__, 'samples', len(self))
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._data[(self._pos - self._count + i) % self._size]
+
+    @property
+    def full(self):
+        return self._count == self._size
+
+    def append(self, value):
+        self._data[self._pos] = value
+        self._pos = (self._pos + 1) % self._size
+        self._count = min(self._count + 1, self._size)
+
+    def first(self):
+        return self._data[(self._pos - self._count) % self._size]
+
+    def last(self):
+        return self._data[(self._pos - 1) % self._size]
+
+
+class ManagementClient(object):
+    """Client for the OpenVPN management interface on a Unix socket
+
+    Real-time notifications (lines starting with '>') are collected in 'notifications'
+    whether they arrive between or during commands.
+    """
+
+    def __init__(self, path, timeout=5.0):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._buf = b''
+        self.notifications = []
+
+        try:
+            self._sock.connect(path)
+        except OSError:
+            self._sock.close()
+            raise
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (self.__class__.__name__, 'fd', self._sock.fileno())
+
+    def _recv(self):
+        data = self._sock.recv(4096)
+        if not data:
+            raise ManagementError('Management interface closed the connection')
+        self._buf += data
+
+    def _readline(self):
+        while b'\n' not in self._buf:
+            self._recv()
+        line, self._buf = self._buf.split(b'\n', 1)
+        return line.decode(errors='replace').rstrip('\r')
+
+    def command(self, cmd, multiline=False):
+        """Sends a command and returns its reply
+
+        Args:
+            cmd: the command (i.e. "state")
+            multiline: the reply is a list of lines ending with 'END'
+
+        Returns:
+            The reply line, or the list of lines for multi-line replies
+
+        Raises:
+            ManagementError: the command failed or the connection was closed
+        """
+        self._sock.sendall(cmd.encode() + b'\n')
+        lines = []
+
+        while True:
+            line = self._readline()
+
+            if line.startswith('>'):
+                self.notifications.append(line)
+            elif line.startswith('ERROR:') and not lines:
+                raise ManagementError('%s: %s' % (cmd, line))
+            elif not multiline:
+                return line
+            elif line == 'END':
+                return lines
+            else:
+                lines.append(line)
+
+    def poll(self):
+        """Reads notifications which arrived since the last command without blocking"""
+        while select.select([self._sock], [], [], 0)[0]:
+            self._recv()
+
+        while b'\n' in self._buf:
+            self.notifications.append(self._readline())
+
+    def close(self):
+        self._sock.close()
+
+
+class Tunnel(object):
+    """Health of one running OpenVPN profile
+
+    Attributes:
+        @name: file name of the profile without extension (i.e. "US_East")
+        @path: path to its management socket
+        @state: last OpenVPN state (i.e. "CONNECTED")
+        @refused: True if the management socket refused the last connection (OpenVPN is gone)
+    """
+
+    def __init__(self, name, path, samples, now):
+        self.name = name
+        self.path = path
+        self.state = None
+        self.client = None
+        self.refused = False
+        self.times = RingBuffer(samples)
+        self.rx = RingBuffer(samples)
+        self.tx = RingBuffer(samples)
+        self._seen = now
+        self._connected = now
+        self._received = now
+        self._bytecount = None
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (self.__class__.__name__, 'name', self.name)
+
+    def connect(self, interval):
+        """Connects to the management socket and asks for byte counts every interval seconds"""
+        try:
+            self.client = ManagementClient(self.path)
+        except ConnectionRefusedError:
+            # Nothing listens on the socket, OpenVPN exited without removing it
+            self.refused = True
+            raise
+        self.refused = False
+        self.client.command('bytecount %d' % max(1, int(interval)))
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def _handle(self, notification):
+        kind, _, data = notification[1:].partition(':')
+        # State is queried on every sample, so only byte counts are taken from notifications
+        if kind == 'BYTECOUNT':
+            rx, tx = data.split(',')[:2]
+            self._bytecount = int(rx), int(tx)
+
+    def sample(self, now):
+        """Records the current state and byte counts
+
+        Byte counts come from 'bytecount' notifications, or from 'status' until the first one
+        arrives.
+
+        Raises:
+            ManagementError, OSError: the management interface is gone
+        """
+        self.client.poll()
+
+        state = self.client.command('state', multiline=True)
+        if state:
+            self.state = state[-1].split(',')[1]
+
+        for notification in self.client.notifications:
+            self._handle(notification)
+        del self.client.notifications[:]
+
+        if self._bytecount is None:
+            stats = dict(line.split(',', 1) for line in self.client.command('status', multiline=True)
+                         if ',' in line)
+            rx, tx = int(stats.get('TCP/UDP read bytes', 0)), int(stats.get('TCP/UDP write bytes', 0))
+        else:
+            rx, tx = self._bytecount
+
+        if self.state == 'CONNECTED':
+            self._connected = now
+        if not len(self.rx) or rx > self.rx.last():
+            self._received = now
+
+        self.times.append(now)
+        self.rx.append(rx)
+        self.tx.append(tx)
+
+    def throughput(self):
+        """Average bytes received per second over the samples, or None with fewer than two"""
+        if len(self.times) < 2 or self.times.last() == self.times.first():
+            return None
+        return (self.rx.last() - self.rx.first()) / (self.times.last() - self.times.first())
+
+    def violation(self, now, grace, stall, min_throughput):
+        """Checks the tunnel against the thresholds
+
+        Args:
+            now: current monotonic time
+            grace: seconds after the tunnel was first seen during which it is not checked
+            stall: seconds the tunnel may be disconnected or receive nothing (not even keepalives)
+            min_throughput: bytes per second the tunnel must average over a full window (0 disables)
+
+        Returns:
+            A description of the violation, or None if the tunnel is healthy
+        """
+        if now - self._seen < grace:
+            return None
+
+        if self.refused:
+            return 'management socket refuses connections'
+
+        if now - self._connected > stall:
+            return 'not connected for %ds (%s)' % (now - self._connected, self.state)
+
+        if now - self._received > stall:
+            return 'nothing received for %ds' % (now - self._received)
+
+        rate = self.throughput()
+        if min_throughput and self.rx.full and rate is not None and rate < min_throughput:
+            return 'throughput %.0f B/s is below %.0f B/s' % (rate, min_throughput)
+
+        return None
+
+
+def _inode(path):
+    """Identifies a socket file, so one created again under the same name is told apart"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+class Monitor(object):
+    """Watches running OpenVPN profiles and fails over to the next-ranked profile
+
+    Profiles are found by their management sockets in the socket directory. Each one is sampled
+    every interval. When a profile violates a threshold it is stopped and the next profile in
+    'ranked' which is not running is started.
+
+    OpenVPN may leave its socket behind when it dies. Profiles which were failed over are
+    ignored until their socket is removed or created again, so a stale socket causes a single
+    failover instead of one every round. Replacements which were started are not picked again
+    until their socket appears.
+
+    The options come from properties.props.monitor (the [monitor] section of pia.conf).
+    """
+
+    def __init__(self, ranked, options):
+        self.ranked = ranked
+        self.options = options
+        self.tunnels = {}
+        self.failed = {}
+        self.starting = {}
+        self._stop = threading.Event()
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (self.__class__.__name__, 'tunnels', list(self.tunnels))
+
+    def scan(self, now):
+        """Starts tracking new management sockets and stops tracking removed ones"""
+        socket_dir = self.options['socket_dir']
+
+        try:
+            names = {n[len(SOCKET_PREFIX):-len(SOCKET_SUFFIX)]: os.path.join(socket_dir, n)
+                     for n in os.listdir(socket_dir)
+                     if n.startswith(SOCKET_PREFIX) and n.endswith(SOCKET_SUFFIX)}
+        except OSError:
+            names = {}
+
+        for name in set(self.tunnels) - set(names):
+            self.tunnels.pop(name).close()
+
+        for name in set(self.failed) - set(names):
+            del self.failed[name]
+
+        # Replacements are pending until their socket appears, or for at most 'stall' seconds
+        for name, started in list(self.starting.items()):
+            if name in names or now - started > float(self.options['stall']):
+                del self.starting[name]
+
+        for name, path in names.items():
+            if name in self.failed:
+                if self.failed[name] == _inode(path):
+                    continue
+                del self.failed[name]
+
+            if name not in self.tunnels:
+                logger.info('Monitoring %s.' % name)
+                self.tunnels[name] = Tunnel(name, path, int(self.options['samples']), now)
+
+    def check(self, now):
+        """Samples every tunnel and fails over the ones which violate a threshold"""
+        for tunnel in list(self.tunnels.values()):
+            try:
+                if tunnel.client is None:
+                    tunnel.connect(float(self.options['interval']))
+                tunnel.sample(now)
+            except (OSError, ManagementError, ValueError, IndexError) as e:
+                logger.debug('Cannot sample %s: %s' % (tunnel.name, e))
+                tunnel.close()
+
+            reason = tunnel.violation(now, float(self.options['grace']), float(self.options['stall']),
+                                      float(self.options['min_throughput']))
+            if reason:
+                self.failover(tunnel, reason, now)
+
+    def next_profile(self, name):
+        """Returns the profile ranked after name which is not running, failed or starting, or None"""
+        if name in self.ranked:
+            i = self.ranked.index(name)
+            candidates = self.ranked[i + 1:] + self.ranked[:i]
+        else:
+            candidates = self.ranked
+
+        for candidate in candidates:
+            if candidate not in self.tunnels and candidate not in self.failed and \
+                    candidate not in self.starting:
+                return candidate
+
+        return None
+
+    def _run_command(self, option, name):
+        cmd = shlex.split(self.options[option].format(name=name))
+        try:
+            subprocess.run(cmd, check=True, timeout=60)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.error('Cannot run %s: %s' % (' '.join(cmd), e))
+            return False
+        return True
+
+    def failover(self, tunnel, reason, now):
+        """Replaces a tunnel with the next-ranked profile
+
+        The tunnel's socket is remembered, so it is not tracked again while it stays behind.
+        """
+        replacement = self.next_profile(tunnel.name)
+        if replacement is None:
+            logger.warning('%s: %s. No other profile to switch to.' % (tunnel.name, reason))
+            return
+
+        logger.warning('%s: %s. Switching to %s.' % (tunnel.name, reason, replacement))
+
+        tunnel.close()
+        del self.tunnels[tunnel.name]
+        self.failed[tunnel.name] = _inode(tunnel.path)
+        self.starting[replacement] = now
+
+        self._run_command('stop_command', tunnel.name)
+        self._run_command('start_command', replacement)
+
+    def stop(self, *args):
+        """Stops run() after the current round"""
+        self._stop.set()
+
+    def run(self):
+        """Monitors tunnels until stopped (i.e. by SIGTERM or SIGINT)"""
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self.stop)
+
+        logger.info('Monitoring %s every %ss.' % (os.path.join(self.options['socket_dir'],
+                                                               SOCKET_PREFIX + '*' + SOCKET_SUFFIX),
+                                                  self.options['interval']))
+
+        while not self._stop.is_set():
+            now = time.monotonic()
+            self.scan(now)
+            self.check(now)
+            self._stop.wait(float(self.options['interval']))
+
+        for tunnel in self.tunnels.values():
+            tunnel.close()
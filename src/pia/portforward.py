@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+
+#    Private Internet Access Configuration auto-configures VPN files for PIA
+#    Copyright (C) 2016  Jesse Spangenberger <azulephoenix[at]gmail[dot]com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import base64
+import calendar
+import functools
+import json
+import logging
+import os
+import shlex
+import signal
+import time
+import urllib.parse
+
+from pia import monitor as health
+from pia.applications import wireguard
+from pia.conf import settings
+from pia.utils import network
+from pia.utils.misc import atomic_write, rooted
+
+logger = logging.getLogger(__name__)
+
+
+class PortForwardError(Exception):
+    """Raised when a gateway does not hand out or bind a forwarded port"""
+    pass
+
+
+def parse_payload(payload):
+    """Decodes the port and expiry time of a getSignature payload
+
+    Returns:
+        A tuple of the port and the expiry time in seconds since the epoch
+
+    Raises:
+        PortForwardError: the payload is not a base64-encoded JSON object with a port and expiry
+    """
+    try:
+        data = json.loads(base64.b64decode(payload).decode())
+        # Fractions of seconds are dropped, PIA sends more digits than strptime accepts
+        expires = calendar.timegm(time.strptime(data['expires_at'][:19], '%Y-%m-%dT%H:%M:%S'))
+        return int(data['port']), expires
+    except (ValueError, KeyError, TypeError) as e:
+        raise PortForwardError('Invalid payload: %s' % e)
+
+
+def openvpn_gateway(path):
+    """Returns the gateway of a running OpenVPN tunnel, asking its management socket
+
+    PIA's OpenVPN servers are the first address of the /24 the tunnel's address is in.
+
+    Raises:
+        PortForwardError: the tunnel is not connected
+        ManagementError, OSError: the management interface is gone
+    """
+    client = health.ManagementClient(path)
+    try:
+        state = client.command('state', multiline=True)
+    finally:
+        client.close()
+
+    fields = state[-1].split(',') if state else []
+    if len(fields) < 4 or fields[1] != 'CONNECTED' or not fields[3]:
+        raise PortForwardError('Not connected')
+
+    return fields[3].rsplit('.', 1)[0] + '.1'
+
+
+def wireguard_gateway(remote):
+    """Returns the gateway of a WireGuard tunnel from the cached peer data
+
+    Raises:
+        PortForwardError: no peer data names the gateway
+    """
+    entry = wireguard.session.peers.get(remote.profile_key)
+    if not entry or not entry['data'].get('server_vip'):
+        raise PortForwardError('No gateway in the WireGuard peer data')
+    return entry['data']['server_vip']
+
+
+class Forwarder(object):
+    """Keeps a port forwarded for every running tunnel of the generated profiles
+
+    Every 'scan' seconds, running OpenVPN profiles are found by their management sockets and
+    wg-quick profiles by their interfaces. Each running tunnel gets a task on a single asyncio event
+    loop. The task requests a signature from the tunnel's gateway (getSignature) when it has none
+    which is valid for another 'renew' seconds, and binds the port (bindPort) every 'interval'
+    seconds. Signatures are kept in settings.PIA_PORT_FORWARD, so a restart keeps the same ports.
+
+    The current port of each tunnel is written to '<port_dir>/<strategy>/<profile>' and the 'hook'
+    command is run whenever it changes.
+
+    The options come from properties.props.port_forward (the [port_forward] section of pia.conf):
+        @url: base URL of the port forwarding API. '{gateway}' is replaced with the tunnel's gateway
+        @interval: seconds between bindPort calls
+        @scan: seconds between looking for tunnels which started or stopped
+        @renew: a new signature is requested when the current one expires within this many seconds
+        @port_dir: directory the ports are written to
+        @hook: command run when a port changes. '{name}', '{strategy}' and '{port}' are replaced
+        @timeout: seconds to wait for each request
+    """
+
+    def __init__(self, profiles, options, socket_dir, wg=None):
+        """
+        Args:
+            profiles: list of Remote whose tunnels get ports forwarded
+            options: the [port_forward] options
+            socket_dir: directory of the OpenVPN management sockets
+            wg: the wg-quick StrategicAlternative, or None to skip WireGuard tunnels
+        """
+        self.profiles = {r.stem: r for r in profiles}
+        self.options = options
+        self.socket_dir = socket_dir
+        self.wg = wg
+        self.tasks = {}
+        self.ports = {}
+        self._state = None
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (self.__class__.__name__, 'tunnels', list(self.tasks))
+
+    @property
+    def state(self):
+        """signatures keyed by 'strategy/profile', read on first use"""
+        if self._state is None:
+            try:
+                with open(rooted(settings.PIA_PORT_FORWARD)) as f:
+                    self._state = json.load(f)
+            except (OSError, ValueError):
+                self._state = {}
+        return self._state
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(rooted(settings.PIA_PORT_FORWARD)), exist_ok=True)
+            atomic_write(rooted(settings.PIA_PORT_FORWARD), json.dumps(self.state, indent=1, sort_keys=True))
+        except OSError:
+            logger.warning('Cannot write %s.' % settings.PIA_PORT_FORWARD)
+
+    def running(self):
+        """Finds the running tunnels of the profiles
+
+        Returns:
+            A dictionary of 'strategy/profile' keys and tuples of the Remote and a function
+            returning the tunnel's gateway
+        """
+        found = {}
+
+        try:
+            names = os.listdir(self.socket_dir)
+        except OSError:
+            names = []
+
+        for n in names:
+            if n.startswith(health.SOCKET_PREFIX) and n.endswith(health.SOCKET_SUFFIX):
+                remote = self.profiles.get(n[len(health.SOCKET_PREFIX):-len(health.SOCKET_SUFFIX)])
+                if remote is not None:
+                    found['openvpn/' + remote.stem] = (
+                        remote, functools.partial(openvpn_gateway, os.path.join(self.socket_dir, n)))
+
+        if self.wg is not None:
+            for remote in self.profiles.values():
+                interface = os.path.splitext(os.path.basename(remote.path(self.wg.app)))[0]
+                if network.has_interface(interface):
+                    found['wg/' + remote.stem] = remote, functools.partial(wireguard_gateway, remote)
+
+        return found
+
+    def _url(self, gateway, method, **params):
+        return '%s/%s?%s' % (self.options['url'].format(gateway=gateway), method,
+                             urllib.parse.urlencode(params))
+
+    def signature(self, remote, gateway):
+        """Requests a port and its signature from a gateway
+
+        Returns:
+            A dictionary of the gateway, payload, signature, port and expiry time
+
+        The account's token is forgotten when the gateway rejects the request, as it may have
+        expired.
+
+        Raises:
+            KeyExchangeError: the request failed
+            PortForwardError: the answer or its payload is invalid
+        """
+        token = wireguard.session.token(remote.login_config)
+        try:
+            data = wireguard.request_json(self._url(gateway, 'getSignature', token=token),
+                                          wireguard.session.context(), float(self.options['timeout']))
+        except wireguard.RequestRejected:
+            wireguard.session.forget_token(remote.login_config)
+            raise
+
+        if not data.get('payload') or not data.get('signature'):
+            raise PortForwardError('No payload or signature in the answer of %s' % gateway)
+        port, expires = parse_payload(data['payload'])
+
+        return {'gateway': gateway, 'payload': data['payload'], 'signature': data['signature'],
+                'port': port, 'expires': expires}
+
+    def bind(self, binding):
+        """Binds (or keeps bound) the port of a signature
+
+        Raises:
+            KeyExchangeError: the request failed
+            RequestRejected: the gateway did not bind the port
+        """
+        wireguard.request_json(self._url(binding['gateway'], 'bindPort', payload=binding['payload'],
+                                         signature=binding['signature']),
+                               wireguard.session.context(), float(self.options['timeout']))
+
+    def _valid(self, binding, gateway):
+        return (binding is not None and binding.get('gateway') == gateway and
+                binding.get('expires', 0) - time.time() > float(self.options['renew']))
+
+    async def keep(self, key, remote, gateway):
+        """Keeps the port of one tunnel bound until cancelled"""
+        loop = asyncio.get_event_loop()
+
+        while True:
+            try:
+                address = await loop.run_in_executor(None, gateway)
+                binding = self.state.get(key)
+
+                if not self._valid(binding, address):
+                    binding = await loop.run_in_executor(None, self.signature, remote, address)
+                    self.state[key] = binding
+                    self.save()
+                    logger.debug('%s: got port %d from %s.', key, binding['port'], address)
+
+                try:
+                    await loop.run_in_executor(None, self.bind, binding)
+                except wireguard.RequestRejected:
+                    # The gateway forgot the signature (i.e. it restarted), so a new one is needed.
+                    # Timeouts keep it, the gateway may just not have answered.
+                    self.state.pop(key, None)
+                    self.save()
+                    raise
+
+                await self.publish(key, remote, binding['port'])
+            except (PortForwardError, wireguard.KeyExchangeError, health.ManagementError, OSError) as e:
+                logger.warning('%s: %s', key, e)
+
+            await asyncio.sleep(float(self.options['interval']))
+
+    def port_file(self, key):
+        return os.path.join(self.options['port_dir'], key)
+
+    async def publish(self, key, remote, port):
+        """Writes the port of a tunnel to its file and runs the hook when it changed"""
+        if self.ports.get(key) == port:
+            return
+
+        os.makedirs(os.path.dirname(self.port_file(key)), exist_ok=True)
+        atomic_write(self.port_file(key), '%d\n' % port, mode=0o644)
+        self.ports[key] = port
+        logger.info('%s: forwarding port %d.', key, port)
+
+        if not self.options['hook']:
+            return
+
+        strategy, name = key.split('/', 1)
+        cmd = shlex.split(self.options['hook'].format(name=name, strategy=strategy, port=port))
+        try:
+            process = await asyncio.create_subprocess_exec(*cmd)
+            await asyncio.wait_for(process.wait(), 60)
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.error('Cannot run %s: %s' % (' '.join(cmd), e))
+
+    def forget(self, key):
+        """Cancels the task of a tunnel and removes its port file, the port is not kept bound"""
+        self.tasks.pop(key).cancel()
+        self.ports.pop(key, None)
+        try:
+            os.remove(self.port_file(key))
+        except OSError:
+            pass
+
+    def scan(self):
+        """Starts a task for each tunnel which started and cancels the ones of stopped tunnels
+
+        Tasks which ended on an unexpected error are started again.
+        """
+        running = self.running()
+
+        for key in set(self.tasks) - set(running):
+            logger.info('%s stopped.', key)
+            self.forget(key)
+
+        for key, (remote, gateway) in running.items():
+            task = self.tasks.get(key)
+
+            if task is not None and task.done():
+                error = None if task.cancelled() else task.exception()
+                logger.error('%s: forwarding stopped: %s. Starting again.', key, error)
+            elif task is not None:
+                continue
+            else:
+                logger.info('Forwarding a port for %s.', key)
+
+            self.tasks[key] = asyncio.ensure_future(self.keep(key, remote, gateway))
+
+    async def _run(self, stop):
+        while not stop.is_set():
+            self.scan()
+            try:
+                await asyncio.wait_for(stop.wait(), float(self.options['scan']))
+            except asyncio.TimeoutError:
+                pass
+
+        tasks = list(self.tasks.values())
+        for key in list(self.tasks):
+            self.forget(key)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def run(self):
+        """Forwards ports until stopped (i.e. by SIGTERM or SIGINT)"""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        stop = asyncio.Event()
+
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+
+        logger.info('Looking for tunnels every %ss.' % self.options['scan'])
+
+        try:
+            loop.run_until_complete(self._run(stop))
+        finally:
+            loop.close()
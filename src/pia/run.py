@@ -15,15 +15,27 @@
 #
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
 import logging
+import multiprocessing
 import os
+import random
 import sys
 import re
-
-from pia import __version__
-from pia.conf import properties
-from pia.applications import appstrategy
+import shlex
+import subprocess
+import time
+
+from pia import __version__, monitor as health, portforward
+from pia.conf import properties, settings
+from pia.conf.lazy import lazy_index
+from pia.conf.manifest import manifest
+from pia.applications import appstrategy, bundle, wireguard
 from pia.conf.properties import props
+from pia.utils import geo, log, network
+from pia.utils.hostindex import HostIndex
+from pia.utils.lock import RunLock, inputs_digest
+from pia.utils.misc import batched, forget_login_credentials, rooted
 from docopt import docopt
 
 logger = logging.getLogger(__name__)
@@ -34,32 +46,208 @@ appstrategy.check_apps()
 # Shortcut for the openvpn app object
 openvpn = props.openvpn.app
 
+# Number of hosts rendered before their configurations are written
+COMMIT_BATCH = 64
+
+# Options which change how the others behave. They run first, and only once for all roots.
+MODIFIERS = ('debug', 'exclude', 'auto_port')
+
+# Actions which must run even right after an identical run
+UNCACHED = ('verify', 'connect', 'refresh')
+
+# Host names given on the commandline or in pia.conf which are not in the host list
+unknown_hosts = set()
+
 
 def run():
     """Main function run from command line"""
     logger.debug('Parsing commandline args...')
     props.commandline = commandline_interface()
 
+    if props.commandline.log_format != 'text':
+        if props.commandline.log_format not in log.FORMATS:
+            logger.error('Unknown log format %s. Use one of: %s.' % (props.commandline.log_format,
+                                                                     ', '.join(log.FORMATS)))
+            sys.exit(1)
+        log.configure_logging(props.commandline.log_format)
+
     set_hosts()
+    properties.update_name_index()
+
+    roots = target_roots()
+    if len(roots) == 1:
+        settings.PIA_ROOT = roots[0]
+        properties.select_apps()
 
     if props.commandline.list_configurations:
         list_configurations()
 
-    # Make sure we are running as root
-    if os.getuid() > 0:
+    # Make sure we are running as root. Other root filesystems only need to be writable.
+    if os.getuid() > 0 and not roots:
         logger.error('You must run this script with administrative privileges!')
         sys.exit(1)
 
     properties.parse_conf_file()
 
-    [globals()[k]() for k, v in props.commandline.__dict__.items() if
-        not k == 'hosts' and getattr(props.commandline, k, None)]
+    # The monitor and forward commands run until stopped, so they must not hold the lock other
+    # runs wait for
+    if props.commandline.monitor or props.commandline.forward:
+        if props.commandline.debug:
+            debug()
+        if props.commandline.monitor:
+            monitor()
+        else:
+            forward()
+        return
+
+    # Options without a matching function (i.e. --repair) only modify other options
+    actions = [k for k, v in props.commandline.__dict__.items() if
+               not k == 'hosts' and getattr(props.commandline, k, None) and callable(globals().get(k))]
+
+    actions.sort(key=lambda k: k not in MODIFIERS)
+
+    if len(roots) > 1:
+        sys.exit(1 if run_roots(roots, actions) else 0)
+
+    run_actions(actions)
+
+
+def run_actions(actions):
+    """Runs the functions named in actions for the root filesystem in settings.PIA_ROOT
+
+    Concurrent runs for the same root are serialized. A run which waited for an identical one
+    reuses its result.
+    """
+    with RunLock(rooted(settings.PIA_LOCK), rooted(settings.PIA_RUN_STATE)) as lock:
+        key = run_key()
+        if lock.reusable(key) and not set(actions) & set(UNCACHED):
+            logger.info('An identical run just finished. Reusing its result.')
+            return
+
+        [globals()[k]() for k in actions]
+
+        # The known hosts are configured, but a misspelled name must not go unnoticed
+        if unknown_hosts:
+            for name in sorted(unknown_hosts):
+                logger.error('%s is not in %s.' % (name, settings.PIA_HOST_LIST))
+            sys.exit(1)
+
+        # Uncached runs are never reused, and a clean --verify writes nothing
+        if not set(actions) & set(UNCACHED):
+            lock.finished(key)
+
+
+def target_roots():
+    """Returns the root filesystems given with --root or --roots-from, or [] for this system
+
+    --roots-from lists one directory per line. Blank lines and lines starting with '#' are skipped.
+    """
+    if props.commandline.root:
+        roots = [props.commandline.root]
+    elif props.commandline.roots_from:
+        try:
+            with open(props.commandline.roots_from) as f:
+                roots = [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+        except OSError as e:
+            logger.error('Cannot read %s: %s' % (props.commandline.roots_from, e))
+            sys.exit(1)
+    else:
+        return []
+
+    roots = list(dict.fromkeys(os.path.abspath(r) for r in roots))
+
+    missing = [r for r in roots if not os.path.isdir(r)]
+    if missing:
+        logger.error('Not a directory: %s' % ', '.join(missing))
+        sys.exit(1)
+
+    return roots
+
+
+def run_roots(roots, actions):
+    """Runs actions for many root filesystems concurrently
+
+    Options which change how the others behave (i.e. --auto-port) run once, here. The host list
+    is then read into memory and each root is handled by a process forked from this one, so
+    pia.conf, the host list and the templates are parsed once for all roots.
+
+    Returns:
+        The list of roots which failed
+    """
+    [globals()[k]() for k in actions if k in MODIFIERS]
+    actions = [k for k in actions if k not in MODIFIERS]
+
+    properties.load_hosts()
+
+    # A fresh fork for every root, so nothing one root loads (i.e. its manifest) leaks into the next
+    context = multiprocessing.get_context('fork')
+    with context.Pool(min(len(roots), os.cpu_count() or 1), maxtasksperchild=1) as pool:
+        results = pool.map(run_root, [(root, actions) for root in roots], chunksize=1)
+
+    failed = [root for root, status in results if status]
+    for root in failed:
+        logger.error('Failed for %s.' % root)
+
+    logger.info('Finished %d of %d root filesystem(s).' % (len(roots) - len(failed), len(roots)))
+    return failed
+
+
+def run_root(job):
+    """Runs actions for one root filesystem in a process started by run_roots()
+
+    Args:
+        job: a tuple of the root filesystem and the names of the actions to run
+
+    Returns:
+        A tuple of the root filesystem and its exit status
+    """
+    root, actions = job
+    settings.PIA_ROOT = root
+
+    try:
+        # Each root may have different applications installed
+        properties.select_apps()
+        if props.commandline.exclude:
+            exclude()
+
+        run_actions(actions)
+    except SystemExit as e:
+        return root, 0 if e.code is None else e.code
+    except Exception as e:
+        logger.error('Cannot configure %s: %s' % (root, e))
+        return root, 1
+    finally:
+        # Pool workers exit without running atexit handlers
+        log.flush()
+
+    return root, 0
+
+
+def run_key():
+    """Computes a digest of everything a run depends on
+
+    This includes the host list, pia.conf, the route list, the credential files of every account
+    (including ones which cannot be read), the templates and the commandline options.
+    """
+    paths = [settings.PIA_HOST_LIST, settings.PIA_CONFIG, settings.LOGIN_CONFIG, props.routes['file']]
+    paths.extend(sorted(properties.find_account_files(props.account_files).values()))
+    if getattr(props.commandline, 'import_bundle', None):
+        paths.append(props.commandline.import_bundle)
+
+    templates = [appstrategy.get_app(a).app.config_template for a in appstrategy.get_supported_apps()]
+    options = sorted((k, repr(v)) for k, v in props.commandline.__dict__.items() if k != 'debug')
+
+    return inputs_digest(paths, __version__, options, *templates)
+
+
+def excluded_apps():
+    """Returns the list of application names given with -e"""
+    return re.split(r'[,\s]+', (props.commandline.exclude or '').strip())
 
 
 def exclude():
     """Excludes applications from being configured."""
-    ex = props.commandline.exclude
-    for e in ex.split():
+    for e in excluded_apps():
         app = appstrategy.get_app(e)
         if app and not app.strategy == 'openvpn':
             app.configure = False
@@ -69,8 +257,9 @@ def set_hosts():
     """Creates custom hosts list
 
     The host list is built from either commandline (by listing them after all other options)
-    or in the config file in '/etc/private-internet-access-vpn' and combines the lists
-    together. This then replaces the openvpn config list on which hosts to modify.
+    or in the config file in '/etc/private-internet-access-vpn'. Hosts given on the commandline
+    replace the openvpn config list on which hosts to modify, in the order given and without
+    duplicates. An empty list means the hosts from the config file (or every host) are used.
 
     """
     configs = list()
@@ -79,11 +268,86 @@ def set_hosts():
     if props.commandline.auto_configure:
         configs.extend(props.commandline.hosts)
 
-    if configs:
-        # Removes any duplicate names
-        openvpn.configs = list(set([re.sub(' ', '_', h.strip()) for h in configs]))
-    else:
-        openvpn.configs = [re.sub(' ', '_', h) for h in properties.get_default_hosts_list(names_only=True)]
+    # Removes any duplicate names, keeping the order they were given in
+    openvpn.configs = list(dict.fromkeys(properties.to_stem(h) for h in configs))
+
+
+def selected_hosts():
+    """Streams the hosts to configure
+
+    Returns:
+        An iterator of Remote(name, fqdn) for the hosts given on the commandline, or else the
+        hosts listed in pia.conf, or else every host in the host list. With --near, only the
+        --count hosts closest to the given point are returned, closest first. Names which are
+        not in the host list are added to unknown_hosts.
+    """
+    hosts = properties.iter_hosts(openvpn.configs or props.configured_hosts, unknown_hosts)
+
+    if not getattr(props.commandline, 'near', None):
+        return hosts
+
+    try:
+        lat, lon = geo.parse_point(props.commandline.near)
+        count = int(props.commandline.count)
+    except ValueError as e:
+        logger.error('Invalid --near or --count: %s' % e)
+        sys.exit(1)
+
+    picked = geo.nearest(hosts, lat, lon, count)
+    for distance, remote in picked:
+        logger.debug('%s is %.0f km away.', remote.name, distance)
+
+    return iter([remote for distance, remote in picked])
+
+
+def selected_profiles():
+    """Streams the profiles to configure: the selected hosts, once for each account
+
+    Returns:
+        An iterator of Remote, see selected_hosts() and properties.iter_profiles()
+    """
+    return properties.iter_profiles(selected_hosts())
+
+
+def auto_port():
+    """Configures the port and protocol which work best on this network
+
+    Every port PIA listens on is probed concurrently on a sample of the selected hosts. The
+    protocol most hosts answered on the fastest is picked, keeping the configured cipher strength
+    if possible. The result is cached for the network (identified by the default gateway's hardware
+    address or the wireless SSID) so later runs on the same network skip probing.
+    """
+    options = props.auto_port
+    cache = network.PortCache(settings.PIA_PORT_CACHE)
+    net = network.network_id()
+
+    port = cache.get(net, float(options['ttl'])) if net else None
+    if port:
+        logger.debug('Using port %s cached for %s.' % (port, net))
+        props.port = port
+        return
+
+    hosts = [r.fqdn for r in selected_hosts()]
+    sample = random.sample(hosts, min(len(hosts), int(options['sample'])))
+    protocols = {p: v['protocol'] for p, v in props.port_lookup.items()}
+
+    results = network.probe_ports(sample, protocols, float(options['timeout']), int(options['workers']))
+    for p, rtts in sorted(results.items()):
+        logger.debug('Port %s/%s answered on %d of %d host(s).' % (p, protocols[p], len(rtts), len(sample)))
+
+    config = props.port_lookup[props.port]['config']
+    port = network.best_port(results, protocols,
+                             sorted(protocols, key=lambda p: props.port_lookup[p]['config'] != config))
+
+    if port is None:
+        logger.warning('No host answered on any port. Keeping port %s.' % props.port)
+        return
+
+    logger.info('Using port %s (%s).' % (port, protocols[port]))
+    props.port = port
+
+    if net:
+        cache.put(net, port)
 
 
 def remove_configurations():
@@ -93,23 +357,109 @@ def remove_configurations():
         app = appstrategy.get_app(app_name)
         app.remove_configs()
 
+    manifest.save()
+
+
+def render_jobs(apps, hosts):
+    """Renders the configuration of each host for each application
+
+    Configurations which cannot be rendered are logged and skipped.
+
+    Yields:
+        A tuple of (app, remote, conf, text, started) for each rendered configuration, where started
+        is the time.monotonic() rendering started
+    """
+    for remote in hosts:
+        for app in apps:
+            started = time.monotonic()
+            try:
+                conf, text = app.app.render(remote)
+            except appstrategy.RenderError as e:
+                logger.warning('Cannot configure %s for %s: %s', remote.name, app.strategy, e,
+                               extra=log.fields(app.strategy, remote.name, 'render', started, 'error'))
+                continue
+            yield app, remote, conf, text, started
+
 
 def auto_configure():
-    """Auto configures applications"""
-    for config in properties.props.hosts:
-        for app_name in appstrategy.get_supported_apps():
-            app = appstrategy.get_app(app_name)
-            if app.configure:
-                logger.debug("Configuring configurations for %s" % app_name)
-                app.config(config)
+    """Auto configures applications
+
+    Hosts are streamed from the host list in batches of COMMIT_BATCH. Each application prepares
+    a batch (i.e. exchanges keys), then the batch is rendered and committed, so memory use does
+    not grow with the size of the host list and files are written in host list order.
+    Applications which write one file for every host (i.e. the kill-switch) write it last. The
+    run exits with status 1 if any configuration could not be written.
+
+    With --lazy, only the profiles are recorded (see pia.conf.lazy) instead of writing a file for
+    every host. 'pia connect' creates them one at a time when they are used.
+    """
+    apps = [appstrategy.get_app(a) for a in appstrategy.get_supported_apps() if appstrategy.get_app(a).configure]
+    per_host = [app for app in apps if app.app.per_host]
+
+    lazy = props.commandline.lazy
+    if lazy:
+        lazy_index.reset([app.strategy for app in per_host])
+        apps = [app for app in apps if not app.app.per_host]
+        per_host = []
+    else:
+        lazy_index.clear()
+    logger.debug("Configuring configurations for %s" % [app.strategy for app in apps])
+
+    # Records for every file are only built when they would be logged
+    verbose = logger.isEnabledFor(logging.DEBUG)
+    failed = 0
+
+    for batch in batched(selected_profiles(), COMMIT_BATCH):
+        for app in apps:
+            started = time.monotonic()
+            app.app.prepare(batch)
+            if verbose:
+                logger.debug('Prepared %d host(s) for %s.', len(batch), app.strategy,
+                             extra=log.fields(app.strategy, None, 'prepare', started, 'ok'))
+
+        for app, remote, conf, text, started in render_jobs(per_host, batch):
+            written = app.commit(conf, text, remote)
+            failed += not written
+            if verbose:
+                logger.debug('%s %s.', 'Wrote' if written else 'Cannot write', conf,
+                             extra=log.fields(app.strategy, remote.name, 'commit', started,
+                                              'written' if written else 'error'))
+        if lazy:
+            lazy_index.add(batch)
+        logger.debug('Committed configurations for %d host(s).', len(batch))
+
+    for app in apps:
+        started = time.monotonic()
+        app.app.finish()
+        if verbose:
+            logger.debug('Finished %s.', app.strategy, extra=log.fields(app.strategy, None, 'finish', started, 'ok'))
+
+    manifest.save()
+    lazy_index.save()
+
+    # Credentials are only kept for one run
+    forget_login_credentials()
+
+    if failed:
+        logger.error('Cannot write %d configuration(s).' % failed)
+        sys.exit(1)
 
 
 def commandline_interface():
     """Configures PIA VPN Services for Connman, Network Manager, and OpenVPN
 
-Usage: pia -a [-d] [-e STRATEGIES] [HOST [HOST]... ]
-       pia -r [-d] [HOST [HOST]... ]
-       pia -l [-d]
+Usage: pia -a [-d] [-e STRATEGIES] [--auto-port] [--near LAT,LON [--count N]] [--lazy]
+              [--root DIR | --roots-from FILE] [--log-format FMT] [HOST [HOST]... ]
+       pia -r [-d] [--root DIR | --roots-from FILE] [--log-format FMT] [HOST [HOST]... ]
+       pia -l [-d] [--root DIR] [--format FMT] [--match GLOB] [--country CC] [--strategy STRATEGIES]
+              [--installed-only]
+       pia --verify [--repair] [-d] [-e STRATEGIES] [--root DIR | --roots-from FILE] [--log-format FMT]
+       pia --export FILE [-d] [-e STRATEGIES] [--log-format FMT]
+       pia --import FILE [-d] [-e STRATEGIES] [--log-format FMT]
+       pia monitor [-d] [--log-format FMT]
+       pia forward [-d] [--log-format FMT]
+       pia connect [-d] [--strategy STRATEGY] [--log-format FMT] HOST
+       pia refresh [-d] [--log-format FMT]
        pia -h | --help
        pia --version
 
@@ -117,13 +467,49 @@ Arguments:
   HOST [HOST]...                       A list of host names to configure
                                        (Example: Japan 'US East' Russia)
 
+Commands:
+  monitor                              Watches running OpenVPN profiles and switches to the
+                                       next profile when one is unhealthy
+  forward                              Keeps a port forwarded for each running OpenVPN and
+                                       WireGuard profile
+  connect                              Creates the configuration of a host recorded by
+                                       pia -a --lazy and starts it
+  refresh                              Looks up the kill-switch endpoints again and lets
+                                       their current addresses through
+
 Options:
   -a, --auto-configure                 Automatically generates configurations
+  --auto-port                          Probes which port and protocol work best on this
+                                       network and configures it
+  --near LAT,LON                       Only configures the hosts closest to a point
+                                       (Example: --near 40.7,-74.0)
+  --count N                            Number of hosts picked by --near [default: 3]
+  --lazy                               Only records the hosts, for pia connect to configure
+                                       when they are used
   -r, --remove-configurations          Removes auto-generated configurations
   -l, --list-configurations            Lists known OpenVPN hosts
+  --format FMT                         Output of -l: text, json or tsv [default: text]
+  --match GLOB                         Only lists hosts whose name matches GLOB, or has words
+                                       starting with the given words (Example: 'US*' or east)
+  --country CC                         Only lists hosts in these countries (Example: US,CA)
+  --strategy STRATEGIES                Only lists configurations of these applications, or
+                                       the application pia connect uses (Example: nm,wg)
+  --installed-only                     Only lists hosts which have configurations
+  --verify                             Reports generated configurations which were changed
+                                       or removed since they were generated
+  --repair                             Rewrites the configurations reported by --verify
+  --export FILE                        Renders configurations for all applications into a
+                                       bundle (.tar, .tar.gz, .tar.xz or .tar.zst)
+  --import FILE                        Verifies a bundle and installs its configurations
+  --root DIR                           Generates configurations into the root filesystem DIR
+                                       (i.e. an image or container tree) instead of /
+  --roots-from FILE                    Generates configurations into every root filesystem
+                                       listed in FILE (one per line) concurrently
   -e STRATEGIES, --exclude STRATEGIES  Excludes modifying the configurations of the listed
                                        program. (Example: -e cm,nm)
   -d, --debug                          enables debug logging to console
+  --log-format FMT                     Log as text to stdout, or as one JSON object per
+                                       record to stderr with json [default: text]
   -h, --help                           show this help message and exit
   --version                            show program's version number and exit
     """
@@ -138,6 +524,9 @@ Options:
         def __setattr__(self, key, value):
             if key == "HOST":
                 object.__setattr__(self, 'hosts', value)
+            elif key in ('--export', '--import'):
+                # 'import' is reserved, so both bundle options get a suffix
+                object.__setattr__(self, key[2:] + '_bundle', value)
             else:
                 # Substitute option names: --an-option-name for an_option_name
                 import re
@@ -157,31 +546,277 @@ Options:
 
 
 def list_configurations():
-    """Prints a list of installed OpenVPN configurations."""
-    lis = properties.get_default_hosts_list(names_only=True)
-    configs = dict()
-
-    # Checks if configuration is installed for a given config_id
-    for c in sorted(lis):
-        config = {'host': re.sub('_', ' ', c), 'openvpn': '', 'apps': ''}
-
-        for app_name in appstrategy.get_supported_apps():
-            app = appstrategy.get_app(app_name)
-            if app.configure and app.find_config(c):
-                logger.debug('Configuring %s for %s' % (c, app.strategy))
-                if app_name == 'openvpn':
-                    config['openvpn'] = '*'
-                else:
-                    config['apps'] += '[' + app_name + ']'
-        configs[c] = config
+    """Prints the hosts in the host list and the applications configured for them
 
+    Rows are printed one at a time as a table, a JSON array or tab-separated values (--format).
+    Profiles of every account are found through an index of their names (--match) and countries
+    (--country) and may be limited to those with configurations (--installed-only) of some
+    applications (--strategy).
+    """
+    options = props.commandline
+
+    writer = LIST_FORMATS.get(options.format)
+    if writer is None:
+        logger.error('Unknown format %s. Use one of: %s.' % (options.format, ', '.join(LIST_FORMATS)))
+        sys.exit(1)
+
+    strategies = listed_strategies()
+
+    properties.parse_accounts()
+    properties.parse_connman()
+
+    # Scans each application's configuration directory once
+    installed = {app_name: appstrategy.get_app(app_name).installed_configs() for app_name in strategies}
+
+    index = HostIndex(properties.iter_profiles(properties.iter_hosts()))
+    rows = ((r, [a for a in strategies if r.name in installed[a]])
+            for r in sorted(index.search(options.match, options.country), key=lambda r: r.name))
+
+    if options.installed_only:
+        rows = ((r, apps) for r, apps in rows if apps)
+
+    try:
+        writer(rows, strategies)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # The reader went away (i.e. pia -l | head). Nothing is left to print to.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+
+    sys.exit()
+
+
+def listed_strategies():
+    """Returns the applications given with --strategy, or else the ones which are configured"""
+    supported = appstrategy.get_supported_apps()
+
+    if not props.commandline.strategy:
+        return [a for a in supported if appstrategy.get_app(a).configure]
+
+    strategies = [s for s in re.split(r'[,\s]+', props.commandline.strategy.strip()) if s]
+    unknown = [s for s in strategies if s not in supported]
+    if unknown:
+        logger.error('Unknown strategy %s. Use one of: %s.' % (', '.join(unknown), ', '.join(supported)))
+        sys.exit(1)
+
+    return strategies
+
+
+def print_text(rows, strategies):
+    """Prints rows of (remote, installed applications) as a table, marking OpenVPN with '*'"""
     print("List of OpenVPN configurations")
-    for c in configs:
-        if configs[c]['openvpn']:
-            print('  {openvpn} {host} {apps}'.format(**configs[c]))
+    for remote, apps in rows:
+        others = ''.join('[' + a + ']' for a in apps if a != 'openvpn')
+        if 'openvpn' in apps:
+            print('  * %s %s' % (remote.name, others))
         else:
-            print('    {host} {apps}'.format(**configs[c]))
-    sys.exit()
+            print('    %s %s' % (remote.name, others))
+
+
+def print_json(rows, strategies):
+    """Prints rows of (remote, installed applications) as a JSON array, one host per line"""
+    # Each row is printed once the next one is known, so the last one gets no comma
+    print('[')
+    previous = None
+    for remote, apps in rows:
+        if previous is not None:
+            print('  %s,' % previous)
+        previous = json.dumps({'host': remote.name, 'fqdn': remote.fqdn, 'country': remote.country,
+                               'lat': remote.lat, 'lon': remote.lon, 'installed': apps}, sort_keys=True)
+    if previous is not None:
+        print('  %s' % previous)
+    print(']')
+
+
+def print_tsv(rows, strategies):
+    """Prints rows of (remote, installed applications) as tab-separated values with a 1/0 column per application"""
+    print('\t'.join(['host', 'fqdn', 'country'] + strategies))
+    for remote, apps in rows:
+        print('\t'.join([remote.name, remote.fqdn, remote.country or ''] +
+                        ['1' if a in apps else '0' for a in strategies]))
+
+
+# Output of pia -l for each --format
+LIST_FORMATS = {'text': print_text, 'json': print_json, 'tsv': print_tsv}
+
+
+def verify():
+    """Reports configurations which differ from what would be generated
+
+    Exits with status 1 if any configuration differs, unless --repair was given in which case
+    only the configurations which differ are rewritten.
+    """
+    drifted = 0
+
+    # Only --repair registers keys again for WireGuard regions whose peer data expired
+    wireguard.session.cached_only = not props.commandline.repair
+
+    for app_name in appstrategy.get_supported_apps():
+        app = appstrategy.get_app(app_name)
+        if not app.configure:
+            continue
+
+        for config_id, conf, text, reasons in app.find_drift(selected_profiles()):
+            drifted += 1
+            print('  %s: %s (%s)' % (app_name, rooted(conf), ', '.join(reasons)))
+
+            if props.commandline.repair:
+                app.commit(conf, text, config_id)
+
+    if not drifted:
+        logger.debug('All configurations match.')
+    elif props.commandline.repair:
+        manifest.save()
+        logger.info('Repaired %d configuration(s).' % drifted)
+    else:
+        sys.exit(1)
+
+
+def export_bundle():
+    """Renders configurations for every application into a bundle
+
+    Applications are rendered whether or not they are installed on this machine, so the bundle
+    can be imported on any node. Files covering every host (i.e. the kill-switch) are specific
+    to the machine which loads them and are left out.
+    """
+    apps = [appstrategy.get_app(a) for a in appstrategy.get_supported_apps()
+            if a not in excluded_apps() and appstrategy.get_app(a).app.per_host]
+
+    try:
+        count = bundle.export_bundle(props.commandline.export_bundle, apps, selected_profiles())
+    except (OSError, bundle.BundleError) as e:
+        logger.error('Cannot export bundle: %s' % e)
+        sys.exit(1)
+
+    logger.info('Exported %d configuration(s) to %s.' % (count, props.commandline.export_bundle))
+
+
+def import_bundle():
+    """Installs the configurations from a bundle for each configured application"""
+    apps = [appstrategy.get_app(a) for a in appstrategy.get_supported_apps()
+            if a not in excluded_apps() and appstrategy.get_app(a).configure]
+
+    try:
+        written, skipped = bundle.import_bundle(props.commandline.import_bundle, apps)
+    except bundle.BundleError as e:
+        # Records any configurations written before one failed
+        manifest.save()
+        logger.error('Cannot import bundle: %s' % e)
+        sys.exit(1)
+
+    manifest.save()
+    logger.info('Imported %d configuration(s), %d unchanged.' % (written, skipped))
+
+
+def monitor():
+    """Watches running OpenVPN profiles through their management sockets
+
+    Profiles are ranked in the order pia -a configures them (see selected_profiles()), limited to
+    the OpenVPN profiles which are installed. An unhealthy profile is replaced by the next one.
+    """
+    installed = props.openvpn.installed_configs()
+    ranked = [r.stem for r in selected_profiles() if r.name in installed]
+    logger.debug('Failover order: %s' % ranked)
+
+    health.Monitor(ranked, props.monitor).run()
+
+
+def refresh():
+    """Looks up the host names of the kill-switch again and updates its sets
+
+    PIA moves its host names to other addresses, while the kill-switch only lets through the ones
+    they resolved to when it was generated. Run before a tunnel starts (i.e. from ExecStartPre of
+    its unit), this lets OpenVPN reach the addresses it will resolve. As the rules stay the same,
+    only set elements are added and removed (see pia.applications.firewall.apply()).
+    """
+    app = appstrategy.get_app('nft')
+    if not app.configure:
+        logger.error('The kill-switch is not enabled.')
+        sys.exit(1)
+
+    for batch in batched(selected_profiles(), COMMIT_BATCH):
+        app.app.prepare(batch)
+    app.app.finish()
+
+    manifest.save()
+
+
+def connect():
+    """Creates the configuration of one profile recorded by pia -a --lazy and starts it
+
+    Only the one file is rendered and committed. Configurations created this way which were not
+    connected for the [connect] ttl are removed, unless their tunnel is still running (see
+    StrategicAlternative.is_active()). The start command for the application comes from
+    the [connect] section, with {name}, {id} and {conf} replaced.
+    """
+    options = props.connect
+    strategy = props.commandline.strategy or options['strategy']
+
+    remote = lazy_index.find(props.commandline.hosts[0])
+    if remote is None:
+        logger.error('%s is not a known host. Run pia -a --lazy first.' % props.commandline.hosts[0])
+        sys.exit(1)
+
+    if strategy not in lazy_index.strategies:
+        logger.error('Unknown strategy %s. Use one of: %s.' % (strategy, ', '.join(lazy_index.strategies)))
+        sys.exit(1)
+
+    app = appstrategy.get_app(strategy)
+
+    try:
+        app.app.prepare([remote])
+        conf, text = app.app.render(remote)
+    except appstrategy.RenderError as e:
+        logger.error('Cannot configure %s for %s: %s' % (remote.name, strategy, e))
+        sys.exit(1)
+
+    # An unchanged file is not written again, so connecting does not touch the disk
+    try:
+        changed = app.app.compare(conf, text, os.stat(rooted(conf)), *app.app.conf_owner)
+    except FileNotFoundError:
+        changed = True
+
+    if changed and not app.commit(conf, text, remote):
+        sys.exit(1)
+
+    lazy_index.touch(conf, strategy, remote)
+
+    for path in lazy_index.expired(float(options['ttl'])):
+        entry = lazy_index.created[path]
+        expired = appstrategy.get_app(entry['strategy'])
+        profile = lazy_index.find(entry['profile'])
+
+        if profile is not None and expired.app.is_active(profile):
+            logger.debug('Keeping %s, its tunnel is running.' % path)
+            continue
+
+        if expired.remove_config(path):
+            logger.debug('Removed %s, not connected for %ss.' % (path, options['ttl']))
+            lazy_index.forget(path)
+
+    manifest.save()
+    lazy_index.save()
+
+    values = {'name': remote.stem, 'id': remote.name, 'conf': conf}
+    for line in options[strategy].splitlines():
+        cmd = [arg.format(**values) for arg in shlex.split(line)]
+        try:
+            subprocess.run(cmd, check=True, timeout=60)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.error('Cannot run %s: %s' % (' '.join(cmd), e))
+            sys.exit(1)
+
+
+def forward():
+    """Keeps a port forwarded for every running tunnel of the generated profiles
+
+    Tunnels are found among the profiles pia -a configures (see selected_profiles()), through the
+    OpenVPN management sockets and the wg-quick interfaces.
+    """
+    wg = appstrategy.get_app('wg')
+
+    portforward.Forwarder(list(selected_profiles()), props.port_forward, props.monitor['socket_dir'],
+                          wg if wg and wg.configure else None).run()
 
 
 def debug():
@@ -1 +1 @@
-from . import log, misc
+from . import log, misc, lock
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+#    Private Internet Access Configuration auto-configures VPN files for PIA
+#    Copyright (C) 2016  Jesse Spangenberger <azulephoenix[at]gmail[dot]com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+import marshal
+import mmap
+import os
+
+from pia.utils.misc import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Changes whenever the rows stored in snapshots change
+VERSION = 2
+
+# Snapshots larger than this are mapped into memory instead of read
+MMAP_THRESHOLD = 1 << 20
+
+
+def _key(source, st):
+    """Returns the first line of a snapshot of source, which identifies the version it was made from"""
+    return ('PIAC %d %d %d %d %s\n' % (VERSION, marshal.version, st.st_size, st.st_mtime_ns, source)).encode()
+
+
+def load(source, snapshot):
+    """Loads the rows of a snapshot, if it was made from the current version of source
+
+    The snapshot is read in one step, or mapped into memory when it is large.
+
+    Args:
+        source: path of the text file the snapshot was made from
+        snapshot: path of the snapshot
+
+    Returns:
+        The list of rows given to save(), or None if the snapshot is missing or stale
+    """
+    try:
+        key = _key(source, os.stat(source))
+
+        with open(snapshot, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > MMAP_THRESHOLD:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m, memoryview(m) as view:
+                    if view[:len(key)] != key:
+                        return None
+                    with view[len(key):] as rows:
+                        return marshal.loads(rows)
+
+            data = f.read()
+    except OSError:
+        return None
+    except (EOFError, ValueError, TypeError):
+        logger.debug('Ignoring damaged snapshot %s.', snapshot)
+        return None
+
+    if not data.startswith(key):
+        return None
+
+    try:
+        return marshal.loads(memoryview(data)[len(key):])
+    except (EOFError, ValueError, TypeError):
+        logger.debug('Ignoring damaged snapshot %s.', snapshot)
+        return None
+
+
+def save(source, st, rows, snapshot):
+    """Writes a snapshot of rows parsed from source
+
+    Args:
+        source: path of the text file the rows were parsed from
+        st: os.stat_result of source taken before it was parsed
+        rows: list of tuples of strings, numbers and None
+        snapshot: path of the snapshot
+
+    Raises:
+        OSError: problems writing the snapshot
+    """
+    os.makedirs(os.path.dirname(snapshot), exist_ok=True)
+    atomic_write(snapshot, _key(source, st) + marshal.dumps(rows), 0o644)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+#    Private Internet Access Configuration auto-configures VPN files for PIA
+#    Copyright (C) 2016  Jesse Spangenberger <azulephoenix[at]gmail[dot]com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import heapq
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# Mean radius of the earth in kilometers
+EARTH_RADIUS = 6371.0088
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def parse_point(value):
+    """Parses a 'LAT,LON' string
+
+    Returns:
+        A tuple of latitude and longitude in degrees
+
+    Raises:
+        ValueError: value is not two numbers or is out of range
+    """
+    lat, lon = (float(v) for v in value.split(','))
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('%s is not a valid latitude and longitude' % value)
+    return lat, lon
+
+
+def distances(lat, lon, points):
+    """Computes the great-circle distance from one point to many with the haversine formula
+
+    All distances are computed in one vectorized step with NumPy when it is installed
+    (pip install pia[geo]), otherwise one point at a time.
+
+    Args:
+        lat: latitude of the origin in degrees
+        lon: longitude of the origin in degrees
+        points: list of (latitude, longitude) tuples in degrees
+
+    Returns:
+        A list of distances in kilometers, in the order of points
+    """
+    np = _numpy()
+
+    if np is not None and points:
+        p = np.radians(np.asarray(points, dtype=float))
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        a = (np.sin((p[:, 0] - lat1) / 2) ** 2 +
+             math.cos(lat1) * np.cos(p[:, 0]) * np.sin((p[:, 1] - lon1) / 2) ** 2)
+        return (2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))).tolist()
+
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    cos_lat1 = math.cos(lat1)
+    result = []
+
+    for plat, plon in points:
+        lat2, lon2 = math.radians(plat), math.radians(plon)
+        a = math.sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+        result.append(2 * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.0))))
+
+    return result
+
+
+def nearest(remotes, lat, lon, count):
+    """Picks the hosts closest to a point
+
+    Hosts without coordinates in the host list are skipped.
+
+    Args:
+        remotes: iterable of Remote(name, fqdn, country, lat, lon)
+        lat: latitude of the point in degrees
+        lon: longitude of the point in degrees
+        count: number of hosts to pick
+
+    Returns:
+        A list of (distance, Remote) tuples for at most count hosts, closest first
+    """
+    located = [r for r in remotes if r.lat is not None and r.lon is not None]
+
+    if not located:
+        logger.warning('The host list has no coordinates. Cannot pick hosts near %s,%s.' % (lat, lon))
+        return []
+
+    dist = distances(lat, lon, [(r.lat, r.lon) for r in located])
+
+    # Ties keep host list order
+    return [(d, located[i]) for d, i in heapq.nsmallest(count, ((d, i) for i, d in enumerate(dist)))]
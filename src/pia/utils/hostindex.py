@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+#    Private Internet Access Configuration auto-configures VPN files for PIA
+#    Copyright (C) 2016  Jesse Spangenberger <azulephoenix[at]gmail[dot]com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import bisect
+import fnmatch
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Characters which make a --match pattern a glob instead of a list of words
+_WILDCARDS = re.compile(r'[*?[]')
+
+# Sorts after any text starting with the same prefix
+_HIGHEST = '\U0010ffff'
+
+
+def tokenize(name):
+    """Splits a host name into lowercase words (i.e. ['us', 'east'] for "US_East")"""
+    return [t for t in re.split(r'[\s_\-,.()/]+', name.lower()) if t]
+
+
+class HostIndex(object):
+    """Index of the host list for searching hosts by name and country
+
+    Built once from the host list. Lowercase names and the words in them are kept in sorted
+    lists searched with bisect, so a prefix finds its hosts without looking at the others.
+    Countries are kept in a dictionary. Only the hosts the index narrows a search down to are
+    matched against a glob.
+
+    Attributes:
+        @remotes: the indexed hosts, in host list order
+    """
+
+    def __init__(self, remotes):
+        self.remotes = list(remotes)
+        self._names = sorted((r.name.lower(), i) for i, r in enumerate(self.remotes))
+        self._tokens = sorted((t, i) for i, r in enumerate(self.remotes) for t in set(tokenize(r.name)))
+        self._countries = {}
+
+        for i, r in enumerate(self.remotes):
+            if r.country:
+                self._countries.setdefault(r.country.upper(), []).append(i)
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (self.__class__.__name__, 'hosts', len(self.remotes))
+
+    @staticmethod
+    def _prefixed(pairs, prefix):
+        """Returns the ids in a sorted list of (text, id) pairs whose text starts with prefix"""
+        lo = bisect.bisect_left(pairs, (prefix,))
+        hi = bisect.bisect_left(pairs, (prefix + _HIGHEST,), lo)
+        return {i for _, i in pairs[lo:hi]}
+
+    def match(self, pattern):
+        """Finds hosts by name, ignoring case
+
+        A pattern with wildcards (*, ? or [...]) is matched against the whole name. Otherwise
+        each word of the pattern must start a word of the name (i.e. "east" and "us e" match
+        "US East").
+
+        Returns:
+            A set of indexes into remotes
+        """
+        pattern = pattern.lower()
+
+        if not _WILDCARDS.search(pattern):
+            ids = None
+            for word in tokenize(pattern):
+                found = self._prefixed(self._tokens, word)
+                ids = found if ids is None else ids & found
+            return set(range(len(self.remotes))) if ids is None else ids
+
+        literal = _WILDCARDS.split(pattern, 1)[0]
+        candidates = self._prefixed(self._names, literal) if literal else range(len(self.remotes))
+        regex = re.compile(fnmatch.translate(pattern))
+
+        return {i for i in candidates if regex.match(self.remotes[i].name.lower())}
+
+    def country(self, codes):
+        """Finds hosts in any of a comma-separated list of country codes
+
+        Returns:
+            A set of indexes into remotes
+        """
+        ids = set()
+        for code in codes.split(','):
+            ids.update(self._countries.get(code.strip().upper(), ()))
+        return ids
+
+    def search(self, match=None, country=None):
+        """Finds the hosts matching every filter given
+
+        Args:
+            match: name pattern (see match())
+            country: comma-separated list of country codes (see country())
+
+        Returns:
+            A list of Remote, in host list order
+        """
+        ids = None
+
+        if match:
+            ids = self.match(match)
+
+        if country:
+            found = self.country(country)
+            ids = found if ids is None else ids & found
+
+        if ids is None:
+            return list(self.remotes)
+
+        return [self.remotes[i] for i in sorted(ids)]
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+#    Private Internet Access Configuration auto-configures VPN files for PIA
+#    Copyright (C) 2016  Jesse Spangenberger <azulephoenix[at]gmail[dot]com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+
+from pia.utils.misc import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+def inputs_digest(paths, *extra):
+    """Computes a digest identifying the inputs of a run
+
+    Args:
+        paths: files whose contents are part of the inputs (missing files are allowed)
+        extra: strings which are part of the inputs (i.e. templates and commandline options)
+
+    Returns:
+        The sha256 hex digest of all inputs
+    """
+    h = hashlib.sha256()
+
+    for path in paths:
+        h.update(path.encode() + b'\0')
+        try:
+            with open(path, 'rb') as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        except OSError:
+            h.update(b'-')
+
+    for e in extra:
+        h.update(b'\0' + str(e).encode())
+
+    return h.hexdigest()
+
+
+class RunLock(object):
+    """Cross-process lock serializing pia runs.
+
+    Only one process holds the lock at a time. A process which had to wait for the lock may
+    reuse the result of the run it waited for when both runs have the same inputs:
+
+        with RunLock(settings.PIA_LOCK, settings.PIA_RUN_STATE) as lock:
+            if lock.reusable(key):
+                return
+            ...
+            lock.finished(key)
+
+    Attributes:
+        @waited: True if another run held the lock when this one started
+    """
+
+    def __init__(self, path, state_path):
+        self._path = path
+        self._state_path = state_path
+        self._fd = None
+        self._started = None
+        self.waited = False
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (self.__class__.__name__, 'path', self._path)
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._started = time.time()
+
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info('Another pia run is in progress. Waiting for it to finish.')
+            self.waited = True
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    def reusable(self, key):
+        """Checks if the run this process waited for had the same inputs
+
+        Args:
+            key: digest of the inputs of this run
+
+        Returns:
+            True if a run with the same inputs finished while this process was waiting
+        """
+        if not self.waited:
+            return False
+
+        try:
+            with open(self._state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        return state.get('key') == key and state.get('finished', 0) >= self._started
+
+    def finished(self, key):
+        """Records that a run with the inputs key completed successfully"""
+        try:
+            atomic_write(self._state_path, json.dumps({'key': key, 'finished': time.time()}))
+        except OSError:
+            logger.warning('Cannot write %s.' % self._state_path)
@@ -15,22 +15,146 @@
 #
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import atexit
+import json
 import logging
+import os
+import queue
 import sys
+import time
 import logging.config
+from logging.handlers import QueueHandler, QueueListener
 from pia.conf import settings
 
 from pia.conf.properties import props
 
+# Record attributes, given with extra=, which JsonFormatter writes as fields of their own
+FIELDS = ('strategy', 'host', 'phase', 'duration', 'outcome')
+
+# Output formats of configure_logging()
+FORMATS = ('text', 'json')
+
+# Writes the records the 'pia' logger puts on its queue (see configure_logging())
+_listener = None
+
+
+def configure_logging(fmt='text'):
+    """Configures logging from settings.LOGGING
+
+    The handlers of the 'pia' logger are moved behind a queue. Records are put on it by a
+    DeferredQueueHandler and formatted and written by a QueueListener thread, so neither holds
+    up the code which logs.
+
+    Args:
+        fmt: 'text', or 'json' to write one JSON object per record to stderr instead
+    """
+    global _listener
 
-def configure_logging():
     if not sys.warnoptions:
         # Route warnings through python logging
         logging.captureWarnings(True)
 
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
     if settings.LOGGING:
         logging.config.dictConfig(settings.LOGGING)
 
+    pia_logger = logging.getLogger('pia')
+    handlers = pia_logger.handlers[:]
+
+    if fmt == 'json':
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter())
+        handlers = [handler]
+
+    if not handlers:
+        return
+
+    records = queue.SimpleQueue()
+    pia_logger.handlers = [DeferredQueueHandler(records)]
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def flush():
+    """Waits until every queued record is written"""
+    if _listener is not None:
+        _listener.stop()
+        _listener.start()
+
+
+def _after_fork():
+    # The listener thread is not copied into a forked process, so the child gets its own
+    global _listener
+
+    if _listener is not None:
+        records = queue.SimpleQueue()
+        for handler in logging.getLogger('pia').handlers:
+            if isinstance(handler, QueueHandler):
+                handler.queue = records
+        _listener = QueueListener(records, *_listener.handlers, respect_handler_level=True)
+        _listener.start()
+
+
+def _stop():
+    if _listener is not None:
+        _listener.stop()
+
+
+atexit.register(_stop)
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def fields(strategy=None, host=None, phase=None, started=None, outcome=None):
+    """Builds the extra= fields of a record
+
+    Args:
+        strategy: name of the application (i.e. "nm")
+        host: name of the host (i.e. "US East")
+        phase: step of the run (i.e. "prepare", "render" or "commit")
+        started: time.monotonic() when the step started. The duration in milliseconds is recorded.
+        outcome: result of the step (i.e. "written" or "error")
+    """
+    return {'strategy': strategy, 'host': host, 'phase': phase, 'outcome': outcome,
+            'duration': None if started is None else round((time.monotonic() - started) * 1000, 3)}
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Puts records on the queue as they were logged
+
+    QueueHandler formats the message on the thread which logs and drops the exception, so the
+    handlers behind the queue could not format it themselves (i.e. JsonFormatter's 'exception').
+    The record keeps its arguments and exception here and is formatted by the listener.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a JSON object on one line
+
+    Attributes named in FIELDS (see fields()) are written when they are set.
+    """
+
+    def format(self, record):
+        entry = {'time': round(record.created, 6),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'message': record.getMessage()}
+
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
 
 class RequireDebugFalse(logging.Filter):
     def filter(self, record):
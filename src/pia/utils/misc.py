@@ -15,24 +15,40 @@
 #
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import functools
+import grp
+import hashlib
 import os
+import pwd
 import re
 import stat
 import pathlib
 import logging
+import tempfile
+
+from pia.conf import settings
 
 logger = logging.getLogger(__name__)
 
 
-def has_proper_permissions(filepath):
-    """Checks of file has 0600 permission and owned by root"""
+def has_proper_permissions(filepath, mode=0o600, uid=0, gid=None):
+    """Checks of file has 0600 permission and owned by root
+
+    Args:
+        filepath: file to check
+        mode: permission bits the file must have
+        uid: user id which must own the file
+        gid: group id which must own the file (not checked if None)
+    """
     try:
         st = os.stat(filepath)
-
-        return bool(st.st_uid == 0 & st.st_gid == 0 & int(oct(stat.S_IMODE(os.stat(filepath).st_mode)) == "0o600"))
     except FileNotFoundError:
         raise FileNotFoundError(filepath + " not found!")
 
+    return (st.st_uid == uid and
+            (gid is None or st.st_gid == gid) and
+            stat.S_IMODE(st.st_mode) == mode)
+
 
 def multiple_replace(dictionary, text):
     """Replaces keys on a single pass
@@ -47,27 +63,160 @@ def multiple_replace(dictionary, text):
     return regex.sub(lambda mo: dictionary[mo.string[mo.start():mo.end()]], text)
 
 
-def get_login_credentials(login_config):
-    """Loads login credentials from file
+def content_digest(text):
+    """Returns the sha256 hex digest of a configuration file's text"""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def atomic_write(filepath, text, mode=0o600):
+    """Writes text to a file by replacing it in a single step
+
+    The text is written to a temporary file in the same directory, flushed to disk and
+    renamed over filepath. Readers will see either the old file or the new one, never
+    a partially written file.
+
+    Args:
+        filepath: full path of the file to write
+        text: contents of the file, as str or bytes
+        mode: permissions of the new file
+
+    Raises:
+        OSError: problems writing or renaming the temporary file
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filepath) or '.',
+                               prefix='.' + os.path.basename(filepath) + '.')
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(text, bytes) else 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, mode)
+        os.replace(tmp, filepath)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def rooted(path):
+    """Returns where a path of the root filesystem being configured is on this machine
+
+    Paths are written into configurations as seen from settings.PIA_ROOT, so only reading and
+    writing files goes through this.
+    """
+    if settings.PIA_ROOT == '/':
+        return path
+    return os.path.join(settings.PIA_ROOT, path.lstrip('/'))
+
+
+def _read_ids(path, name):
+    try:
+        with open(path) as f:
+            for line in f:
+                fields = line.split(':')
+                if len(fields) > 2 and fields[0] == name:
+                    return int(fields[2])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def lookup_owner(root, user, group):
+    """Resolves a user and group name to ids in a root filesystem
+
+    Names are looked up in the root's /etc/passwd and /etc/group, or through the system's
+    user database when root is '/'.
+
+    Returns:
+        A tuple of uid and gid. Either is None when the name is unknown.
+    """
+    if root == '/':
+        try:
+            uid = pwd.getpwnam(user).pw_uid
+        except KeyError:
+            uid = None
+
+        try:
+            gid = grp.getgrnam(group).gr_gid
+        except KeyError:
+            gid = None
+
+        return uid, gid
+
+    return (_read_ids(os.path.join(root, 'etc/passwd'), user),
+            _read_ids(os.path.join(root, 'etc/group'), group))
+
+
+# Credentials read during a run, by file (see get_login_credentials())
+_credentials = {}
+
+
+def read_login_credentials(login_config):
+    """Reads login credentials from file, every time it is called
 
     Returns:
         A list containing username and password for login service.
+
+    Raises:
+        OSError: the file cannot be read, or is not owned by root or is world readable
+        ValueError: the file does not have a username and a password
     """
-    try:
-        if not has_proper_permissions(login_config):
-            logger.error('%s must be owned by root and not world readable!' % login_config)
-            exit(1)
-    except FileNotFoundError as e:
-        logger.error('%s Auto-configuration failed!' % e.args)
-        exit(1)
+    if not has_proper_permissions(login_config):
+        raise PermissionError('%s must be owned by root and not world readable!' % login_config)
 
     p = pathlib.Path(login_config)
 
     # Opens login.conf and reads login and passwords from file
     with p.open() as f:
-        content = f.read().splitlines()
+        content = list(filter(bool, f.read().splitlines()))
+
+    if len(content) < 2:
+        raise ValueError('%s must have a username and a password!' % login_config)
+
+    return content[:2]
+
+
+def get_login_credentials(login_config):
+    """Loads login credentials from file, exiting if they cannot be read
+
+    Each file is read once per run, however many profiles use it, until forget_login_credentials()
+    is called. Processes which keep running (i.e. pia forward) use read_login_credentials() instead,
+    so changed credentials are picked up.
+
+    Returns:
+        A list containing username and password for login service.
+    """
+    if login_config not in _credentials:
+        try:
+            _credentials[login_config] = read_login_credentials(login_config)
+        except FileNotFoundError as e:
+            logger.error('%s Auto-configuration failed!' % e.args)
+            exit(1)
+        except (OSError, ValueError) as e:
+            logger.error(str(e))
+            exit(1)
+
+    return _credentials[login_config]
+
+
+def forget_login_credentials():
+    """Drops the credentials read during a run, so the next run reads them again"""
+    _credentials.clear()
+
 
-    return list(filter(bool, content))
+def batched(iterable, size):
+    """Groups an iterable into lists of at most size items"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
 def is_sequence(arg):
@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+
+#    Private Internet Access Configuration auto-configures VPN files for PIA
+#    Copyright (C) 2016  Jesse Spangenberger <azulephoenix[at]gmail[dot]com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import errno
+import json
+import logging
+import os
+import socket
+import statistics
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pia.utils.misc import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Network interfaces which exist, such as the ones wg-quick creates
+SYS_NET = '/sys/class/net'
+
+
+def has_interface(name):
+    """Checks if a network interface exists"""
+    return os.path.exists(os.path.join(SYS_NET, name))
+
+
+def is_listening(path):
+    """Checks if something accepts connections on a unix socket, so it is not left from a dead process"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(path)
+            return True
+        except OSError:
+            return False
+
+
+def active_connections():
+    """Returns the names of NetworkManager's active connections, or an empty set if nmcli cannot tell"""
+    try:
+        out = subprocess.run(['nmcli', '-t', '-f', 'NAME', 'connection', 'show', '--active'],
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.debug('Cannot list active connections: %s' % e)
+        return set()
+    # Terse output escapes colons in names
+    return {line.replace('\\:', ':') for line in out.decode(errors='replace').splitlines() if line}
+
+
+def default_gateway(route='/proc/net/route'):
+    """Returns the IPv4 address of the default gateway, or None"""
+    try:
+        with open(route) as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2 and fields[1] == '00000000' and fields[2] != '00000000':
+                    return socket.inet_ntoa(int(fields[2], 16).to_bytes(4, 'little'))
+    except (OSError, StopIteration, ValueError):
+        pass
+    return None
+
+
+def gateway_mac(gateway, arp='/proc/net/arp'):
+    """Returns the hardware address of the gateway from the ARP table, or None"""
+    try:
+        with open(arp) as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if len(fields) > 3 and fields[0] == gateway and fields[3] != '00:00:00:00:00:00':
+                    return fields[3].lower()
+    except (OSError, StopIteration):
+        pass
+    return None
+
+
+def wifi_ssid():
+    """Returns the SSID of the connected wireless network, or None"""
+    try:
+        ssid = subprocess.run(['iwgetid', '-r'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              timeout=2).stdout.decode(errors='replace').strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return ssid or None
+
+
+def network_id():
+    """Identifies the network this machine is on
+
+    Returns:
+        'gw:<mac>' for the default gateway's hardware address, else 'ssid:<name>' for the
+        wireless network, else None if the network cannot be identified
+    """
+    gateway = default_gateway()
+    mac = gateway_mac(gateway) if gateway else None
+    if mac:
+        return 'gw:' + mac
+
+    ssid = wifi_ssid()
+    if ssid:
+        return 'ssid:' + ssid
+
+    return None
+
+
+# OpenVPN P_CONTROL_HARD_RESET_CLIENT_V2 with key id 0, no acks and packet id 0. Servers without
+# tls-auth answer it with P_CONTROL_HARD_RESET_SERVER_V2.
+_HARD_RESET_CLIENT = 0x38
+_HARD_RESET_SERVER = 0x40
+
+
+def probe_tcp(address, port, timeout):
+    """Returns the seconds taken to open a TCP connection, or None if it fails"""
+    start = time.monotonic()
+    try:
+        with socket.create_connection((address, int(port)), timeout=timeout):
+            return time.monotonic() - start
+    except OSError:
+        return None
+
+
+def probe_udp(address, port, timeout):
+    """Returns the seconds an OpenVPN server takes to answer a hard reset over UDP, or None"""
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+
+    with socket.socket(family, socket.SOCK_DGRAM) as s:
+        s.settimeout(timeout)
+        start = time.monotonic()
+        try:
+            s.sendto(bytes([_HARD_RESET_CLIENT]) + os.urandom(8) + bytes(5), (address, int(port)))
+            data = s.recv(1500)
+        except OSError:
+            return None
+
+    if not data or data[0] >> 3 != _HARD_RESET_SERVER >> 3:
+        return None
+
+    return time.monotonic() - start
+
+
+# Socket options for path MTU discovery on Linux, where the socket module does not define them
+_IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+_IPV6_MTU_DISCOVER = getattr(socket, 'IPV6_MTU_DISCOVER', 23)
+_PMTUDISC_DO = 2
+
+# IP packet sizes probed for the path MTU, largest first
+MTU_SIZES = (1500, 1492, 1480, 1472, 1460, 1450, 1440, 1420, 1400, 1380, 1360, 1340, 1320, 1300, 1280)
+
+
+def probe_mtu(address, port, timeout, sizes=MTU_SIZES):
+    """Finds the largest UDP payload which reaches an endpoint without being fragmented
+
+    Packets of decreasing size are sent with the don't fragment flag. A packet larger than the
+    MTU of the route, or than a path MTU the kernel learned from an ICMP "fragmentation needed"
+    message, cannot be sent (EMSGSIZE) and the next size is tried. A packet only fits when the
+    server answers the hard reset or the host refuses the port. Silence is not taken as proof,
+    since a router dropping the packet without an ICMP error looks the same, so the next size is
+    tried after timeout seconds.
+
+    Args:
+        address: IP address of the endpoint
+        port: UDP port to send to
+        timeout: seconds to wait for an answer after each packet
+        sizes: IP packet sizes to try, largest first
+
+    Returns:
+        The size of the UDP payload which fits, or None if the endpoint cannot be reached
+    """
+    v6 = ':' in address
+    headers = 48 if v6 else 28
+
+    with socket.socket(socket.AF_INET6 if v6 else socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            s.setsockopt(socket.IPPROTO_IPV6 if v6 else socket.IPPROTO_IP,
+                         _IPV6_MTU_DISCOVER if v6 else _IP_MTU_DISCOVER, _PMTUDISC_DO)
+            s.connect((address, int(port)))
+        except OSError as e:
+            logger.debug('Cannot probe the path MTU to %s: %s' % (address, e))
+            return None
+
+        s.settimeout(timeout)
+
+        for size in sizes:
+            payload = size - headers
+            try:
+                s.send(bytes([_HARD_RESET_CLIENT]) + os.urandom(8) + bytes(payload - 9))
+                data = s.recv(65535)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if e.errno == errno.EMSGSIZE:
+                    continue
+                if e.errno == errno.ECONNREFUSED:
+                    return payload
+                logger.debug('Cannot probe the path MTU to %s: %s' % (address, e))
+                return None
+
+            if data and data[0] >> 3 == _HARD_RESET_SERVER >> 3:
+                return payload
+
+    return None
+
+
+def probe_mtus(targets, port, timeout=1.0, workers=16):
+    """Probes the path MTU to every endpoint concurrently (see probe_mtu())
+
+    Args:
+        targets: dictionary of keys to the IP address or host name of each endpoint
+        port: UDP port to send to
+        timeout: seconds to wait for an answer after each packet
+        workers: number of endpoints probed at once
+
+    Returns:
+        A dictionary of keys to the largest UDP payload which fits, leaving out endpoints which
+        could not be reached
+    """
+    def probe(target):
+        address = target if _is_address(target) else _resolve(target)
+        return probe_mtu(address, port, timeout) if address else None
+
+    keys = list(targets)
+    if not keys:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return {k: mtu for k, mtu in zip(keys, pool.map(probe, [targets[k] for k in keys])) if mtu}
+
+
+def _is_address(host):
+    try:
+        socket.inet_pton(socket.AF_INET6 if ':' in host else socket.AF_INET, host)
+        return True
+    except OSError:
+        return False
+
+
+def _resolve(fqdn):
+    try:
+        return socket.getaddrinfo(fqdn, None, proto=socket.IPPROTO_TCP)[0][4][0]
+    except OSError as e:
+        logger.debug('Cannot resolve %s: %s' % (fqdn, e))
+        return None
+
+
+def probe_ports(fqdns, ports, timeout=2.0, workers=16):
+    """Probes every port on every host concurrently
+
+    Args:
+        fqdns: host names to probe
+        ports: dictionary of port numbers to protocols ('tcp' or 'udp')
+        timeout: seconds to wait for each probe
+        workers: number of probes in flight at once
+
+    Returns:
+        A dictionary of ports to the list of round trip times of the hosts which answered
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        addresses = [a for a in pool.map(_resolve, fqdns) if a]
+
+        futures = [(port, pool.submit(probe_tcp if proto == 'tcp' else probe_udp, address, port, timeout))
+                   for port, proto in ports.items() for address in addresses]
+
+        results = {port: [] for port in ports}
+        for port, future in futures:
+            rtt = future.result()
+            if rtt is not None:
+                results[port].append(rtt)
+
+    return results
+
+
+def best_port(results, protocols, order=()):
+    """Picks the fastest protocol, then a port for it
+
+    The protocol is the one with the most hosts answering, then the lowest median time. Among its
+    ports which as many hosts answered on, the first one in order is picked.
+
+    Args:
+        results: dictionary of ports to round trip times (see probe_ports())
+        protocols: dictionary of port numbers to protocols ('tcp' or 'udp')
+        order: ports in order of preference (i.e. ones with the configured cipher first)
+
+    Returns:
+        The port, or None if no host answered on any port
+    """
+    working = [p for p, rtts in results.items() if rtts]
+    if not working:
+        return None
+
+    fastest = min(working, key=lambda p: (-len(results[p]), statistics.median(results[p])))
+    candidates = [p for p in working
+                  if protocols[p] == protocols[fastest] and len(results[p]) == len(results[fastest])]
+    order = list(order)
+
+    return min(candidates, key=lambda p: order.index(p) if p in order else len(order))
+
+
+def families(fqdn):
+    """Resolves a host name and classifies it by the IP versions it has addresses for
+
+    Returns:
+        A dictionary of IP versions (4 or 6) to the first address of each, empty if the host name
+        does not resolve
+    """
+    found = {}
+
+    try:
+        infos = socket.getaddrinfo(fqdn, None, proto=socket.IPPROTO_UDP)
+    except OSError as e:
+        logger.debug('Cannot resolve %s: %s' % (fqdn, e))
+        return found
+
+    for family, _, _, _, sockaddr in infos:
+        found.setdefault(6 if family == socket.AF_INET6 else 4, sockaddr[0].split('%')[0])
+
+    return found
+
+
+def classify(fqdns, workers=16):
+    """Resolves host names concurrently (see families())
+
+    Returns:
+        A dictionary of host names to their addresses by IP version
+    """
+    fqdns = list(fqdns)
+    if not fqdns:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(fqdns, pool.map(families, fqdns)))
+
+
+def probe_families(addresses, port, protocol, timeout=2.0, workers=16):
+    """Probes an OpenVPN port on addresses of each IP version concurrently
+
+    Args:
+        addresses: dictionary of IP versions (4 or 6) to lists of addresses to probe
+        port: port number to probe
+        protocol: 'tcp' or 'udp'
+        timeout: seconds to wait for each probe
+        workers: number of probes in flight at once
+
+    Returns:
+        A dictionary of IP versions to the list of round trip times of the addresses which answered
+    """
+    probe = probe_tcp if protocol == 'tcp' else probe_udp
+    results = {version: [] for version in addresses}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [(version, pool.submit(probe, address, port, timeout))
+                   for version, found in addresses.items() for address in found]
+
+        for version, future in futures:
+            rtt = future.result()
+            if rtt is not None:
+                results[version].append(rtt)
+
+    return results
+
+
+def family_order(results, head_start=0.05):
+    """Orders IP versions the way happy eyeballs (RFC 8305) does
+
+    IPv6 goes first when it answered as many hosts as IPv4 and its median time is at most
+    head_start seconds slower. Otherwise IPv4 goes first, so a network which drops IPv6 never
+    waits for IPv6 to time out.
+
+    Args:
+        results: dictionary of IP versions to round trip times (see probe_families())
+        head_start: seconds IPv6 may be slower and still go first
+
+    Returns:
+        A list of IP versions, the ones which did not answer last, or None if none answered
+    """
+    answered = {v: rtts for v, rtts in results.items() if rtts}
+    if not answered:
+        return None
+
+    v4, v6 = answered.get(4), answered.get(6)
+    if v6 and (not v4 or (len(v6) >= len(v4) and
+                          statistics.median(v6) <= statistics.median(v4) + head_start)):
+        return [6, 4]
+    return [4, 6]
+
+
+class PortCache(object):
+    """Values picked for a network, keyed by network (see network_id())
+
+    Used for the ports picked by --auto-port and for the order of IP versions (see family_order()).
+    """
+
+    def __init__(self, path, field='port'):
+        self._path = path
+        self._field = field
+
+    def __repr__(self):
+        return '<%s %s:%s>' % (self.__class__.__name__, 'path', self._path)
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, network, ttl):
+        """Returns the value cached for network if it is younger than ttl seconds, or None"""
+        entry = self._load().get(network)
+        if entry and time.time() - entry.get('time', 0) < ttl:
+            return entry.get(self._field)
+        return None
+
+    def put(self, network, value):
+        cache = self._load()
+        cache[network] = {self._field: value, 'time': time.time()}
+
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            atomic_write(self._path, json.dumps(cache, indent=1, sort_keys=True))
+        except OSError:
+            logger.warning('Cannot write %s.' % self._path)
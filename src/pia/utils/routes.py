@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+#    Private Internet Access Configuration auto-configures VPN files for PIA
+#    Copyright (C) 2016  Jesse Spangenberger <azulephoenix[at]gmail[dot]com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+import re
+import socket
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# A route to send through the VPN. address is the network address as a string.
+Route = namedtuple('Route', 'version address length')
+
+_FAMILIES = {4: (socket.AF_INET, 32), 6: (socket.AF_INET6, 128)}
+
+
+def parse_prefix(prefix):
+    """Parses a prefix such as '10.1.0.0/16', '2001:db8::/32' or a single address
+
+    Host bits are ignored, so '10.1.2.3/16' is the same as '10.1.0.0/16'.
+
+    Returns:
+        A tuple of the IP version and the first and last address of the prefix as integers
+
+    Raises:
+        ValueError: prefix is not a valid address or prefix length
+    """
+    address, _, length = prefix.partition('/')
+    version = 6 if ':' in address else 4
+    family, bits = _FAMILIES[version]
+
+    try:
+        n = int.from_bytes(socket.inet_pton(family, address), 'big')
+    except OSError:
+        raise ValueError('%s is not a valid address' % prefix)
+
+    length = int(length) if length else bits
+    if not 0 <= length <= bits:
+        raise ValueError('%s has an invalid prefix length' % prefix)
+
+    host = (1 << (bits - length)) - 1
+    return version, n & ~host, n | host
+
+
+def merge(ranges):
+    """Merges overlapping and adjacent (first, last) ranges
+
+    Returns:
+        A sorted list of disjoint ranges which are not adjacent to each other
+    """
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1][1] = last
+        else:
+            merged.append([first, last])
+    return merged
+
+
+def to_prefixes(first, last, bits):
+    """Splits a range of addresses into the fewest prefixes which cover exactly that range
+
+    Yields:
+        A tuple of the network address as an integer and the prefix length
+    """
+    while first <= last:
+        # The largest block aligned on first which does not go past last
+        size = (first & -first) if first else 1 << bits
+        while size > last - first + 1:
+            size >>= 1
+        yield first, bits - size.bit_length() + 1
+        first += size
+
+
+def aggregate(prefixes, strict=True):
+    """Collapses prefixes into the minimal set of prefixes covering the same addresses
+
+    Overlapping, nested and adjacent prefixes are merged. Addresses are handled as integers, so
+    lists of hundreds of thousands of prefixes collapse in well under a second.
+
+    Args:
+        prefixes: iterable of prefix strings (see parse_prefix())
+        strict: raise on invalid prefixes instead of logging and skipping them
+
+    Returns:
+        A list of Route(version, address, length), IPv4 first, each sorted by address
+
+    Raises:
+        ValueError: a prefix is not valid
+    """
+    ranges = {4: [], 6: []}
+    for prefix in prefixes:
+        try:
+            version, first, last = parse_prefix(prefix)
+        except ValueError as e:
+            if strict:
+                raise
+            logger.warning('Skipping route: %s' % e)
+            continue
+        ranges[version].append((first, last))
+
+    routes = []
+    for version in (4, 6):
+        family, bits = _FAMILIES[version]
+        for first, last in merge(ranges[version]):
+            for network, length in to_prefixes(first, last, bits):
+                address = socket.inet_ntop(family, network.to_bytes(bits // 8, 'big'))
+                routes.append(Route(version, address, length))
+
+    return routes
+
+
+def read_prefixes(path):
+    """Streams the prefixes in a route list, one per line. '#' starts a comment.
+
+    Raises:
+        OSError: the route list cannot be read
+    """
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                yield line
+
+
+def load(path, inline=''):
+    """Reads and aggregates the routes from a route list and a comma-separated list of prefixes
+
+    A missing route list is the same as an empty one. Invalid prefixes are logged and skipped.
+
+    Returns:
+        A list of Route(version, address, length) (see aggregate())
+    """
+    prefixes = [p for p in re.split(r'[,\s]+', inline) if p]
+
+    try:
+        prefixes.extend(read_prefixes(path))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning('Cannot read route list %s: %s' % (path, e))
+
+    routes = aggregate(prefixes, strict=False)
+    logger.debug('Aggregated %d prefix(es) into %d route(s).' % (len(prefixes), len(routes)))
+    return routes
+
+
+def netmask(length):
+    """Returns the dotted IPv4 netmask for a prefix length (i.e. 255.255.0.0 for 16)"""
+    return socket.inet_ntoa((((1 << 32) - 1) ^ ((1 << (32 - length)) - 1)).to_bytes(4, 'big'))
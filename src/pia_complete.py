@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+#    Private Internet Access Configuration auto-configures VPN files for PIA
+#    Copyright (C) 2016  Jesse Spangenberger <azulephoenix[at]gmail[dot]com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Completes host names for pia from the name index pia writes
+
+This module is kept outside the pia package and only uses the standard library, because importing
+pia detects the installed applications. The index is written by
+pia.conf.properties.update_name_index() whenever the host list changes.
+
+Usage: pia-complete [PREFIX]
+"""
+import sys
+
+# Same as pia.conf.settings.PIA_NAME_INDEX
+NAME_INDEX = '/var/lib/pia/names.txt'
+
+
+def complete(prefix, path=NAME_INDEX):
+    """Finds the host names starting with prefix, ignoring case
+
+    Spaces in prefix match underscores and quotes are ignored, so "'us e" finds "US_East".
+
+    Returns:
+        A list of host names with underscores instead of spaces, in host list order
+    """
+    prefix = prefix.strip('\'"').replace(' ', '_').lower()
+
+    try:
+        with open(path) as f:
+            return [n for n in f.read().splitlines() if n and n[0] != '#' and n.lower().startswith(prefix)]
+    except OSError:
+        return []
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    names = complete(argv[0] if argv else '')
+
+    if names:
+        sys.stdout.write('\n'.join(names) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
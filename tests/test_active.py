@@ -0,0 +1,37 @@
+"""Running tunnels, which pia connect keeps when their configuration expires"""
+import socket
+
+from pia.applications import appstrategy
+from pia.conf import properties
+from pia.utils import network
+
+US_EAST = properties.Remote('US East', 'us-east.example')
+
+
+def test_openvpn_is_active_while_its_management_socket_listens(tmp_path, monkeypatch):
+    monkeypatch.setitem(properties.props.monitor, 'socket_dir', str(tmp_path))
+    app = appstrategy.get_app('openvpn').app
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.bind(app.management_path(US_EAST))
+        s.listen(1)
+        assert app.is_active(US_EAST)
+
+    # Left behind by an OpenVPN which died
+    assert not app.is_active(US_EAST)
+
+
+def test_wireguard_is_active_while_its_interface_exists(monkeypatch):
+    app = appstrategy.get_app('wg').app
+    monkeypatch.setattr(network, 'SYS_NET', '/nonexistent')
+    assert not app.is_active(US_EAST)
+
+    monkeypatch.setattr(network, 'has_interface', lambda name: name == 'US_East')
+    assert app.is_active(US_EAST)
+
+
+def test_networkmanager_is_active_while_its_connection_is_up(monkeypatch):
+    monkeypatch.setattr(network, 'active_connections', lambda: {'US East WireGuard'})
+
+    assert appstrategy.get_app('nmwg').app.is_active(US_EAST)
+    assert not appstrategy.get_app('nm').app.is_active(US_EAST)
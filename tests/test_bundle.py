@@ -0,0 +1,83 @@
+"""Bundles with broken manifests and exports which fail half way"""
+import io
+import json
+import tarfile
+
+import pytest
+
+from pia.applications import appstrategy, bundle
+from pia.conf import properties, settings
+from pia.utils.misc import content_digest
+
+TEXT = 'client\n'
+
+
+def write_bundle(path, files, members):
+    with tarfile.open(str(path), 'w') as tar:
+        for name, text in list(members.items()) + [(bundle.BUNDLE_MANIFEST, json.dumps(
+                {'version': bundle.BUNDLE_VERSION, 'files': files}))]:
+            data = text.encode()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def entry(**changes):
+    return dict({'strategy': 'openvpn', 'host': 'US East', 'port': '1198', 'template': 'abc',
+                 'digest': content_digest(TEXT)}, **changes)
+
+
+@pytest.mark.parametrize('bad', [None, [], entry(strategy=None), entry(digest=1), {'strategy': 'openvpn'}])
+def test_malformed_manifest_entry_is_a_bundle_error(tmp_path, bad):
+    path = tmp_path / 'pia.tar'
+    write_bundle(path, {'openvpn/US_East.conf': bad}, {'openvpn/US_East.conf': TEXT})
+
+    with pytest.raises(bundle.BundleError):
+        bundle.read_bundle(str(path))
+
+
+def test_manifest_which_is_not_an_object_is_a_bundle_error(tmp_path):
+    path = tmp_path / 'pia.tar'
+    with tarfile.open(str(path), 'w') as tar:
+        info = tarfile.TarInfo(bundle.BUNDLE_MANIFEST)
+        info.size = 2
+        tar.addfile(info, io.BytesIO(b'[]'))
+
+    with pytest.raises(bundle.BundleError):
+        bundle.read_bundle(str(path))
+
+
+def test_failed_export_keeps_the_previous_bundle(tmp_path):
+    path = tmp_path / 'pia.tar'
+    path.write_text('previous')
+
+    class Broken(object):
+        strategy = 'broken'
+
+        class app(object):
+            @staticmethod
+            def prepare(remotes):
+                raise RuntimeError('cannot prepare')
+
+    with pytest.raises(RuntimeError):
+        bundle.export_bundle(str(path), [Broken()], [properties.Remote('US East', 'us-east.example')])
+
+    assert path.read_text() == 'previous'
+    assert [p.name for p in tmp_path.iterdir()] == ['pia.tar']
+
+
+def test_exported_bundle_imports_into_another_root(tmp_path, monkeypatch):
+    path = tmp_path / 'pia.tar.gz'
+    app = appstrategy.get_app('openvpn')
+    remotes = [properties.Remote('US East', 'us-east.example'), properties.Remote('Japan', 'japan.example')]
+
+    assert bundle.export_bundle(str(path), [app], remotes) == 2
+
+    root = tmp_path / 'root'
+    (root / app.app.conf_dir.lstrip('/')).mkdir(parents=True)
+    monkeypatch.setattr(settings, 'PIA_ROOT', str(root))
+    monkeypatch.setattr(app.app, 'commit', lambda conf, text, config_id=None, port=None:
+                        (root / conf.lstrip('/')).write_text(text) or True)
+
+    assert bundle.import_bundle(str(path), [app]) == (2, 0)
+    assert sorted(p.name for p in (root / app.app.conf_dir.lstrip('/')).iterdir()) == ['Japan.conf', 'US_East.conf']
@@ -0,0 +1,48 @@
+"""Sections of pia.conf read into their options"""
+import logging
+
+import pytest
+
+from pia.conf import properties
+
+PIA_CONF = """[mtu]
+discover = yes
+timeout = 2 
+bogus = 1
+
+[accounts]
+work = /etc/private-internet-access/work.conf
+"""
+
+
+@pytest.fixture
+def conf(tmp_path, monkeypatch):
+    path = tmp_path / 'pia.conf'
+    path.write_text(PIA_CONF)
+    monkeypatch.setattr(properties.props, '_conf_file', str(path))
+    monkeypatch.setattr(properties.props, 'conf_section', {})
+    monkeypatch.setattr(properties.props, '_mtu', dict(properties.props.mtu))
+    monkeypatch.setattr(properties.props, '_account_files', {})
+    return path
+
+
+def test_known_options_are_read_and_unknown_ones_reported(conf, caplog):
+    with caplog.at_level(logging.WARNING):
+        assert properties._read_section('mtu', properties.props.mtu) is not None
+
+    assert properties.props.mtu['discover'] == 'yes'
+    assert properties.props.mtu['timeout'] == '2'
+    assert 'bogus' not in properties.props.mtu
+    assert 'Option bogus is not a [mtu] option.' in caplog.text
+
+
+def test_missing_section_keeps_the_defaults(conf):
+    options = dict(properties.props.firewall)
+
+    assert properties._read_section('firewall', options) is None
+    assert options == properties.props.firewall
+
+
+def test_accounts_keep_every_option(conf):
+    properties.parse_accounts()
+    assert properties.props.account_files == {'work': '/etc/private-internet-access/work.conf'}
@@ -0,0 +1,49 @@
+"""Consolidated connman provisioning file"""
+import os
+
+import pytest
+
+from pia.applications import appstrategy
+from pia.conf import properties, settings
+
+US_EAST = properties.Remote('US East', 'us-east.example')
+JAPAN = properties.Remote('Japan', 'japan.example')
+
+
+@pytest.fixture
+def cm(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'PIA_ROOT', str(tmp_path))
+    monkeypatch.setitem(properties.props.connman, 'consolidate', 'yes')
+    app = appstrategy.get_app('cm').app
+    (tmp_path / app.conf_dir.lstrip('/')).mkdir(parents=True)
+    return app
+
+
+def configure(app, remotes):
+    app.prepare(remotes)
+    conf, text = app.render()
+    app._sections = []
+    with open(settings.PIA_ROOT + conf, 'w') as f:
+        f.write(text)
+    os.chmod(settings.PIA_ROOT + conf, app._CONF_MODE)
+    return text
+
+
+def test_configuring_one_host_keeps_the_others(cm):
+    both = configure(cm, [US_EAST, JAPAN])
+
+    assert configure(cm, [JAPAN]) == both
+    assert list(cm.installed_sections()) == ['US_East', 'Japan']
+
+
+def test_new_hosts_are_added_after_the_others(cm):
+    configure(cm, [JAPAN])
+    configure(cm, [US_EAST])
+
+    assert list(cm.installed_sections()) == ['Japan', 'US_East']
+
+
+def test_checking_one_host_does_not_report_the_others(cm):
+    configure(cm, [US_EAST, JAPAN])
+
+    assert cm.find_drift([JAPAN]) == []
@@ -0,0 +1,34 @@
+"""Credentials of login.conf and the accounts in accounts.d"""
+import os
+
+from pia.conf import properties, settings
+from pia.utils import misc
+
+
+def credentials(path, text, mode=0o600):
+    path.write_text(text)
+    os.chmod(str(path), mode)
+    return str(path)
+
+
+def test_bad_account_files_are_skipped(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'PIA_ACCOUNTS_DIR', str(tmp_path))
+    credentials(tmp_path / 'home.conf', 'user\npass\n')
+    credentials(tmp_path / 'open.conf', 'user\npass\n', mode=0o644)
+    credentials(tmp_path / 'empty.conf', '\n')
+
+    accounts = properties.load_accounts({'gone': str(tmp_path / 'missing.conf')})
+
+    assert [a.name for a in accounts] == ['home']
+
+
+def test_credentials_are_read_again_after_a_run(tmp_path):
+    path = credentials(tmp_path / 'login.conf', 'user\nold\n')
+    assert misc.get_login_credentials(path) == ['user', 'old']
+
+    credentials(tmp_path / 'login.conf', 'user\nnew\n')
+    assert misc.get_login_credentials(path) == ['user', 'old']
+
+    misc.forget_login_credentials()
+    assert misc.get_login_credentials(path) == ['user', 'new']
+    misc.forget_login_credentials()
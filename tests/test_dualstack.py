@@ -0,0 +1,143 @@
+"""IPv4 and IPv6 endpoints probed on loopback and rendered into OpenVPN configurations"""
+import socket
+
+import pytest
+
+from pia.applications import appstrategy, hooks
+from pia.conf import properties, settings
+from pia.utils import network
+
+DUAL = properties.Remote('Loopback', 'localhost', v4='127.0.0.1', v6='::1')
+NAMED = properties.Remote('US East', 'us-east.example')
+
+
+def listen(address, port=0):
+    """Returns a TCP listener on a loopback address, or None if the address cannot be bound"""
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    s = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        s.bind((address, port))
+    except OSError:
+        s.close()
+        return None
+    s.listen(8)
+    return s
+
+
+@pytest.fixture
+def listeners():
+    """Starts TCP listeners on 127.0.0.1 and, when asked, on ::1 with the same port"""
+    sockets = []
+
+    def start(v6=True):
+        for _ in range(10):
+            v4 = listen('127.0.0.1')
+            port = v4.getsockname()[1]
+            other = listen('::1', port) if v6 else None
+            if other or not v6:
+                sockets.extend(s for s in (v4, other) if s)
+                return port
+            v4.close()
+        pytest.skip('Cannot listen on ::1')
+
+    yield start
+
+    for s in sockets:
+        s.close()
+
+
+@pytest.fixture
+def openvpn(tmp_path, monkeypatch):
+    """OpenVPN strategy connecting over TCP, with no IP version order found yet"""
+    monkeypatch.setattr(settings, 'PIA_CAPABILITIES', str(tmp_path / 'capabilities.json'))
+    monkeypatch.setattr(settings, 'PIA_FAMILY_CACHE', str(tmp_path / 'families.json'))
+    monkeypatch.setattr(hooks, 'get_login_credentials', lambda login_config: ('user', 'pass'))
+    monkeypatch.setattr(network, 'network_id', lambda: 'gw:00:00:5e:00:53:01')
+    monkeypatch.setattr(properties.props, '_protocol', 'tcp')
+    monkeypatch.setattr(properties.props, '_dual_stack', dict(properties.Props._dual_stack_defaults))
+    properties.props.dual_stack['timeout'] = '0.5'
+
+    app = appstrategy.get_app('openvpn').app
+    monkeypatch.setattr(app, '_families', {})
+    monkeypatch.setattr(app, '_order', None)
+    return app
+
+
+def remotes(app, remote):
+    """Returns the remote lines of a rendered configuration"""
+    text = app.render(remote)[1].splitlines()
+    return [line for line in text if line.startswith(('remote ', 'server-poll-timeout'))]
+
+
+def test_probe_families_times_each_version(listeners):
+    port = listeners()
+    results = network.probe_families({4: ['127.0.0.1'], 6: ['::1']}, port, 'tcp', 0.5)
+
+    assert len(results[4]) == len(results[6]) == 1
+
+
+def test_probe_families_leaves_out_refused_addresses(listeners):
+    port = listeners(v6=False)
+    results = network.probe_families({4: ['127.0.0.1'], 6: ['::1']}, port, 'tcp', 0.5)
+
+    assert len(results[4]) == 1
+    assert results[6] == []
+
+
+@pytest.mark.parametrize('results, order', [
+    ({4: [0.020], 6: [0.030]}, [6, 4]),
+    ({4: [0.020], 6: [0.080]}, [4, 6]),
+    ({4: [0.020, 0.020], 6: [0.010]}, [4, 6]),
+    ({4: [], 6: [0.500]}, [6, 4]),
+    ({4: [0.500], 6: []}, [4, 6]),
+    ({4: [], 6: []}, None),
+])
+def test_family_order_gives_ipv6_a_head_start(results, order):
+    assert network.family_order(results, head_start=0.05) == order
+
+
+def test_ipv6_goes_first_when_both_answer(openvpn, listeners, monkeypatch):
+    port = listeners()
+    monkeypatch.setattr(properties.props, '_port', str(port))
+
+    openvpn.prepare([DUAL])
+    assert remotes(openvpn, DUAL) == ['remote ::1 %d tcp6' % port, 'remote 127.0.0.1 %d tcp4' % port,
+                                      'server-poll-timeout 5']
+
+
+def test_ipv4_goes_first_when_ipv6_does_not_answer(openvpn, listeners, monkeypatch):
+    port = listeners(v6=False)
+    monkeypatch.setattr(properties.props, '_port', str(port))
+
+    openvpn.prepare([DUAL])
+    assert remotes(openvpn, DUAL) == ['remote 127.0.0.1 %d tcp4' % port, 'remote ::1 %d tcp6' % port,
+                                      'server-poll-timeout 5']
+
+
+def test_order_is_cached_for_the_network(openvpn, listeners, monkeypatch):
+    port = listeners(v6=False)
+    monkeypatch.setattr(properties.props, '_port', str(port))
+    openvpn.prepare([DUAL])
+
+    # Later runs on the same network keep the order without probing
+    monkeypatch.setattr(network, 'probe_families', pytest.fail)
+    monkeypatch.setattr(openvpn, '_order', None)
+    openvpn.prepare([DUAL])
+    assert openvpn._order == [4, 6]
+
+
+def test_prefer_skips_probing(openvpn, monkeypatch):
+    monkeypatch.setattr(network, 'probe_families', pytest.fail)
+    monkeypatch.setattr(properties.props, '_port', '502')
+    properties.props.dual_stack['prefer'] = '6'
+
+    openvpn.prepare([DUAL])
+    assert remotes(openvpn, DUAL)[:2] == ['remote ::1 502 tcp6', 'remote 127.0.0.1 502 tcp4']
+
+
+def test_hosts_without_addresses_render_as_before(openvpn, monkeypatch):
+    monkeypatch.setattr(network, 'probe_families', pytest.fail)
+    monkeypatch.setattr(properties.props, '_port', '502')
+
+    openvpn.prepare([NAMED])
+    assert remotes(openvpn, NAMED) == ['remote us-east.example 502']
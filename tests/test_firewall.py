@@ -0,0 +1,53 @@
+"""Kill-switch rulesets whose host names moved to other addresses"""
+from pia.applications import firewall
+
+RULESET = """table inet pia_killswitch {
+	set endpoints4 {
+		type ipv4_addr
+%s
+	}
+
+	set endpoints6 {
+		type ipv6_addr
+	}
+
+	set tunnels {
+		type ifname
+%s
+	}
+
+	chain output {
+		type filter hook output priority 0; policy drop;
+%s
+	}
+}
+"""
+
+
+def ruleset(addresses, tunnels=('"wg0"',), rules='\t\tip daddr @endpoints4 accept'):
+    return RULESET % (firewall.format_elements(addresses), firewall.format_elements(tunnels), rules)
+
+
+def test_resolve_leaves_host_names_out_without_lookup():
+    assert firewall.resolve(['10.0.0.1', 'us-east.example', 'fd00::1'], lookup=False) == ({'10.0.0.1'}, {'fd00::1'})
+
+
+def test_moved_host_names_are_not_drift():
+    listed = ({'10.0.0.1'}, set())
+    old = ruleset({'10.0.0.1', '192.0.2.1'})
+    new = ruleset({'10.0.0.1', '192.0.2.99'})
+
+    assert firewall.only_resolved_differ(old, new, listed)
+
+
+def test_missing_listed_address_is_drift():
+    listed = ({'10.0.0.1', '10.0.0.2'}, set())
+    assert not firewall.only_resolved_differ(ruleset({'10.0.0.1'}), ruleset({'10.0.0.1', '10.0.0.2'}), listed)
+
+
+def test_changed_rules_or_interfaces_are_drift():
+    listed = ({'10.0.0.1'}, set())
+    old = ruleset({'10.0.0.1'})
+
+    assert not firewall.only_resolved_differ(old, ruleset({'10.0.0.1'}, rules='\t\tip daddr 10.0.0.0/8 accept'), listed)
+    assert not firewall.only_resolved_differ(old, ruleset({'10.0.0.1'}, tunnels=('"wg1"',)), listed)
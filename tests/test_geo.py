@@ -0,0 +1,37 @@
+"""Hosts picked by distance with --near"""
+import pytest
+
+from pia.conf import properties
+from pia.utils import geo
+
+NEW_YORK = properties.Remote('US East', 'us-east.example', 'US', 40.71, -74.01)
+CHICAGO = properties.Remote('US Chicago', 'chicago.example', 'US', 41.88, -87.63)
+TOKYO = properties.Remote('Japan', 'japan.example', 'JP', 35.68, 139.69)
+UNKNOWN = properties.Remote('US West', 'us-west.example')
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(geo, '_numpy', lambda: None)
+
+
+def test_distances_are_great_circle_kilometers(backend):
+    new_york, tokyo = geo.distances(41.88, -87.63, [(40.71, -74.01), (35.68, 139.69)])
+
+    assert new_york == pytest.approx(1145, rel=0.01)
+    assert tokyo == pytest.approx(10150, rel=0.01)
+
+
+def test_nearest_hosts_come_first_and_unlocated_ones_are_skipped(backend):
+    picked = [r for d, r in geo.nearest([TOKYO, UNKNOWN, CHICAGO, NEW_YORK], 42.36, -71.06, 2)]
+
+    assert picked == [NEW_YORK, CHICAGO]
+
+
+def test_point_must_be_in_range():
+    assert geo.parse_point('35.68,139.69') == (35.68, 139.69)
+    with pytest.raises(ValueError):
+        geo.parse_point('135,0')
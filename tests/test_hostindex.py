@@ -0,0 +1,88 @@
+"""Searching the host list with pia -l --match and --country"""
+import argparse
+import json
+
+import pytest
+
+from pia import run
+from pia.conf import properties
+from pia.utils.hostindex import HostIndex
+
+HOSTS = [properties.Remote('US East', 'us-east.example', 'US', 40.71, -74.01),
+         properties.Remote('US West', 'us-west.example', 'US'),
+         properties.Remote('UK London', 'uk-london.example', 'GB'),
+         properties.Remote('UK Southampton', 'uk-southampton.example', 'GB'),
+         properties.Remote('Japan', 'japan.example', 'JP'),
+         properties.Remote('East Timor', 'east-timor.example')]
+
+
+@pytest.fixture
+def index():
+    return HostIndex(HOSTS)
+
+
+def names(remotes):
+    return [r.name for r in remotes]
+
+
+@pytest.mark.parametrize('pattern, expected', [
+    ('east', ['US East', 'East Timor']),
+    ('us e', ['US East']),
+    ('US', ['US East', 'US West']),
+    ('uk s', ['UK Southampton']),
+    ('lon', ['UK London']),
+    ('ondon', []),
+])
+def test_words_of_a_pattern_start_words_of_the_name(index, pattern, expected):
+    assert names(index.search(match=pattern)) == expected
+
+
+@pytest.mark.parametrize('pattern, expected', [
+    ('uk*', ['UK London', 'UK Southampton']),
+    ('*on', ['UK London', 'UK Southampton']),
+    ('us ?est', ['US West']),
+    ('[jt]*', ['Japan']),
+])
+def test_globs_match_the_whole_name(index, pattern, expected):
+    assert names(index.search(match=pattern)) == expected
+
+
+def test_filters_are_combined(index):
+    assert names(index.search(country='gb, jp')) == ['UK London', 'UK Southampton', 'Japan']
+    assert names(index.search(match='east', country='US')) == ['US East']
+    assert names(index.search()) == names(HOSTS)
+
+
+def rows():
+    return iter([(HOSTS[0], ['openvpn', 'nm']), (HOSTS[5], [])])
+
+
+def test_json_output_is_one_array(capsys):
+    run.print_json(rows(), ['openvpn', 'nm'])
+    hosts = json.loads(capsys.readouterr().out)
+
+    assert hosts == [{'host': 'US East', 'fqdn': 'us-east.example', 'country': 'US', 'lat': 40.71, 'lon': -74.01,
+                      'installed': ['openvpn', 'nm']},
+                     {'host': 'East Timor', 'fqdn': 'east-timor.example', 'country': None, 'lat': None,
+                      'lon': None, 'installed': []}]
+
+
+def test_empty_json_output_is_an_empty_array(capsys):
+    run.print_json(iter([]), [])
+    assert json.loads(capsys.readouterr().out) == []
+
+
+def test_tsv_output_has_a_column_per_application(capsys):
+    run.print_tsv(rows(), ['openvpn', 'nm'])
+
+    assert capsys.readouterr().out.splitlines() == ['host\tfqdn\tcountry\topenvpn\tnm',
+                                                    'US East\tus-east.example\tUS\t1\t1',
+                                                    'East Timor\teast-timor.example\t\t0\t0']
+
+
+def test_unknown_format_is_an_error(monkeypatch):
+    monkeypatch.setattr(properties.props, 'commandline', argparse.Namespace(format='xml'), raising=False)
+
+    with pytest.raises(SystemExit) as e:
+        run.list_configurations()
+    assert e.value.code == 1
@@ -0,0 +1,29 @@
+"""Hosts selected by name from the host list"""
+from pia.conf import properties, settings
+
+HOSTS = [('US East', 'us-east.example', 'US', 40.71, -74.01, 'US_East', None, None),
+         ('Japan', 'japan.example', 'JP', 35.68, 139.69, 'Japan', None, None)]
+
+
+def test_names_not_in_the_host_list_are_reported(monkeypatch):
+    monkeypatch.setattr(properties, '_hosts', list(HOSTS))
+    unknown = set()
+
+    hosts = [r.name for r in properties.iter_hosts(['japan', 'Japan', 'Atlantis', 'US_East'], unknown)]
+
+    assert hosts == ['US East', 'Japan']
+    assert unknown == {'japan', 'Atlantis'}
+
+
+def test_hosts_are_not_kept_once_yielded(tmp_path, monkeypatch):
+    host_list = tmp_path / 'vpn-hosts.txt'
+    host_list.write_text(''.join('%s,%s\n' % (h[0], h[1]) for h in HOSTS))
+    monkeypatch.setattr(settings, 'PIA_HOST_LIST', str(host_list))
+    monkeypatch.setattr(settings, 'PIA_HOST_CACHE', str(tmp_path / 'hosts.cache'))
+    monkeypatch.setattr(properties, '_hosts', None)
+
+    first = list(properties.iter_hosts())
+    second = list(properties.iter_hosts())
+
+    assert first == second and first[0] is not second[0]
+    assert all(type(row) is tuple for row in properties._hosts)
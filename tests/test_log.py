@@ -0,0 +1,35 @@
+"""Records formatted behind the logging queue"""
+import json
+import logging
+import queue
+
+from pia.utils import log
+
+
+def queued(logger_name, emit):
+    records = queue.SimpleQueue()
+    logger = logging.getLogger(logger_name)
+    logger.propagate = False
+    logger.handlers = [log.DeferredQueueHandler(records)]
+    emit(logger)
+    return records.get_nowait()
+
+
+def test_exception_reaches_the_json_formatter():
+    def emit(logger):
+        try:
+            raise ValueError('bad port')
+        except ValueError:
+            logger.exception('Cannot probe %s.', 'US East')
+
+    entry = json.loads(log.JsonFormatter().format(queued('test.log.exception', emit)))
+
+    assert entry['message'] == 'Cannot probe US East.'
+    assert 'ValueError: bad port' in entry['exception']
+
+
+def test_message_is_formatted_by_the_listener():
+    record = queued('test.log.args', lambda logger: logger.warning('%s is %.0f km away.', 'Japan', 10.4))
+
+    assert record.args == ('Japan', 10.4)
+    assert record.getMessage() == 'Japan is 10 km away.'
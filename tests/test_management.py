@@ -0,0 +1,83 @@
+"""Samples of pia monitor's tunnels read from an OpenVPN management interface"""
+import socket
+import threading
+
+from pia import monitor
+
+
+class ManagementServer(threading.Thread):
+    """Answers 'bytecount', 'state' and 'status' like the OpenVPN management interface"""
+
+    def __init__(self, path, state='CONNECTED'):
+        super().__init__(daemon=True)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(str(path))
+        self.listener.listen(1)
+        self.state = state
+        self.received = 0
+        self.bytecount = False
+
+    def reply(self, cmd):
+        if cmd.startswith('bytecount'):
+            return ['SUCCESS: bytecount interval changed']
+        if cmd == 'state':
+            return ['1700000000,%s,SUCCESS,10.1.2.3,198.51.100.1' % self.state, 'END']
+        if cmd == 'status':
+            return ['OpenVPN STATISTICS', 'TCP/UDP read bytes,%d' % self.received, 'TCP/UDP write bytes,10', 'END']
+        return ['ERROR: unknown command']
+
+    def run(self):
+        conn, _ = self.listener.accept()
+        with conn, conn.makefile('rw') as f:
+            for line in f:
+                lines = self.reply(line.strip())
+                if self.bytecount:
+                    lines.append('>BYTECOUNT:%d,10' % self.received)
+                f.write(''.join(line + '\r\n' for line in lines))
+                f.flush()
+
+    def close(self):
+        self.listener.close()
+
+
+def test_tunnel_samples_state_and_byte_counts(tmp_path):
+    path = tmp_path / 'pia-US_East.sock'
+    server = ManagementServer(path)
+    server.start()
+    tunnel = monitor.Tunnel('US_East', str(path), 4, 0.0)
+
+    try:
+        tunnel.connect(5)
+        server.received = 1000
+        tunnel.sample(5.0)
+        assert tunnel.state == 'CONNECTED'
+        assert list(tunnel.rx) == [1000]
+
+        server.received, server.bytecount = 3000, True
+        tunnel.sample(10.0)
+        tunnel.sample(15.0)
+        assert list(tunnel.rx) == [1000, 3000, 3000]
+        assert tunnel.throughput() == 200
+    finally:
+        tunnel.close()
+        server.close()
+
+
+def test_tunnel_which_receives_nothing_stalls(tmp_path):
+    path = tmp_path / 'pia-US_East.sock'
+    server = ManagementServer(path, state='RECONNECTING')
+    server.start()
+    tunnel = monitor.Tunnel('US_East', str(path), 4, 0.0)
+
+    try:
+        tunnel.connect(5)
+        for now in (5.0, 50.0, 100.0):
+            tunnel.sample(now)
+        assert tunnel.violation(100.0, 0, 90, 0) == 'not connected for 100s (RECONNECTING)'
+
+        server.state = 'CONNECTED'
+        tunnel.sample(105.0)
+        assert tunnel.violation(105.0, 0, 90, 0) == 'nothing received for 100s'
+    finally:
+        tunnel.close()
+        server.close()
@@ -0,0 +1,70 @@
+"""Failover of pia monitor when OpenVPN leaves its management socket behind"""
+import os
+import socket
+
+from pia import monitor
+
+
+def stale_socket(path):
+    """Leaves a socket file nothing listens on, like OpenVPN dying without cleaning up"""
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.bind(str(path))
+    s.close()
+
+
+def make_monitor(socket_dir, ranked):
+    options = dict(monitor_options(), socket_dir=str(socket_dir))
+    m = monitor.Monitor(ranked, options)
+    m.commands = []
+    m._run_command = lambda option, name: m.commands.append((option, name)) or True
+    return m
+
+
+def monitor_options():
+    return {'interval': '5', 'samples': '4', 'grace': '0', 'stall': '90', 'min_throughput': '0'}
+
+
+def test_stale_socket_fails_over_once(tmp_path):
+    stale_socket(tmp_path / 'pia-US_East.sock')
+    m = make_monitor(tmp_path, ['US_East', 'US_West', 'Japan'])
+
+    for now in (0.0, 5.0, 10.0, 200.0, 400.0):
+        m.scan(now)
+        m.check(now)
+
+    assert m.commands == [('stop_command', 'US_East'), ('start_command', 'US_West')]
+    assert 'US_East' not in m.tunnels
+    assert 'US_East' in m.failed
+
+
+def test_failed_profile_is_tracked_again_when_its_socket_is_recreated(tmp_path):
+    path = tmp_path / 'pia-US_East.sock'
+    stale_socket(path)
+    m = make_monitor(tmp_path, ['US_East', 'US_West'])
+    m.scan(0.0)
+    m.check(0.0)
+    assert 'US_East' in m.failed
+
+    os.remove(str(path))
+    m.scan(5.0)
+    assert 'US_East' not in m.failed
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(str(path))
+    listener.listen(1)
+    try:
+        m.scan(10.0)
+        assert 'US_East' in m.tunnels
+    finally:
+        listener.close()
+
+
+def test_failed_profile_is_not_picked_as_replacement(tmp_path):
+    stale_socket(tmp_path / 'pia-US_East.sock')
+    stale_socket(tmp_path / 'pia-US_West.sock')
+    m = make_monitor(tmp_path, ['US_East', 'US_West', 'Japan'])
+
+    m.scan(0.0)
+    m.check(0.0)
+
+    assert [name for option, name in m.commands if option == 'start_command'] == ['Japan']
@@ -0,0 +1,67 @@
+"""Name index for shell completion, rewritten when the host list changes"""
+import os
+
+import pytest
+
+import pia_complete
+from pia.conf import properties, settings
+
+
+@pytest.fixture
+def host_list(tmp_path, monkeypatch):
+    path = tmp_path / 'vpn-hosts.txt'
+    path.write_text('US East,us-east.example\nJapan,japan.example\n')
+    monkeypatch.setattr(settings, 'PIA_HOST_LIST', str(path))
+    monkeypatch.setattr(settings, 'PIA_HOST_CACHE', str(tmp_path / 'hosts.cache'))
+    monkeypatch.setattr(settings, 'PIA_NAME_INDEX', str(tmp_path / 'names.txt'))
+    monkeypatch.setattr(properties, '_hosts', None)
+    return path
+
+
+def index():
+    with open(settings.PIA_NAME_INDEX) as f:
+        return f.read().splitlines()
+
+
+def change(host_list, text, mtime=None):
+    """Rewrites the host list and forgets the loaded one, as a new pia process would"""
+    host_list.write_text(text)
+    if mtime is not None:
+        os.utime(str(host_list), ns=(mtime, mtime))
+    properties._hosts = None
+
+
+def test_index_is_written_with_the_host_list_size_and_mtime(host_list):
+    properties.update_name_index()
+    st = os.stat(str(host_list))
+
+    assert index() == ['# %d %d' % (st.st_size, st.st_mtime_ns), 'US_East', 'Japan']
+    assert pia_complete.complete("'us e", settings.PIA_NAME_INDEX) == ['US_East']
+
+
+def test_index_is_kept_while_the_host_list_is_unchanged(host_list):
+    properties.update_name_index()
+    written = os.stat(settings.PIA_NAME_INDEX).st_mtime_ns
+    os.utime(settings.PIA_NAME_INDEX, ns=(written - 10 ** 9, written - 10 ** 9))
+
+    properties.update_name_index()
+    assert os.stat(settings.PIA_NAME_INDEX).st_mtime_ns == written - 10 ** 9
+
+
+def test_index_is_rewritten_when_the_size_changes(host_list):
+    properties.update_name_index()
+    mtime = os.stat(str(host_list)).st_mtime_ns
+
+    change(host_list, 'US East,us-east.example\nJapan,japan.example\nSweden,sweden.example\n', mtime)
+    properties.update_name_index()
+    assert index()[1:] == ['US_East', 'Japan', 'Sweden']
+
+
+def test_index_is_rewritten_when_the_mtime_changes(host_list):
+    properties.update_name_index()
+    mtime = os.stat(str(host_list)).st_mtime_ns
+
+    # Same size, so only the modification time tells the lists apart
+    change(host_list, 'US West,us-west.example\nJapan,japan.example\n', mtime + 10 ** 9)
+    properties.update_name_index()
+    assert index()[1:] == ['US_West', 'Japan']
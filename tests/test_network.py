@@ -0,0 +1,101 @@
+"""Port probes for --auto-port against loopback listeners"""
+import socket
+import threading
+
+import pytest
+
+from pia.utils import network
+
+
+@pytest.fixture
+def tcp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        s.listen(8)
+        yield s.getsockname()[1]
+
+
+def free_port(kind):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class UDPServer(threading.Thread):
+    """Answers OpenVPN hard resets with 'reply', or nothing if it is None"""
+
+    def __init__(self, reply):
+        super().__init__(daemon=True)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        self.reply = reply
+        self.packets = []
+
+    def run(self):
+        try:
+            while True:
+                data, peer = self.sock.recvfrom(1500)
+                self.packets.append(data)
+                if self.reply is not None:
+                    self.sock.sendto(self.reply, peer)
+        except OSError:
+            pass
+
+
+@pytest.fixture
+def udp_server():
+    servers = []
+
+    def start(reply):
+        server = UDPServer(reply)
+        server.start()
+        servers.append(server)
+        return server
+    yield start
+
+    for server in servers:
+        server.sock.close()
+
+
+HARD_RESET_SERVER = bytes([network._HARD_RESET_SERVER]) + bytes(13)
+
+
+def test_tcp_probe_times_a_connect(tcp_port):
+    assert network.probe_tcp('127.0.0.1', tcp_port, 1.0) >= 0
+
+
+def test_tcp_probe_of_a_closed_port_fails():
+    assert network.probe_tcp('127.0.0.1', free_port(socket.SOCK_STREAM), 1.0) is None
+
+
+def test_udp_probe_sends_a_hard_reset(udp_server):
+    server = udp_server(HARD_RESET_SERVER)
+
+    assert network.probe_udp('127.0.0.1', server.port, 1.0) >= 0
+    assert server.packets[0][0] == network._HARD_RESET_CLIENT
+
+
+def test_udp_probe_ignores_other_replies(udp_server):
+    assert network.probe_udp('127.0.0.1', udp_server(b'\x00hello').port, 0.5) is None
+    assert network.probe_udp('127.0.0.1', udp_server(None).port, 0.2) is None
+
+
+def test_fastest_protocol_wins(tcp_port, udp_server):
+    udp = udp_server(HARD_RESET_SERVER).port
+    closed = free_port(socket.SOCK_STREAM)
+    ports = {tcp_port: 'tcp', closed: 'tcp', udp: 'udp'}
+
+    results = network.probe_ports(['127.0.0.1', '127.0.0.1'], ports, timeout=0.5)
+
+    assert len(results[tcp_port]) == 2 and len(results[udp]) == 2 and results[closed] == []
+    assert network.best_port(results, ports) in (tcp_port, udp)
+
+
+def test_port_of_the_configured_cipher_is_preferred():
+    protocols = {1198: 'udp', 1197: 'udp', 502: 'tcp'}
+    results = {1198: [0.02, 0.03], 1197: [0.05, 0.04], 502: [0.01]}
+
+    assert network.best_port(results, protocols) == 1198
+    assert network.best_port(results, protocols, order=[1197, 1198]) == 1197
+    assert network.best_port({p: [] for p in protocols}, protocols) is None
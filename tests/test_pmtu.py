@@ -0,0 +1,113 @@
+"""Path MTU discovery against UDP listeners on loopback"""
+import socket
+import threading
+import time
+
+import pytest
+
+from pia.applications import appstrategy, hooks, pmtu, wireguard
+from pia.conf import properties, settings
+from pia.utils import network
+
+SIZES = (1500, 1400, 1300)
+
+
+@pytest.fixture
+def udp_server():
+    """Starts a UDP listener on loopback which answers hard resets up to a given payload size"""
+    sockets = []
+
+    def start(largest=None, answer=True):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.bind(('127.0.0.1', 0))
+        s.settimeout(0.1)
+        sockets.append(s)
+
+        def serve():
+            while s.fileno() != -1:
+                try:
+                    data, peer = s.recvfrom(65535)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    return
+                if answer and (largest is None or len(data) <= largest):
+                    s.sendto(bytes([network._HARD_RESET_SERVER]) + bytes(13), peer)
+
+        threading.Thread(target=serve, daemon=True).start()
+        return s.getsockname()[1]
+
+    yield start
+
+    for s in sockets:
+        s.close()
+
+
+def test_answered_size_fits(udp_server):
+    port = udp_server()
+    assert network.probe_mtu('127.0.0.1', port, 0.5, SIZES) == 1472
+
+
+def test_refused_port_fits():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+
+    assert network.probe_mtu('127.0.0.1', port, 0.5, SIZES) == 1472
+
+
+def test_dropped_sizes_are_not_taken_as_fitting(udp_server):
+    # A router dropping large packets without an ICMP error
+    port = udp_server(largest=1372)
+    assert network.probe_mtu('127.0.0.1', port, 0.2, SIZES) == 1372
+
+
+def test_silent_endpoint_has_no_path_mtu(udp_server):
+    port = udp_server(answer=False)
+    assert network.probe_mtu('127.0.0.1', port, 0.1, SIZES) is None
+
+
+def test_tuning_fits_mssfix_for_openvpn_and_mtu_for_wireguard(monkeypatch):
+    monkeypatch.setitem(properties.props.mtu, 'discover', 'yes')
+    remote = properties.Remote('Local', 'local.example')
+    discovery = pmtu.PathMTUDiscovery('/nonexistent/mtu.json')
+    discovery._payloads = {'local.example': 1372}
+
+    openvpn = discovery.tuning(remote)
+    assert openvpn['mssfix'] == '1372'
+    assert openvpn.get('tun_mtu') == properties.props.tuning.get('tun_mtu')
+
+    assert discovery.tuning(remote, wireguard=True)['tun_mtu'] == str(1372 - pmtu.WIREGUARD_OVERHEAD)
+
+
+def test_discovered_mtu_is_rendered_into_each_strategy(udp_server, tmp_path, monkeypatch):
+    port = udp_server(largest=1372)
+    remote = properties.Remote('Local', 'local.example', v4='127.0.0.1')
+
+    monkeypatch.setattr(settings, 'PIA_CAPABILITIES', str(tmp_path / 'capabilities.json'))
+    monkeypatch.setattr(hooks, 'get_login_credentials', lambda login_config: ('user', 'pass'))
+    monkeypatch.setattr(network, 'network_id', lambda: None)
+    monkeypatch.setattr(properties.props, '_port', str(port))
+    monkeypatch.setattr(properties.props, 'tuning_preset', 'default')
+    monkeypatch.setitem(properties.props.mtu, 'discover', 'yes')
+    monkeypatch.setitem(properties.props.mtu, 'timeout', '0.1')
+    monkeypatch.setattr(pmtu, 'discovery', pmtu.PathMTUDiscovery(str(tmp_path / 'mtu.json')))
+
+    session = wireguard.WireGuardSession()
+    session._keypair = ('cHJpdmF0ZQ==', 'cHVibGlj')
+    session._peers = {remote.profile_key: {'pubkey': 'cHVibGlj', 'time': time.time(),
+                                           'data': {'peer_ip': '10.1.2.3', 'server_key': 'c2VydmVy',
+                                                    'server_ip': '10.0.0.1', 'server_port': 1337,
+                                                    'dns_servers': ['10.0.0.243']}}}
+    monkeypatch.setattr(wireguard, 'session', session)
+
+    pmtu.discovery.discover([remote])
+
+    # 1400 byte packets carry 1372 bytes of UDP payload
+    openvpn = appstrategy.get_app('openvpn').app.render(remote)[1].splitlines()
+    assert 'mssfix 1372' in openvpn
+    assert not [line for line in openvpn if line.startswith('tun-mtu')]
+
+    wg = appstrategy.get_app('wg').app.render(remote)[1].splitlines()
+    assert 'MTU = %d' % (1372 - pmtu.WIREGUARD_OVERHEAD) in wg
@@ -0,0 +1,208 @@
+"""pia forward against a local HTTP stand-in for the port forwarding API"""
+import asyncio
+import base64
+import json
+import shutil
+import ssl
+import subprocess
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from pia import portforward
+from pia.applications import wireguard
+from pia.conf import properties, settings
+
+
+class Stop(Exception):
+    """Ends Forwarder.keep() where it would sleep until the next bind"""
+    pass
+
+
+class Gateway(HTTPServer):
+    """Answers token, getSignature and bindPort requests with the answers set in 'answers'
+
+    With a certificate, requests are answered over HTTPS for the host name 'localhost'.
+    """
+
+    def __init__(self, cert=None):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.requests = []
+        self.answers = {}
+        self.delay = {}
+        self.scheme = 'http'
+
+        if cert:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(*cert)
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+            self.scheme = 'https'
+
+    @property
+    def url(self):
+        host = 'localhost' if self.scheme == 'https' else '127.0.0.1'
+        return '%s://%s:%d' % (self.scheme, host, self.server_address[1])
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        method = url.path.strip('/')
+        self.server.requests.append((method, urllib.parse.parse_qs(url.query)))
+        time.sleep(self.server.delay.get(method, 0))
+
+        body = json.dumps(self.server.answers[method]).encode()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def payload(port, expires='2099-01-01T00:00:00.000000000Z'):
+    return base64.b64encode(json.dumps({'port': port, 'expires_at': expires}).encode()).decode()
+
+
+def start(server):
+    server.answers = {'token': {'status': 'OK', 'token': 'tok'},
+                      'getSignature': {'status': 'OK', 'payload': payload(40000), 'signature': 'sig'},
+                      'bindPort': {'status': 'OK'}}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def certificate(path, name):
+    """Creates a self-signed certificate for a host name and returns the paths of it and its key"""
+    if not shutil.which('openssl'):
+        pytest.skip('openssl is not installed')
+    cert, key = str(path / (name + '.crt')), str(path / (name + '.key'))
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-keyout', key,
+                    '-out', cert, '-subj', '/CN=' + name, '-addext', 'subjectAltName=DNS:' + name],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return cert, key
+
+
+@pytest.fixture
+def gateway():
+    server = start(Gateway())
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def forwarder(gateway, tmp_path, monkeypatch):
+    session = wireguard.WireGuardSession()
+    monkeypatch.setattr(wireguard, 'session', session)
+    monkeypatch.setattr(wireguard, 'read_login_credentials', lambda login_config: ('user', 'pass'))
+    monkeypatch.setitem(properties.props.wireguard, 'token_url', gateway.url + '/token')
+    monkeypatch.setitem(properties.props.wireguard, 'ca', '')
+    monkeypatch.setattr(settings, 'PIA_PORT_FORWARD', str(tmp_path / 'portforward.json'))
+
+    async def stop(delay):
+        raise Stop()
+    monkeypatch.setattr(portforward.asyncio, 'sleep', stop)
+
+    options = dict(properties.props.port_forward, url=gateway.url, port_dir=str(tmp_path / 'ports'),
+                   timeout='0.5')
+    return portforward.Forwarder([], options, str(tmp_path))
+
+
+def keep_once(forwarder):
+    remote = properties.Remote('US East', 'us-east.example')
+    with pytest.raises(Stop):
+        asyncio.run(forwarder.keep('openvpn/US_East', remote, lambda: '127.0.0.1'))
+
+
+def test_port_is_requested_bound_and_published(forwarder, gateway, tmp_path):
+    keep_once(forwarder)
+
+    assert [m for m, q in gateway.requests] == ['token', 'getSignature', 'bindPort']
+    assert forwarder.state['openvpn/US_East']['port'] == 40000
+    assert (tmp_path / 'ports' / 'openvpn' / 'US_East').read_text() == '40000\n'
+
+
+def test_timed_out_bind_keeps_the_signature(forwarder, gateway):
+    keep_once(forwarder)
+    gateway.delay['bindPort'] = 1
+
+    keep_once(forwarder)
+    assert 'openvpn/US_East' in forwarder.state
+
+
+def test_rejected_bind_drops_the_signature(forwarder, gateway):
+    keep_once(forwarder)
+    gateway.answers['bindPort'] = {'status': 'ERROR', 'message': 'unknown signature'}
+
+    keep_once(forwarder)
+    assert 'openvpn/US_East' not in forwarder.state
+
+
+def test_answer_without_signature_does_not_end_the_task(forwarder, gateway):
+    gateway.answers['getSignature'] = {'status': 'OK'}
+
+    keep_once(forwarder)
+    assert 'openvpn/US_East' not in forwarder.state
+
+
+def test_rejected_signature_request_gets_a_new_token(forwarder, gateway):
+    gateway.answers['getSignature'] = {'status': 'ERROR', 'message': 'invalid token'}
+    keep_once(forwarder)
+    gateway.answers['getSignature'] = {'status': 'OK', 'payload': payload(40001), 'signature': 'sig'}
+    keep_once(forwarder)
+
+    assert [m for m, q in gateway.requests] == ['token', 'getSignature', 'token', 'getSignature', 'bindPort']
+
+
+def test_token_is_requested_again_after_its_ttl(forwarder, gateway, monkeypatch):
+    assert wireguard.session.token() == 'tok'
+    assert wireguard.session.token() == 'tok'
+    monkeypatch.setitem(properties.props.wireguard, 'token_ttl', '0')
+    wireguard.session.token()
+
+    assert [m for m, q in gateway.requests] == ['token', 'token']
+
+
+@pytest.fixture
+def tls_gateway(tmp_path, monkeypatch):
+    """Gateway over HTTPS whose certificate is trusted by the system but is not the PIA CA"""
+    cert = certificate(tmp_path, 'localhost')
+    monkeypatch.setenv('SSL_CERT_FILE', cert[0])
+    monkeypatch.setitem(properties.props.wireguard, 'ca', certificate(tmp_path, 'pia-ca')[0])
+
+    server = start(Gateway(cert))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def session(monkeypatch):
+    s = wireguard.WireGuardSession()
+    monkeypatch.setattr(wireguard, 'session', s)
+    monkeypatch.setattr(wireguard, 'read_login_credentials', lambda login_config: ('user', 'pass'))
+    return s
+
+
+def test_token_is_requested_with_the_system_certificate_authorities(tls_gateway, session, monkeypatch):
+    monkeypatch.setitem(properties.props.wireguard, 'token_url', tls_gateway.url + '/token')
+
+    assert session.token() == 'tok'
+    assert tls_gateway.requests[0][0] == 'token'
+
+
+def test_token_url_must_match_its_certificate(tls_gateway, session, monkeypatch):
+    monkeypatch.setitem(properties.props.wireguard, 'token_url', tls_gateway.url.replace('localhost', '127.0.0.1'))
+
+    with pytest.raises(wireguard.KeyExchangeError):
+        session.token()
+    assert tls_gateway.requests == []
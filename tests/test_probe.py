@@ -0,0 +1,81 @@
+"""OpenVPN features probed from stand-in openvpn binaries"""
+import json
+import os
+
+import pytest
+
+from pia.applications import probe
+from pia.conf import settings
+
+BANNERS = {
+    '2.4': 'OpenVPN 2.4.12 x86_64-pc-linux-gnu [SSL (OpenSSL)] [LZO] [LZ4] [EPOLL] [MH/PKTINFO] [AEAD]',
+    '2.5': 'OpenVPN 2.5.9 x86_64-pc-linux-gnu [SSL (OpenSSL)] [LZO] [LZ4] [EPOLL] [MH/PKTINFO] [AEAD]',
+    'dco': 'OpenVPN 2.6.8 x86_64-pc-linux-gnu [SSL (OpenSSL)] [LZO] [LZ4] [EPOLL] [MH/PKTINFO] [AEAD] [DCO]',
+}
+
+
+@pytest.fixture
+def openvpn(tmp_path, monkeypatch):
+    """Stand-in openvpn which prints 'output' and exits with 'status', both files next to it"""
+    monkeypatch.setattr(settings, 'PIA_CAPABILITIES', str(tmp_path / 'capabilities.json'))
+    binary = tmp_path / 'openvpn'
+    binary.write_text('#!/bin/sh\ncat "$(dirname "$0")/output"\nexit "$(cat "$(dirname "$0")/status")"\n')
+    binary.chmod(0o755)
+    return binary
+
+
+def answer(binary, output, status):
+    (binary.parent / 'output').write_text(output + '\n')
+    (binary.parent / 'status').write_text(str(status))
+
+
+@pytest.mark.parametrize('banner, status, expected', [
+    ('2.4', 1, {'version': (2, 4, 12), 'aead': False, 'dco': False}),
+    ('2.5', 1, {'version': (2, 5, 9), 'aead': True, 'dco': False}),
+    ('dco', 0, {'version': (2, 6, 8), 'aead': True, 'dco': True}),
+])
+def test_features_follow_the_version(openvpn, monkeypatch, banner, status, expected):
+    monkeypatch.setattr(probe, 'kernel_module_available', lambda names: True)
+    answer(openvpn, BANNERS[banner], status)
+
+    assert probe.probe_openvpn(str(openvpn)) == expected
+
+
+def test_offload_needs_the_kernel_module(openvpn, monkeypatch):
+    monkeypatch.setattr(probe, 'kernel_module_available', lambda names: False)
+    answer(openvpn, BANNERS['dco'], 0)
+
+    assert not probe.probe_openvpn(str(openvpn))['dco']
+
+
+def test_version_is_cached_until_the_binary_changes(openvpn):
+    answer(openvpn, BANNERS['2.5'], 1)
+    probe.probe_openvpn(str(openvpn))
+    answer(openvpn, BANNERS['2.4'], 1)
+
+    assert probe.probe_openvpn(str(openvpn))['version'] == (2, 5, 9)
+
+
+def test_failures_are_not_cached(openvpn):
+    answer(openvpn, 'error while loading shared libraries: libssl.so.3', 127)
+    assert probe.probe_openvpn(str(openvpn))['version'] is None
+    assert not os.path.exists(settings.PIA_CAPABILITIES)
+
+    answer(openvpn, BANNERS['2.5'], 1)
+    assert probe.probe_openvpn(str(openvpn))['version'] == (2, 5, 9)
+    with open(settings.PIA_CAPABILITIES) as f:
+        assert list(json.load(f)) == ['%s --version' % openvpn]
+
+
+def test_loaded_or_installed_modules_are_found(tmp_path):
+    sys_module = tmp_path / 'sys'
+    modules = tmp_path / 'modules' / os.uname().release
+    sys_module.mkdir()
+    modules.mkdir(parents=True)
+    (modules / 'modules.dep').write_text('kernel/drivers/net/ovpn-dco-v2.ko.xz: kernel/net/udp_tunnel.ko\n')
+
+    assert probe.kernel_module_available(['ovpn_dco_v2'], str(tmp_path / 'modules'), str(sys_module))
+    assert not probe.kernel_module_available(['ovpn'], str(tmp_path / 'modules'), str(sys_module))
+
+    (sys_module / 'ovpn').mkdir()
+    assert probe.kernel_module_available(['ovpn'], str(tmp_path / 'modules'), str(sys_module))
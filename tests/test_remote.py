@@ -0,0 +1,57 @@
+"""Hosts whose names contain underscores, as Remote names, file names and pia -l rows"""
+import argparse
+
+import pytest
+
+from pia import run
+from pia.applications import appstrategy
+from pia.conf import manifest, properties, settings
+
+HOSTS = [('UK_London', 'uk-london.example', 'GB', None, None, 'UK_London', None, None),
+         ('US East', 'us-east.example', 'US', None, None, 'US_East', None, None)]
+
+
+def test_stem_and_path_of_a_name_with_underscores():
+    remote = properties.Remote('UK_London', 'uk-london.example')
+    app = appstrategy.get_app('openvpn').app
+
+    assert (remote.name, remote.stem) == ('UK_London', 'UK_London')
+    assert properties.Remote('US East', 'us-east.example').stem == 'US_East'
+    assert remote.path(app) == app.conf_dir + '/UK_London.conf'
+    assert remote.path(app) is remote.path(app)
+
+
+@pytest.fixture
+def installed(tmp_path, monkeypatch):
+    """Root filesystem with the OpenVPN configuration of every host written"""
+    monkeypatch.setattr(settings, 'PIA_ROOT', str(tmp_path))
+    monkeypatch.setattr(settings, 'PIA_CAPABILITIES', str(tmp_path / 'capabilities.json'))
+    monkeypatch.setattr(settings, 'PIA_ACCOUNTS_DIR', str(tmp_path / 'accounts'))
+    monkeypatch.setattr(properties, '_hosts', tuple(HOSTS))
+    monkeypatch.setattr(properties.props, '_conf_file', str(tmp_path / 'pia.conf'))
+    monkeypatch.setattr(properties.props, '_accounts', [])
+    monkeypatch.setattr(appstrategy, 'manifest', manifest.Manifest(str(tmp_path / 'manifest.json')))
+    (tmp_path / 'etc').mkdir()
+    (tmp_path / 'etc' / 'passwd').write_text('root:x:0:0:root:/root:/bin/sh\n')
+    (tmp_path / 'etc' / 'group').write_text('network:x:90:\n')
+
+    app = appstrategy.get_app('openvpn')
+    for remote in properties.iter_hosts():
+        conf, text = app.app.render(remote)
+        app.commit(conf, text, remote)
+    return app
+
+
+def test_installed_configurations_keep_their_display_names(installed):
+    assert installed.installed_configs() == {'UK_London', 'US East'}
+
+
+def test_list_shows_hosts_with_underscores_as_installed(installed, monkeypatch, capsys):
+    monkeypatch.setattr(properties.props, 'commandline', argparse.Namespace(
+        format='tsv', strategy='openvpn', match=None, country=None, installed_only=True), raising=False)
+
+    with pytest.raises(SystemExit):
+        run.list_configurations()
+
+    assert capsys.readouterr().out.splitlines()[1:] == ['UK_London\tuk-london.example\tGB\t1',
+                                                       'US East\tus-east.example\tUS\t1']
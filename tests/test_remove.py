@@ -0,0 +1,47 @@
+"""pia -r with files generated before and after the manifest was introduced"""
+import os
+
+import pytest
+
+from pia.applications import appstrategy
+from pia.conf import manifest, properties, settings
+
+HOSTS = [('US East', 'us-east.example', None, None, None, 'US_East', None, None),
+         ('Japan', 'japan.example', None, None, None, 'Japan', None, None)]
+
+
+@pytest.fixture
+def conf_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'PIA_ROOT', str(tmp_path))
+    monkeypatch.setattr(properties, '_hosts', list(HOSTS))
+    monkeypatch.setattr(appstrategy, 'manifest', manifest.Manifest(str(tmp_path / 'manifest.json')))
+
+    conf_dir = appstrategy.get_app('openvpn').app.conf_dir
+    (tmp_path / conf_dir.lstrip('/')).mkdir(parents=True)
+    for name in ('US_East.conf', 'Japan.conf', 'notes.txt'):
+        (tmp_path / conf_dir.lstrip('/') / name).write_text('client\n')
+
+    record(conf_dir + '/US_East.conf', 'openvpn')
+    return conf_dir
+
+
+def record(path, strategy):
+    appstrategy.manifest.record(path, strategy, 'US East', '1198', 'client\n', 'abc')
+
+
+def remaining(conf_dir):
+    return sorted(os.listdir(settings.PIA_ROOT + conf_dir))
+
+
+def test_files_from_before_the_manifest_are_removed_too(conf_dir):
+    appstrategy.get_app('openvpn').remove_configs()
+
+    assert remaining(conf_dir) == ['notes.txt']
+    assert appstrategy.manifest.entries == {}
+
+
+def test_files_tracked_for_other_strategies_are_kept(conf_dir):
+    record(conf_dir + '/Japan.conf', 'nm')
+    appstrategy.get_app('openvpn').remove_configs()
+
+    assert remaining(conf_dir) == ['Japan.conf', 'notes.txt']
@@ -0,0 +1,43 @@
+"""Configuring another root filesystem with --root"""
+import pytest
+
+from pia.applications import appstrategy
+from pia.conf import manifest, properties, settings
+
+US_EAST = properties.Remote('US East', 'us-east.example')
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    root = tmp_path / 'root'
+    root.mkdir()
+    monkeypatch.setattr(settings, 'PIA_ROOT', str(root))
+    monkeypatch.setattr(settings, 'PIA_CAPABILITIES', str(tmp_path / 'capabilities.json'))
+    return root
+
+
+def install_openvpn(root, version):
+    """Installs a stand-in for openvpn which prints the version banner"""
+    (root / 'usr' / 'bin').mkdir(parents=True)
+    binary = root / 'usr' / 'bin' / 'openvpn'
+    binary.write_text('#!/bin/sh\necho "OpenVPN %s x86_64-pc-linux-gnu [SSL (OpenSSL)]"\nexit 1\n' % version)
+    binary.chmod(0o755)
+
+
+def test_openvpn_of_the_root_is_probed(root):
+    install_openvpn(root, '2.4.12')
+    assert appstrategy.get_app('openvpn').app.probe() == {'version': (2, 4, 12), 'aead': False, 'dco': False}
+
+
+def test_offload_is_left_out_for_another_root(root):
+    install_openvpn(root, '2.6.8')
+    assert appstrategy.get_app('openvpn').app.probe() == {'version': (2, 6, 8), 'aead': True, 'dco': False}
+
+
+def test_configuration_directory_is_created_in_a_fresh_root(root, monkeypatch):
+    monkeypatch.setattr(appstrategy, 'manifest', manifest.Manifest(str(root / 'manifest.json')))
+    app = appstrategy.get_app('openvpn')
+    conf = app.app.conf_path(US_EAST)
+
+    assert app.commit(conf, 'client\n', US_EAST)
+    assert (root / conf.lstrip('/')).read_text() == 'client\n'
@@ -0,0 +1,64 @@
+"""Split tunnel routes collapsed like ipaddress.collapse_addresses"""
+import ipaddress
+import random
+import time
+
+import pytest
+
+from pia.utils import routes
+
+
+def random_prefixes(rng, base, bits, shortest, count):
+    """Prefixes crowded into a small part of the address space, so many overlap or are adjacent"""
+    span = count << 4
+    prefixes = []
+    for _ in range(count):
+        # Mostly long prefixes, with a few short ones swallowing others
+        length = max(shortest, bits - int(rng.expovariate(0.4)))
+        address = base + rng.randrange(span)
+        prefixes.append(str(ipaddress.ip_network((address, length), strict=False)))
+    return prefixes
+
+
+def expected(prefixes):
+    networks = [ipaddress.ip_network(p, strict=False) for p in prefixes]
+    return [(n.version, str(n.network_address), n.prefixlen)
+            for version in (4, 6)
+            for n in ipaddress.collapse_addresses(n for n in networks if n.version == version)]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_prefixes_collapse_like_ipaddress(seed):
+    rng = random.Random(seed)
+    prefixes = (random_prefixes(rng, int(ipaddress.IPv4Address('10.0.0.0')), 32, 22, 5000) +
+                random_prefixes(rng, int(ipaddress.IPv6Address('2001:db8::')), 128, 120, 5000))
+    rng.shuffle(prefixes)
+
+    assert [tuple(r) for r in routes.aggregate(prefixes)] == expected(prefixes)
+
+
+def test_adjacent_nested_and_overlapping_prefixes():
+    prefixes = ['10.0.0.0/25', '10.0.0.128/25', '10.0.1.0/24', '10.0.0.64/26', '10.0.3.0/24', '10.0.2.128/25',
+                '192.0.2.1', '2001:db8::/65', '2001:db8:0:0:8000::/65', '2001:db8::1/128']
+
+    assert [tuple(r) for r in routes.aggregate(prefixes)] == expected(prefixes)
+    assert [tuple(r) for r in routes.aggregate(prefixes)] == [
+        (4, '10.0.0.0', 23), (4, '10.0.2.128', 25), (4, '10.0.3.0', 24), (4, '192.0.2.1', 32),
+        (6, '2001:db8::', 64)]
+
+
+def test_aggregate_is_faster_than_ipaddress():
+    rng = random.Random(0)
+    prefixes = (random_prefixes(rng, int(ipaddress.IPv4Address('10.0.0.0')), 32, 22, 20000) +
+                random_prefixes(rng, int(ipaddress.IPv6Address('2001:db8::')), 128, 120, 20000))
+
+    started = time.perf_counter()
+    routes.aggregate(prefixes)
+    aggregate = time.perf_counter() - started
+
+    started = time.perf_counter()
+    expected(prefixes)
+    collapse = time.perf_counter() - started
+
+    # About ten times faster, with a margin for noisy machines
+    assert aggregate * 3 < collapse
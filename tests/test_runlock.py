@@ -0,0 +1,46 @@
+"""Runs which wait for an identical one and reuse its result"""
+import argparse
+import os
+
+import pytest
+
+from pia import run
+from pia.conf import properties, settings
+
+
+@pytest.fixture
+def inputs(tmp_path, monkeypatch):
+    """Root filesystem with a route list and an accounts directory"""
+    monkeypatch.setattr(settings, 'PIA_ROOT', str(tmp_path))
+    monkeypatch.setattr(settings, 'PIA_ACCOUNTS_DIR', str(tmp_path / 'accounts'))
+    monkeypatch.setitem(properties.props.routes, 'file', str(tmp_path / 'routes.txt'))
+    monkeypatch.setattr(properties.props, 'commandline', argparse.Namespace(debug=False), raising=False)
+    monkeypatch.setattr(properties.props, '_accounts', [])
+    (tmp_path / 'accounts').mkdir()
+    return tmp_path
+
+
+def test_route_list_is_an_input(inputs):
+    key = run.run_key()
+    (inputs / 'routes.txt').write_text('10.0.0.0/8\n')
+
+    assert run.run_key() != key
+
+
+def test_account_files_are_inputs_even_when_they_cannot_be_read(inputs):
+    key = run.run_key()
+    (inputs / 'accounts' / 'work.conf').write_text('only-a-user\n')
+
+    assert run.run_key() != key
+
+
+def test_verify_does_not_record_the_run(inputs, monkeypatch):
+    monkeypatch.setattr(run, 'verify', lambda: None)
+    monkeypatch.setattr(run, 'auto_configure', lambda: None)
+    state = os.path.join(str(inputs), settings.PIA_RUN_STATE.lstrip('/'))
+
+    run.run_actions(['verify'])
+    assert not os.path.exists(state)
+
+    run.run_actions(['auto_configure'])
+    assert os.path.exists(state)
@@ -0,0 +1,69 @@
+"""Tuning presets and overrides rendered into each strategy's configuration"""
+import time
+
+import pytest
+
+from pia.applications import appstrategy, hooks, wireguard
+from pia.conf import properties, settings
+
+US_EAST = properties.Remote('US East', 'us-east.example')
+PEER = {'peer_ip': '10.1.2.3', 'server_key': 'c2VydmVy', 'server_ip': '10.0.0.1', 'server_port': 1337,
+        'dns_servers': ['10.0.0.243']}
+
+STRATEGIES = ['openvpn', 'nm', 'cm', 'wg', 'nmwg']
+
+
+@pytest.fixture(autouse=True)
+def environment(tmp_path, monkeypatch):
+    """Same credentials, OpenVPN features and WireGuard peer data for every render"""
+    monkeypatch.setattr(settings, 'PIA_CAPABILITIES', str(tmp_path / 'capabilities.json'))
+    monkeypatch.setattr(hooks, 'get_login_credentials', lambda login_config: ('user', 'pass'))
+    monkeypatch.setattr(properties.props, 'tuning_preset', 'default')
+
+    session = wireguard.WireGuardSession()
+    session._keypair = ('cHJpdmF0ZQ==', 'cHVibGlj')
+    session._peers = {US_EAST.profile_key: {'pubkey': 'cHVibGlj', 'time': time.time(), 'data': PEER}}
+    monkeypatch.setattr(wireguard, 'session', session)
+
+
+def render(strategy):
+    return appstrategy.get_app(strategy).app.render(US_EAST)[1]
+
+
+@pytest.mark.parametrize('strategy', STRATEGIES)
+def test_default_preset_renders_the_template_without_tuning(strategy, monkeypatch):
+    """Files rendered with the default preset are the same as before tuning was added"""
+    app = appstrategy.get_app(strategy).app
+    text = render(strategy)
+
+    monkeypatch.setattr(app, '_CONFIG_TEMPLATE', app.config_template.replace('##tuning##\n', ''))
+    assert text == render(strategy)
+
+
+@pytest.mark.parametrize('strategy, lines', [
+    ('openvpn', ['sndbuf 524288', 'rcvbuf 524288', 'tun-mtu 1400', 'mssfix 1300', 'txqueuelen 1000',
+                 'ping 5', 'ping-restart 30']),
+    ('nm', ['tunnel-mtu=1400', 'mssfix=1300', 'ping=5', 'ping-restart=30']),
+    ('cm', ['OpenVPN.MTU = 1400']),
+    ('wg', ['MTU = 1400']),
+    ('nmwg', ['mtu=1400']),
+])
+def test_overrides_are_rendered_with_the_names_of_each_strategy(strategy, lines):
+    properties.props.tuning_preset = 'lossy-link'
+    properties.props.tuning.update(sndbuf='524288', rcvbuf='524288', txqueuelen='1000')
+    text = render(strategy).splitlines()
+
+    assert [line for line in text if line in lines] == lines
+    # Settings a strategy does not support are left out
+    assert len(text) == len(render_default(strategy)) + len(lines)
+
+
+def render_default(strategy):
+    properties.props.tuning_preset = 'default'
+    return render(strategy).splitlines()
+
+
+def test_unknown_preset_falls_back_to_the_default():
+    properties.props.tuning_preset = 'warp-speed'
+    assert properties.props.tuning_preset == 'default'
+    assert properties.props.tuning == {}
@@ -0,0 +1,83 @@
+"""pia --verify and --repair against configurations changed on disk"""
+import argparse
+import os
+
+import pytest
+
+from pia import run
+from pia.applications import appstrategy
+from pia.conf import manifest, properties, settings
+
+HOSTS = [('US East', 'us-east.example', None, None, None, 'US_East', None, None),
+         ('Japan', 'japan.example', None, None, None, 'Japan', None, None),
+         ('Sweden', 'sweden.example', None, None, None, 'Sweden', None, None)]
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    """Root filesystem with the OpenVPN configuration of every host written"""
+    monkeypatch.setattr(settings, 'PIA_ROOT', str(tmp_path))
+    monkeypatch.setattr(settings, 'PIA_CAPABILITIES', str(tmp_path / 'capabilities.json'))
+    monkeypatch.setattr(properties, '_hosts', tuple(HOSTS))
+    monkeypatch.setattr(properties.props, '_accounts', [])
+    monkeypatch.setattr(properties.props, 'commandline', argparse.Namespace(repair=False), raising=False)
+    monkeypatch.setattr(run, 'selected_hosts', properties.iter_hosts)
+
+    m = manifest.Manifest(str(tmp_path / 'manifest.json'))
+    monkeypatch.setattr(appstrategy, 'manifest', m)
+    monkeypatch.setattr(run, 'manifest', m)
+
+    for name in appstrategy.get_supported_apps():
+        monkeypatch.setattr(appstrategy.get_app(name), 'configure', name == 'openvpn')
+
+    (tmp_path / 'etc').mkdir()
+    (tmp_path / 'etc' / 'passwd').write_text('root:x:0:0:root:/root:/bin/sh\n')
+    (tmp_path / 'etc' / 'group').write_text('root:x:0:\nnetwork:x:90:\n')
+
+    app = appstrategy.get_app('openvpn')
+    paths = {}
+    for remote in properties.iter_hosts():
+        conf, text = app.app.render(remote)
+        app.commit(conf, text, remote)
+        paths[remote.stem] = tmp_path / conf.lstrip('/')
+    return paths
+
+
+def verify(capsys):
+    """Runs pia --verify and returns its exit status and the files it reported"""
+    try:
+        run.verify()
+        status = 0
+    except SystemExit as e:
+        status = e.code
+    return status, capsys.readouterr().out.splitlines()
+
+
+def test_clean_configurations_pass(files, capsys):
+    assert verify(capsys) == (0, [])
+
+
+def test_content_mode_and_owner_drift_are_reported(files, capsys):
+    files['US_East'].write_text('client\n')
+    files['Japan'].chmod(0o644)
+    os.chown(str(files['Sweden']), 0, 0)
+
+    status, lines = verify(capsys)
+
+    assert status == 1
+    assert lines == ['  openvpn: %s (content)' % files['US_East'],
+                     '  openvpn: %s (mode)' % files['Japan'],
+                     '  openvpn: %s (owner)' % files['Sweden']]
+
+
+def test_repair_rewrites_only_drifted_files(files, capsys):
+    files['US_East'].write_text('client\n')
+    clean = {stem: os.stat(str(path)).st_ino for stem, path in files.items() if stem != 'US_East'}
+    properties.props.commandline.repair = True
+
+    status, lines = verify(capsys)
+    assert status == 0 and len(lines) == 1
+    assert {stem: os.stat(str(files[stem])).st_ino for stem in clean} == clean
+
+    properties.props.commandline.repair = False
+    assert verify(capsys) == (0, [])
@@ -0,0 +1,150 @@
+"""WireGuard profiles rendered from cached peer data"""
+import time
+
+import pytest
+
+from pia.applications import appstrategy, wireguard
+from pia.conf import properties, settings
+
+PEER = {'peer_ip': '10.1.2.3', 'server_key': 'c2VydmVy', 'server_ip': '10.0.0.1', 'server_port': 1337,
+        'dns_servers': ['10.0.0.243', '10.0.0.242']}
+
+
+@pytest.fixture
+def session(monkeypatch):
+    """Replaces the shared session with one which has a key pair and no peer data"""
+    s = wireguard.WireGuardSession()
+    s._keypair = ('cHJpdmF0ZQ==', 'cHVibGlj')
+    s._peers = {}
+    s.save = lambda: None
+    monkeypatch.setattr(wireguard, 'session', s)
+    return s
+
+
+def cache(session, remote, data, age=0):
+    session.peers[remote.profile_key] = {'pubkey': session.keypair[1], 'time': time.time() - age, 'data': data}
+
+
+def refuse_exchange(*args):
+    raise AssertionError('keys were exchanged')
+
+
+def test_cached_only_renders_expired_peer_data_without_exchanging_keys(session, monkeypatch):
+    remote = properties.Remote('US East', 'us-east.example')
+    cache(session, remote, PEER, age=float(session.options['ttl']) + 60)
+    monkeypatch.setattr(session, '_add_key', refuse_exchange)
+    session.cached_only = True
+
+    app = appstrategy.get_app('wg').app
+    conf, text = app.render(remote)
+
+    assert 'Address = 10.1.2.3' in text
+    assert session.report_stale(app, [remote], []) == [(remote, conf, text, ['stale'])]
+
+
+def test_cached_only_fails_without_peer_data(session):
+    session.cached_only = True
+    with pytest.raises(wireguard.KeyExchangeError):
+        session.peer(properties.Remote('Japan', 'japan.example'))
+
+
+def test_fresh_peer_data_is_not_stale(session):
+    remote = properties.Remote('US East', 'us-east.example')
+    cache(session, remote, PEER)
+    session.cached_only = True
+
+    assert session.report_stale(appstrategy.get_app('wg').app, [remote], []) == []
+
+
+def test_missing_dns_servers_leave_no_dns_line(session):
+    remote = properties.Remote('US East', 'us-east.example')
+    cache(session, remote, dict(PEER, dns_servers=[]))
+
+    conf, text = appstrategy.get_app('wg').app.render(remote)
+    assert 'DNS' not in text
+
+
+def test_networkmanager_profiles_get_their_own_interface(session):
+    names = set()
+    for remote in (properties.Remote('US East', 'us-east.example'), properties.Remote('US West', 'us-west.example'),
+                   properties.Remote('Australia Melbourne', 'aus-melbourne.example')):
+        cache(session, remote, PEER)
+        conf, text = appstrategy.get_app('nmwg').app.render(remote)
+        names.add(next(line for line in text.splitlines() if line.startswith('interface-name=')))
+
+    assert len(names) == 3
+    assert all(len(n.split('=', 1)[1]) <= 15 for n in names)
+
+
+def test_missing_ca_fails_the_exchange_instead_of_the_run(session, monkeypatch):
+    monkeypatch.setitem(properties.props.wireguard, 'ca', '/nonexistent/ca.crt')
+    remote = properties.Remote('US East', 'us-east.example')
+
+    session.prefetch([remote])
+    with pytest.raises(wireguard.KeyExchangeError):
+        session.peer(remote)
+
+
+def test_partial_add_key_answer_is_a_key_exchange_error(session, monkeypatch):
+    monkeypatch.setattr(wireguard, 'request_json', lambda *args: {'status': 'OK', 'peer_ip': '10.1.2.3'})
+
+    with pytest.raises(wireguard.KeyExchangeError, match='server_key'):
+        session._add_key(properties.Remote('US East', 'us-east.example'), 'tok', None)
+
+
+def test_failed_token_is_not_requested_again_for_each_region(session, monkeypatch):
+    requests = []
+
+    def token(login_config):
+        requests.append(login_config)
+        raise wireguard.KeyExchangeError('timed out')
+    monkeypatch.setattr(session, 'token', token)
+    monkeypatch.setattr(session, 'context', lambda: None)
+    remotes = [properties.Remote('US East', 'us-east.example'), properties.Remote('Japan', 'japan.example')]
+
+    session.prefetch(remotes)
+    for remote in remotes:
+        with pytest.raises(wireguard.KeyExchangeError, match='timed out'):
+            session.peer(remote)
+
+    assert len(requests) == 1
+
+
+class Configure(object):
+    """[configure] section of pia.conf"""
+
+    def __init__(self, apps):
+        self.apps = apps
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    """Root filesystem with NetworkManager and the WireGuard tools installed"""
+    monkeypatch.setattr(settings, 'PIA_ROOT', str(tmp_path))
+    monkeypatch.setattr(properties.props, 'conf_section', {})
+    (tmp_path / 'usr' / 'bin').mkdir(parents=True)
+    for name in ('nmcli', 'wg', 'wg-quick'):
+        (tmp_path / 'usr' / 'bin' / name).touch()
+
+    configured = {a: appstrategy.get_app(a).configure for a in appstrategy.get_supported_apps()}
+    yield tmp_path
+    for a, configure in configured.items():
+        appstrategy.get_app(a).configure = configure
+
+
+def test_networkmanager_wireguard_is_only_configured_when_named(root):
+    properties.select_apps()
+    assert appstrategy.get_app('wg').configure
+    assert not appstrategy.get_app('nmwg').configure
+
+    properties.props.conf_section['configure'] = Configure(['nmwg'])
+    properties.select_apps()
+    assert appstrategy.get_app('nmwg').configure
+
+
+def test_networkmanager_wireguard_needs_the_wireguard_tools(root):
+    (root / 'usr' / 'bin' / 'wg').unlink()
+    properties.props.conf_section['configure'] = Configure(['nmwg'])
+
+    properties.select_apps()
+    assert not appstrategy.get_app('nmwg').configure